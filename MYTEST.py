@@ -1,13 +1,384 @@
+import contextlib
+import decimal
+import glob
+import hashlib
+import json
 import logging
 import os
 import sys
+import threading
+import time
+import uuid
 import pandas as pd
+import re
+import numpy
+import pyarrow
+import pyarrow.compute
+import pyarrow.ipc
+import pyarrow.parquet
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 
 
 # -- (> ---------------------- SECTION=import_connectors ---------------------
 import snowflake.connector
 # from snowflake.connector import DictCursor
+import load_metrics
+import csv_splitter
+import MultiThreadBulkLoad_V1 as loader
+# -- <) ---------------------------- END_SECTION ----------------------------
+
+
+# -- (> ---------------------- SECTION=load_spec ---------------------------
+# The tables set_up() creates and loads: table -> the sample file it is loaded
+# from, its CREATE statement and its key columns (for incremental loads). A
+# table may also list 'after', the tables that must be loaded before it.
+SAMPLE_DATA = 'C:/Users/north/OneDrive/Documents/Snowflake/SampleData/'
+STAGE = '@DDB_STG01'
+FILE_FORMAT = 'DDB_FFT01'
+
+# Session statements sent at the head of the CREATE batch of a load, so they
+# cost no round trip of their own; the PUTs wait for them.
+SESSION_SETUP = ["USE ROLE ACCOUNTADMIN"]
+
+# Where do_the_real_work() writes V_DISTRIBUTION as Parquet files.
+EXPORT_PATH = SAMPLE_DATA + 'V_DISTRIBUTION/'
+
+# Where fetch_cached() keeps query results (see QueryResultCache).
+CACHE_PATH = SAMPLE_DATA + 'QueryCache/'
+
+# Where an incremental set_up() keeps the row index of each table (see
+# csv_splitter.ChangeIndex) and writes the rows that changed since the last load.
+ROW_INDEX_PATH = SAMPLE_DATA + 'RowIndex/'
+CHANGES_PATH = SAMPLE_DATA + 'Changes/'
+
+# Where set_up() writes the tables' Parquet files when it loads Parquet.
+PARQUET_PATH = SAMPLE_DATA + 'Parquet/'
+
+LOAD_SPEC = {
+    'CUSTOMER': {
+        'file': 'Customer.csv',
+        'create': (
+            "CREATE OR REPLACE TABLE DEMO_DB.PUBLIC.CUSTOMER ("
+            "C_CUSTKEY NUMBER (38, 0),"
+            "C_NAME VARCHAR (25),"
+            "C_ADDRESS VARCHAR (40),"
+            "C_NATIONKEY  NUMBER (38,0),"
+            "C_PHONE VARCHAR (15),"
+            "C_ACCTBAL NUMBER (12,2),"
+            "C_MKTSEGMENT VARCHAR (10),"
+            "C_COMMENT VARCHAR (117)"
+            ");"
+        ),
+        'key': ['C_CUSTKEY'],
+    },
+    'ORDERS': {
+        'file': 'Orders.csv',
+        'create': (
+            "CREATE OR REPLACE TABLE DEMO_DB.PUBLIC.ORDERS ("
+            "O_ORDERKEY NUMBER (38, 0),"
+            "O_CUSTKEY NUMBER (38, 0),"
+            "O_ORDERSTATUS VARCHAR (1),"
+            "O_TOTALPRICE NUMBER (12,2),"
+            "O_ORDERDATE DATE,"
+            "O_ORDERPRIORITY VARCHAR (15),"
+            "O_CLERK VARCHAR (15),"
+            "O_SHIPPRORITY NUMBER (38,0),"
+            "O_COMMENT VARCHAR (79)"
+            ")"
+        ),
+        'key': ['O_ORDERKEY'],
+    },
+    'LINEITEM': {
+        'file': 'LineItem.csv',
+        'create': (
+            "CREATE OR REPLACE TABLE DEMO_DB.PUBLIC.LINEITEM ("
+            "L_ORDERKEY NUMBER (38, 0),"
+            "L_PARTKEY NUMBER (38, 0),"
+            "L_SUPPKEY NUMBER (38, 0),"
+            "L_LINENUMBER NUMBER (38, 0),"
+            "L_QUANTITY NUMBER (12,2),"
+            "L_EXTENDEDPRICE NUMBER (12,2),"
+            "L_DISCOUNT NUMBER (12,2),"
+            "L_TAX NUMBER (12,2),"
+            "L_RETURNFLAG VARCHAR (1),"
+            "L_LINESTATUS VARCHAR (1),"
+            "L_SHIPDATE DATE,"
+            "L_COMMITDATE DATE,"
+            "L_RECEIPTDATE DATE,"
+            "L_SHIPINSTRUCT VARCHAR (25),"
+            "L_SHIPMODE VARCHAR (10),"
+            "L_COMMENT VARCHAR (44)"
+            ")"
+        ),
+        'key': ['L_ORDERKEY', 'L_LINENUMBER'],
+    },
+    'NATION': {
+        'file': 'Nation.csv',
+        'create': (
+            "CREATE OR REPLACE TABLE DEMO_DB.PUBLIC.NATION ("
+            "N_NATIONKEY NUMBER (38, 0),"
+            "N_NAME VARCHAR (25),"
+            "N_REGIONKEY NUMBER (38,0),"
+            "N_COMMENT VARCHAR (152)"
+            ")"
+        ),
+        'key': ['N_NATIONKEY'],
+    },
+    'PART': {
+        'file': 'Part.csv',
+        'create': (
+            "CREATE OR REPLACE TABLE DEMO_DB.PUBLIC.PART ("
+            "P_PARTKEY NUMBER (38, 0),"
+            "P_NAME VARCHAR (55),"
+            "P_MFGR VARCHAR (25),"
+            "P_BRAND VARCHAR (10),"
+            "P_TYPE VARCHAR (25),"
+            "P_SIZE NUMBER (38,0),"
+            "P_CONTAINER VARCHAR (10),"
+            "P_RETAILPRICE NUMBER (12,2),"
+            "P_COMMENT VARCHAR (23)"
+            ")"
+        ),
+        'key': ['P_PARTKEY'],
+    },
+    'SUPPLIER': {
+        'file': 'Supplier.csv',
+        'create': (
+            "CREATE OR REPLACE TABLE DEMO_DB.PUBLIC.SUPPLIER ("
+            "S_SUPPKEY NUMBER (38, 0),"
+            "S_NAME VARCHAR (25),"
+            "S_ADDRESS VARCHAR (40),"
+            "S_NATIONKEY NUMBER (38,0),"
+            "S_PHONE VARCHAR (15),"
+            "S_ACCTBAL NUMBER (12,2),"
+            "S_COMMENT VARCHAR (101)"
+            ")"
+        ),
+        'key': ['S_SUPPKEY'],
+    },
+    'PARTSUPP': {
+        'file': 'PartSupp.csv',
+        'create': (
+            "CREATE OR REPLACE TABLE DEMO_DB.PUBLIC.PARTSUPP ("
+            "PS_PARTKEY NUMBER (38, 0),"
+            "PS_SUPPKEY NUMBER (38,0),"
+            "PS_AVAILQTY NUMBER (38,0),"
+            "PS_SUPPLYCOST NUMBER (12,2),"
+            "PS_COMMENT VARCHAR (199)"
+            ")"
+        ),
+        'key': ['PS_PARTKEY', 'PS_SUPPKEY'],
+    },
+}
+# -- <) ---------------------------- END_SECTION ----------------------------
+
+
+# -- (> ---------------------- SECTION=result_cache ------------------------
+def normalize_sql(sql):
+
+    """
+    PURPOSE:
+        Returns the form of a statement used as its cache key: runs of
+        whitespace become one space and the text outside quotes is upper-cased
+        (unquoted names are not case sensitive), and a trailing ; is dropped.
+    """
+
+    parts = re.split(r"""('(?:[^']|'')*'|"(?:[^"]|"")*")""", sql)
+    for i in range(0, len(parts), 2):
+        parts[i] = re.sub(r'\s+', ' ', parts[i]).upper()
+    return ''.join(parts).strip().rstrip(';').strip()
+
+
+class QueryResultCache:
+
+    """
+    PURPOSE:
+        A cache of query results on local disk. Each result is one Arrow file
+        named after a hash of the normalized SQL and the session's database,
+        schema and role, so a hit costs a local disk read rather than a
+        warehouse query and a download. Entries older than
+        `ttl_seconds` are not used, and once the files add up to more than
+        `max_bytes` the least recently used ones are deleted. Several
+        processes can share the directory: files are written under a
+        temporary name and renamed into place.
+    """
+
+    def __init__(self, path, max_bytes=2 * 1024 * 1024 * 1024, ttl_seconds=24 * 3600):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        os.makedirs(path, exist_ok=True)
+
+    def file_name(self, conn, sql):
+        context = [normalize_sql(sql), conn.database, conn.schema, conn.role]
+        key = hashlib.sha256(json.dumps(context).encode()).hexdigest()
+        return os.path.join(self.path, key + '.arrow')
+
+    def get(self, conn, sql):
+        # The cached pyarrow Table, or None.
+        file_name = self.file_name(conn, sql)
+        try:
+            with pyarrow.OSFile(file_name) as source:
+                reader = pyarrow.ipc.open_file(source)
+                created = float(reader.schema.metadata[b'cache_created'])
+                table = None
+                if time.time() - created <= self.ttl_seconds:
+                    table = reader.read_all()
+        except (FileNotFoundError, pyarrow.ArrowInvalid):
+            return None
+        if table is None:
+            self.remove(file_name)
+            return None
+        # The modification time is when the entry was last used.
+        os.utime(file_name)
+        return table
+
+    def put(self, conn, sql, table):
+        file_name = self.file_name(conn, sql)
+        metadata = dict(table.schema.metadata or {})
+        metadata.update({b'cache_sql': sql.encode(), b'cache_created': repr(time.time()).encode()})
+        table = table.replace_schema_metadata(metadata)
+        temp_name = '{0}.{1}.tmp'.format(file_name, os.getpid())
+        with pyarrow.OSFile(temp_name, 'wb') as sink:
+            with pyarrow.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(temp_name, file_name)
+        self.evict()
+
+    def evict(self):
+        # Deletes the least recently used entries until the cache fits in max_bytes.
+        entries = []
+        for file_name in glob.glob(os.path.join(self.path, '*.arrow')):
+            try:
+                stat = os.stat(file_name)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, file_name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, file_name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self.remove(file_name)
+            total -= size
+
+    def invalidate(self):
+        # Drops every entry, e.g. after the tables the results came from were reloaded.
+        for file_name in glob.glob(os.path.join(self.path, '*.arrow')):
+            self.remove(file_name)
+
+    def remove(self, file_name):
+        try:
+            os.remove(file_name)
+        except FileNotFoundError:
+            pass
+# -- <) ---------------------------- END_SECTION ----------------------------
+
+
+# -- (> ---------------------- SECTION=compact_dtypes ----------------------
+# Snowflake type codes in cursor.description (snowflake.connector.constants.FIELD_TYPES).
+FIXED = 0
+TEXT = 2
+DATE = 3
+
+INTEGER_TYPES = [pyarrow.int8(), pyarrow.int16(), pyarrow.int32(), pyarrow.int64()]
+NULLABLE_INTEGER_TYPES = {pyarrow.int8(): pd.Int8Dtype(), pyarrow.int16(): pd.Int16Dtype(),
+                          pyarrow.int32(): pd.Int32Dtype(), pyarrow.int64(): pd.Int64Dtype()}
+
+
+def compact_frame(table, description=None, scaled_decimals=False, max_category_ratio=0.5):
+
+    """
+    PURPOSE:
+        Converts a pyarrow Table of query results to a DataFrame with the
+        smallest dtypes that hold it, using the column types in the cursor's
+        description (or the Arrow types when there is none):
+            * NUMBER(p, 0): the smallest integer type that fits the values
+              (a nullable Int type when there are NULLs); columns with
+              values past the int64 range stay Decimal objects.
+            * NUMBER(p, s): as the connector returns them (Decimal objects),
+              or with scaled_decimals the smallest integer type holding the
+              exact value * 10**s when that fits an int64; the scale of each
+              such column is kept in frame.attrs['scale'].
+            * VARCHAR: categorical when there are at most
+              max_category_ratio distinct values per row, else strings.
+            * DATE: datetime64 instead of datetime.date objects.
+    RETURNS:
+        The DataFrame and an estimate of the bytes a plain to_pandas() would
+        have used, measured on a sample of each column.
+    """
+
+    columns = {}
+    default_bytes = 0
+    scales = {}
+    for i, name in enumerate(table.column_names):
+        column = table.column(i)
+        type_code, scale = None, 0
+        if description is not None:
+            type_code, scale = description[i][1], description[i][5] or 0
+        elif pyarrow.types.is_integer(column.type):
+            type_code = FIXED
+        elif pyarrow.types.is_string(column.type) or pyarrow.types.is_large_string(column.type):
+            type_code = TEXT
+        elif pyarrow.types.is_date(column.type):
+            type_code = DATE
+        default_bytes += default_size(column)
+
+        series = None
+        if type_code == FIXED and scale and scaled_decimals and pyarrow.types.is_decimal(column.type):
+            series = smallest_integer(column, scale)
+            if series is not None:
+                scales[name] = scale
+        elif type_code == FIXED and not scale:
+            series = smallest_integer(column)
+        elif type_code == TEXT and len(column) and \
+                pyarrow.compute.count_distinct(column).as_py() <= max_category_ratio * len(column):
+            series = column.dictionary_encode().to_pandas()
+        elif type_code == DATE:
+            series = column.to_pandas(date_as_object=False)
+        columns[name] = column.to_pandas() if series is None else series
+    frame = pd.DataFrame(columns, copy=False)
+    if scales:
+        frame.attrs['scale'] = scales
+    return frame, default_bytes
+
+
+def smallest_integer(column, scale=0):
+    # The column as the smallest integer type holding value * 10**scale, or
+    # None when it is all NULL or does not fit an int64. The range is checked
+    # on the exact (int or Decimal) min and max, so NUMBER(38, 0) keys past
+    # 2**63 and scaled decimals never go through a lossy cast or float64.
+    low, high = (value.as_py() for value in pyarrow.compute.min_max(column).values())
+    if low is None:
+        return None
+    if scale:
+        low, high = low.scaleb(scale), high.scaleb(scale)
+    for arrow_type in INTEGER_TYPES:
+        limits = numpy.iinfo(arrow_type.to_pandas_dtype())
+        if limits.min <= low and high <= limits.max:
+            break
+    else:
+        return None
+    if scale:
+        # Values that fit an int64 once scaled have at most 19 digits, which
+        # leaves the product room within the 38 digits of a decimal128.
+        if scale > 17:
+            return None
+        column = pyarrow.compute.multiply(column.cast(pyarrow.decimal128(19, scale)),
+                                          pyarrow.scalar(decimal.Decimal(10 ** scale), pyarrow.decimal128(scale + 1, 0)))
+    column = column.cast(arrow_type)
+    if column.null_count:
+        return column.to_pandas(types_mapper=NULLABLE_INTEGER_TYPES.get)
+    return column.to_pandas()
+
+
+def default_size(column, sample_rows=10000):
+    # Bytes a plain to_pandas() of the column takes, measured on its first sample_rows rows.
+    rows = len(column)
+    if not rows:
+        return 0
+    sample = column.slice(0, sample_rows)
+    return int(sample.to_pandas().memory_usage(deep=True, index=False) * rows / len(sample))
 # -- <) ---------------------------- END_SECTION ----------------------------
 
 
@@ -23,14 +394,24 @@ class SnwClass:
     """
 
 
-    def __init__(self, p_log_file_name = None):
+    def __init__(self, p_log_file_name = None, p_cache_path = None, p_metrics = None):
 
         """
         PURPOSE:
             This does any required initialization steps, which in this class is
-            basically just turning on logging.
+            basically just turning on logging and opening the query result
+            cache (CACHE_PATH unless p_cache_path is given). With p_metrics (a
+            load_metrics.StageMetrics) every fetch is recorded as a 'fetch'
+            event with its rows, Arrow bytes and query id, and every load
+            step as an event of its kind ('create', 'put', 'copy', 'merge'). Files this object
+            loads are staged under a folder of STAGE of its own, so it never
+            COPYs or removes the files of another load using the same stage.
         """
 
+        self.cache = QueryResultCache(p_cache_path or CACHE_PATH)
+        self.metrics = p_metrics
+        self.stage_folder = "{0}/{1}_{2}/".format(STAGE, time.strftime('%Y%m%d%H%M%S'), uuid.uuid4().hex[:8])
+
         file_name = p_log_file_name
         if file_name is None:
             file_name = "C:/Users/north/PycharmProjects/SnowflakeTest/venv/tmpsnowflake_python_onnector.log"
@@ -61,17 +442,35 @@ class SnwClass:
         # Read the connection parameters (e.g. user ID) from the command line
         # and environment variables, then connect to Snowflake.
         connection = self.create_connection(argv)
-
-        # Set up anything we need (e.g. a separate schema for the test/demo).
-        self.set_up(connection)
-
-        # Do the "real work", for example, create a table, insert rows, SELECT
-        # from the table, etc.
-        self.do_the_real_work(connection)
-
-        # Clean up. In this case, we drop the temporary warehouse, database, and
-        # schema.
-        self.clean_up(connection)
+        properties = self.args_to_properties(argv)
+
+        # Per-stage metrics of the load steps and fetches, as in
+        # MultiThreadBulkLoad_V1.py: --metrics <file> appends the events as
+        # they happen, --prometheus <file> writes the stage totals for the
+        # node_exporter textfile collector and --trace <file> a Chrome trace,
+        # both when the run ends. The per-stage summary is printed either way.
+        if self.metrics is None:
+            self.metrics = load_metrics.StageMetrics(
+                eventsFile=properties.get('metrics'),
+                prometheusFile=properties.get('prometheus'),
+                traceFile=properties.get('trace'))
+        try:
+            # Set up anything we need (e.g. a separate schema for the test/demo).
+            # With --incremental yes the tables are kept and only the rows that
+            # changed since the last run are loaded; --splitformat parquet loads
+            # them from typed Parquet files instead of the CSV files.
+            self.set_up(connection, properties.get('incremental') == 'yes',
+                        properties.get('splitformat', 'csv'))
+
+            # Do the "real work", for example, create a table, insert rows, SELECT
+            # from the table, etc.
+            self.do_the_real_work(connection)
+
+            # Clean up. In this case, we drop the temporary warehouse, database, and
+            # schema.
+            self.clean_up(connection)
+        finally:
+            self.metrics.close()
 
         print("\nClosing connection...")
         # -- (> ------------------- SECTION=close_connection -----------------
@@ -211,156 +610,260 @@ class SnwClass:
         return conn
 
     # -- <) ============================== START METHOD ==============================
-    def set_up(self, connection):
+    def set_up(self, connection, incremental=False, file_format='csv'):
 
         """
         PURPOSE:
-            Create or Replace existing Tables in Snowflake DW
+            Create or Replace existing Tables in Snowflake DW and load them
+            from the sample files listed in LOAD_SPEC. If `incremental`, the
+            tables are only created where they do not exist yet, and just the
+            rows that are new or changed since the last load are MERGEd in
+            (see load_changes()). Otherwise `file_format` 'parquet' loads
+            them from Parquet files (see load_tables()).
         """
-        connection.cursor().execute("USE ROLE ACCOUNTADMIN")
+        # Cached results of the old tables are stale once the load starts
+        # (and again once it is done, for queries run while it was running).
+        self.cache.invalidate()
+        try:
+            if incremental:
+                self.load_changes(connection, LOAD_SPEC)
+            else:
+                self.load_tables(connection, LOAD_SPEC, file_format=file_format)
+        finally:
+            self.cache.invalidate()
 
-        connection.cursor().execute(
-            "CREATE OR REPLACE TABLE DEMO_DB.PUBLIC.CUSTOMER ("
-            "C_CUSTKEY NUMBER (38, 0)," 
-            "C_NAME VARCHAR (25),"
-            "C_ADDRESS VARCHAR (40)," 
-            "C_NATIONKEY  NUMBER (38,0),"
-            "C_PHONE VARCHAR (15)," 
-            "C_ACCTBAL NUMBER (12,2),"
-            "C_MKTSEGMENT VARCHAR (10)," 
-            "C_COMMENT VARCHAR (117)"
-            ");"
-            )
+        connection.cursor().close()
 
-        connection.cursor().execute(
-            "CREATE OR REPLACE TABLE DEMO_DB.PUBLIC.ORDERS ("
-            "O_ORDERKEY NUMBER (38, 0),"  
-            "O_CUSTKEY NUMBER (38, 0)," 
-            "O_ORDERSTATUS VARCHAR (1),"
-            "O_TOTALPRICE NUMBER (12,2)," 
-            "O_ORDERDATE DATE,"
-            "O_ORDERPRIORITY VARCHAR (15)," 
-            "O_CLERK VARCHAR (15),"
-            "O_SHIPPRORITY NUMBER (38,0)," 
-            "O_COMMENT VARCHAR (79)"
-            ")"
-        )
+    # -- <) ============================== START METHOD ==============================
+    def load_tables(self, connection, spec, threads=4, file_format='csv'):
 
-        connection.cursor().execute(
-            "CREATE OR REPLACE TABLE DEMO_DB.PUBLIC.LINEITEM ("
-            "L_ORDERKEY NUMBER (38, 0),"  
-            "L_PARTKEY NUMBER (38, 0)," 
-            "L_SUPPKEY NUMBER (38, 0)," 
-            "L_LINENUMBER NUMBER (38, 0),"   
-            "L_QUANTITY NUMBER (12,2),"
-            "L_EXTENDEDPRICE NUMBER (12,2)," 
-            "L_DISCOUNT NUMBER (12,2),"  
-            "L_TAX NUMBER (12,2),"
-            "L_RETURNFLAG VARCHAR (1),"  
-            "L_LINESTATUS VARCHAR (1)," 
-            "L_SHIPDATE DATE,"
-            "L_COMMITDATE DATE,"
-            "L_RECEIPTDATE DATE,"  
-            "L_SHIPINSTRUCT VARCHAR (25)," 
-            "L_SHIPMODE VARCHAR (10),"
-            "L_COMMENT VARCHAR (44)"
-            ")"
-        )
+        """
+        PURPOSE:
+            Creates and loads the tables of a load spec (see LOAD_SPEC)
+            concurrently. The SESSION_SETUP statements and the CREATEs of all
+            the tables are sent as one multi-statement request (see
+            run_batch()); each table then has a PUT of its file, run under
+            that role, and a COPY INTO, which waits for its PUT and the COPYs
+            of the tables in its 'after' list. Tables are
+            started largest file first, so the biggest one (LINEITEM for
+            TPC-H) is not left to the end of the load.
+            With `file_format` 'parquet' the files are first split into
+            snappy-compressed Parquet files typed by the CREATE statements,
+            all of them at once on every core, and each table's files are PUT
+            to a stage folder of its own and COPYed by column name.
+            Every COPY purges the files it loaded, so the stage is left as it
+            was without a REMOVE.
+        INPUTS:
+            connection: The connection the statements run on.
+            spec: Table -> {'file', 'create', optional 'after'}.
+            threads: How many statements run at once.
+            file_format: 'csv' or 'parquet'.
+        """
 
-        connection.cursor().execute(
-            "CREATE OR REPLACE TABLE DEMO_DB.PUBLIC.NATION ("
-            "N_NATIONKEY NUMBER (38, 0),"  
-            "N_NAME VARCHAR (25),"
-            "N_REGIONKEY NUMBER (38,0)," 
-            "N_COMMENT VARCHAR (152)"
-            ")"
-        )
+        def file_size(table):
+            path = SAMPLE_DATA + spec[table]['file']
+            return os.path.getsize(path) if os.path.exists(path) else 0
+
+        if file_format == 'parquet':
+            os.makedirs(PARQUET_PATH, exist_ok=True)
+            for path in glob.glob(PARQUET_PATH + '*.parquet'):
+                os.remove(path)
+            files = {SAMPLE_DATA + spec[table]['file']: table for table in spec}
+            csv_splitter.split_files(
+                {path: table + '_%s.csv' for path, table in files.items()}, output_path=PARQUET_PATH,
+                file_format='parquet', compression='snappy',
+                columns={path: csv_splitter.parse_columns(spec[table]['create']) for path, table in files.items()})
+
+        tables = sorted(spec, key=file_size, reverse=True)
+        steps = {'CREATE': (SESSION_SETUP + [spec[table]['create'] for table in tables], [])}
+        for table in tables:
+            csv_file = SAMPLE_DATA + spec[table]['file']
+            if file_format == 'parquet':
+                folder = "{0}{1}/".format(self.stage_folder, table.lower())
+                steps['PUT ' + table] = ("put file://{0}{1}_*.parquet {2} auto_compress=false overwrite=true".format(
+                    PARQUET_PATH, table, folder), ['CREATE'])
+                copy = ("COPY INTO {0} FROM {1} FILE_FORMAT=(TYPE = PARQUET) MATCH_BY_COLUMN_NAME = CASE_INSENSITIVE"
+                        " PURGE = TRUE".format(table, folder))
+            else:
+                steps['PUT ' + table] = ("put file://{0} {1} auto_compress=true".format(
+                    csv_file, self.stage_folder), ['CREATE'])
+                copy = "COPY INTO {0} FROM {1} FILES=('{2}.gz') FILE_FORMAT=(format_name = {3}) PURGE = TRUE".format(
+                    table, self.stage_folder, spec[table]['file'], FILE_FORMAT)
+            steps['COPY ' + table] = (
+                copy,
+                ['CREATE', 'PUT ' + table]
+                + ['COPY ' + other for other in spec[table].get('after', [])])
+        self.run_steps(connection, steps, threads)
 
-        connection.cursor().execute(
-            "CREATE OR REPLACE TABLE DEMO_DB.PUBLIC.PART ("
-            "P_PARTKEY NUMBER (38, 0),"  
-            "P_NAME VARCHAR (55),"  
-            "P_MFGR VARCHAR (25)," 
-            "P_BRAND VARCHAR (10),"
-            "P_TYPE VARCHAR (25)," 
-            "P_SIZE NUMBER (38,0),"
-            "P_CONTAINER VARCHAR (10)," 
-            "P_RETAILPRICE NUMBER (12,2)," 
-            "P_COMMENT VARCHAR (23)"
-            ")"
+    # -- <) ============================== START METHOD ==============================
+    def load_changes(self, connection, spec, threads=4):
 
-        )
+        """
+        PURPOSE:
+            Loads the tables of a load spec incrementally. Each file is first
+            compared with the row index of its last load (24 bytes of hashes
+            per row, in ROW_INDEX_PATH), and only the rows that are new
+            or changed are written to a gzip file, PUT, COPYed into a
+            transient <table>_DELTA table and MERGEd into the table on its
+            'key'. The row indexes only take the new hashes once every MERGE
+            is done, so after a failed load the next one finds the same
+            changes again. Rows missing from a file are counted, not deleted.
+            The tables and delta tables are all created in one multi-statement
+            request, together with the SESSION_SETUP statements.
+        INPUTS:
+            connection: The connection the statements run on.
+            spec: Table -> {'file', 'create', 'key', optional 'after'}.
+            threads: How many statements run at once.
+        """
 
-        connection.cursor().execute(
-            "CREATE OR REPLACE TABLE DEMO_DB.PUBLIC.SUPPLIER ("
-            "S_SUPPKEY NUMBER (38, 0),"  
-            "S_NAME VARCHAR (25),"  
-            "S_ADDRESS VARCHAR (40)," 
-            "S_NATIONKEY NUMBER (38,0),"
-            "S_PHONE VARCHAR (15)," 
-            "S_ACCTBAL NUMBER (12,2),"
-            "S_COMMENT VARCHAR (101)"
-            ")"
-        )
+        os.makedirs(ROW_INDEX_PATH, exist_ok=True)
+        os.makedirs(CHANGES_PATH, exist_ok=True)
+        creates = []
+        deltas = []
+        steps = {}
+        indexes = {}
+        changed_files = []
+        for table in spec:
+            columns = [column.name for column in csv_splitter.parse_columns(spec[table]['create'])]
+            key = spec[table]['key']
+            # The key by position, so the files need not have the table's column names as headers.
+            index = csv_splitter.ChangeIndex(ROW_INDEX_PATH + table + '.rowindex',
+                                             [columns.index(name) for name in key])
+            pieces = []
+            csv_splitter.split(SAMPLE_DATA + spec[table]['file'],
+                               row_limit=sys.maxsize, output_name_template=table + '_changes_%s.csv',
+                               output_path=CHANGES_PATH, compression='gzip',
+                               on_chunk=pieces.append, changes=index)
+            print("{0}: {1}".format(table, index.summary()))
+            indexes[table] = index
+            changed_files += [piece.path for piece in pieces]
+
+            delta = table + '_DELTA'
+            updates = ", ".join("{0} = s.{0}".format(name) for name in columns if name not in key)
+            creates.append(spec[table]['create'].replace('CREATE OR REPLACE TABLE', 'CREATE TABLE IF NOT EXISTS', 1))
+            # Replacing the delta table also drops its load metadata, so COPY
+            # loads a changes file of the same name as the last run's again.
+            deltas.append("CREATE OR REPLACE TRANSIENT TABLE {0} LIKE {1}".format(delta, table))
+            steps['PUT ' + table] = ("put file://{0} {1} auto_compress=false overwrite=true".format(
+                pieces[0].path, self.stage_folder), ['CREATE'])
+            steps['COPY ' + table] = (
+                "COPY INTO {0} FROM {1} FILES=('{2}') FILE_FORMAT=(format_name = {3}) PURGE = TRUE".format(
+                    delta, self.stage_folder, os.path.basename(pieces[0].path), FILE_FORMAT),
+                ['CREATE', 'PUT ' + table])
+            steps['MERGE ' + table] = (
+                "MERGE INTO {0} t USING {1} s ON {2} {3}WHEN NOT MATCHED THEN INSERT ({4}) VALUES ({5})".format(
+                    table, delta,
+                    " AND ".join("t.{0} = s.{0}".format(name) for name in key),
+                    "WHEN MATCHED THEN UPDATE SET {0} ".format(updates) if updates else "",
+                    ", ".join(columns),
+                    ", ".join("s." + name for name in columns)),
+                ['COPY ' + table] + ['MERGE ' + other for other in spec[table].get('after', [])])
+        # The batch runs in order, so each delta table is created after its table.
+        steps = {'CREATE': (SESSION_SETUP + creates + deltas, []), **steps}
+        self.run_steps(connection, steps, threads)
+
+        for index in indexes.values():
+            index.commit()
+        for path in changed_files:
+            os.remove(path)
 
-        connection.cursor().execute(
-            "CREATE OR REPLACE TABLE DEMO_DB.PUBLIC.PARTSUPP ("
-            "PS_PARTKEY NUMBER (38, 0),"  
-            "PS_SUPPKEY NUMBER (38,0),"  
-            "PS_AVAILQTY NUMBER (38,0)," 
-            "PS_SUPPLYCOST NUMBER (12,2),"
-            "PS_COMMENT VARCHAR (199)"
-            ")"
-        )
+    # -- <) ============================== START METHOD ==============================
+    def run_steps(self, connection, steps, threads):
+
+        """
+        PURPOSE:
+            Runs named SQL statements on a pool of threads, each one as soon as
+            the steps it depends on have succeeded, in the order of `steps`
+            among the ones that are ready.
+        INPUTS:
+            steps: An ordered dict of name -> (statement, names it depends on).
+                   The statement can also be a list of statements that need
+                   nothing in between them, run as one request by run_batch().
+        RAISES:
+            RuntimeError once every step that could run has finished, if any
+            step failed; the steps depending on it are not run.
         """
-                PURPOSE:
-                    Copy csv files to the SNOWFLAKE STAGE
-         """
-
-        csv_file = 'C:/Users/north/OneDrive/Documents/Snowflake/SampleData/Customer.csv'
-        sql = "put file://{0} @DDB_STG01 auto_compress=true".format(csv_file)
-        connection.cursor().execute(sql)
-        sql1 = "COPY INTO CUSTOMER FROM @DDB_STG01/Customer.csv.gz FILE_FORMAT=(format_name = DDB_FFT01)"
-        connection.cursor().execute(sql1)
-
-        csv_file = 'C:/Users/north/OneDrive/Documents/Snowflake/SampleData/Orders.csv'
-        sql = "put file://{0} @DDB_STG01 auto_compress=true".format(csv_file)
-        connection.cursor().execute(sql)
-        sql1 = "COPY INTO ORDERS FROM @DDB_STG01/Orders.csv.gz FILE_FORMAT=(format_name = DDB_FFT01)"
-        connection.cursor().execute(sql1)
-
-        csv_file = 'C:/Users/north/OneDrive/Documents/Snowflake/SampleData/LineItem.csv'
-        sql = "put file://{0} @DDB_STG01 auto_compress=true".format(csv_file)
-        connection.cursor().execute(sql)
-        sql1 = "COPY INTO LINEITEM FROM @DDB_STG01/LineItem.csv.gz FILE_FORMAT=(format_name = DDB_FFT01)"
-        connection.cursor().execute(sql1)
-
-        csv_file = 'C:/Users/north/OneDrive/Documents/Snowflake/SampleData/Nation.csv'
-        sql = "put file://{0} @DDB_STG01 auto_compress=true".format(csv_file)
-        connection.cursor().execute(sql)
-        sql1 = "COPY INTO NATION FROM @DDB_STG01/Nation.csv.gz FILE_FORMAT=(format_name = DDB_FFT01)"
-        connection.cursor().execute(sql1)
-
-        csv_file = 'C:/Users/north/OneDrive/Documents/Snowflake/SampleData/Part.csv'
-        sql = "put file://{0} @DDB_STG01 auto_compress=true".format(csv_file)
-        connection.cursor().execute(sql)
-        sql1 = "COPY INTO PART FROM @DDB_STG01/Part.csv.gz FILE_FORMAT=(format_name = DDB_FFT01)"
-        connection.cursor().execute(sql1)
-
-        csv_file = 'C:/Users/north/OneDrive/Documents/Snowflake/SampleData/Supplier.csv'
-        sql = "put file://{0} @DDB_STG01 auto_compress=true".format(csv_file)
-        connection.cursor().execute(sql)
-        sql1 = "COPY INTO SUPPLIER FROM @DDB_STG01/Supplier.csv.gz FILE_FORMAT=(format_name = DDB_FFT01)"
-        connection.cursor().execute(sql1)
-
-        csv_file = 'C:/Users/north/OneDrive/Documents/Snowflake/SampleData/PartSupp.csv'
-        sql = "put file://{0} @DDB_STG01 auto_compress=true".format(csv_file)
-        connection.cursor().execute(sql)
-        sql1 = "COPY INTO PARTSUPP FROM @DDB_STG01/PartSupp.csv.gz FILE_FORMAT=(format_name = DDB_FFT01)"
-        connection.cursor().execute(sql1)
 
+        for name, (statement, after) in steps.items():
+            unknown = [dependency for dependency in after if dependency not in steps]
+            if unknown:
+                raise ValueError("{0} depends on unknown steps {1}".format(name, unknown))
+
+        waiting = list(steps)
+        done = set()
+        failed = {}
+        running = {}
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            while True:
+                changed = False
+                for name in list(waiting):
+                    after = steps[name][1]
+                    if any(dependency in failed for dependency in after):
+                        waiting.remove(name)
+                        failed[name] = "not run"
+                        changed = True
+                    elif all(dependency in done for dependency in after):
+                        waiting.remove(name)
+                        running[pool.submit(self.run_step, connection, name, steps[name][0])] = name
+                if not running:
+                    if changed:
+                        continue
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        future.result()
+                        done.add(name)
+                    except Exception as e:
+                        logging.error("%s failed: %s", name, e)
+                        failed[name] = e
+        # Steps still waiting here depend on each other in a cycle.
+        for name in waiting:
+            failed[name] = "dependency cycle"
+        if failed:
+            raise RuntimeError("{0} of {1} load steps failed: {2}".format(
+                len(failed), len(steps), ", ".join("{0} ({1})".format(name, error) for name, error in failed.items())))
+
+    def run_step(self, connection, name, statement):
+        # Recorded as an event of the step's kind, the first word of its name.
+        started = time.time()
+        span = (self.metrics.span(name.split()[0].lower(), step=name) if self.metrics is not None
+                else contextlib.nullcontext({}))
+        with span as event:
+            if isinstance(statement, list):
+                event['statements'] = len(self.run_batch(connection, statement))
+            else:
+                cursor = connection.cursor()
+                try:
+                    cursor.execute(statement)
+                    event['queryId'] = cursor.sfqid
+                    event['rows'] = cursor.rowcount
+                finally:
+                    cursor.close()
+        logging.info("%s done in %.1fs", name, time.time() - started)
+
+    def run_batch(self, connection, statements):
 
-        connection.cursor().close()
+        """
+        PURPOSE:
+            Runs statements that need nothing in between them (DDL, USE,
+            ALTER SESSION) as one multi-statement request, one round trip
+            instead of one per statement, with the loader's execute_batch().
+            Snowflake runs them in order and stops at the first one that
+            fails, without rolling back the ones before it.
+        RETURNS:
+            execute_batch()'s sfStatementResult per statement, with its query
+            id and row count. Each is also logged.
+        RAISES:
+            The error of the first statement that failed.
+        """
+
+        results = loader.execute_batch(connection, statements)
+        for result in results:
+            if not result.ok:
+                raise result.error
+        return results
 
     # -- <) ============================== START METHOD ==============================
     def do_the_real_work(self, conn):
@@ -396,15 +899,10 @@ class SnwClass:
         # Close this cursor.
         cursor1.close()
 
-        # Read data into dataframe from V_DISTRIBUTION
-        cur = conn.cursor()
-        try:
-            sql = "SELECT * FROM V_DISTRIBUTION"
-            results = cur.execute(sql).fetchall()
-            column_names = [col[0] for col in cur.description]
-            df = pd.DataFrame(results, columns=column_names)
-        finally:
-            cur.close()
+        # Export V_DISTRIBUTION to Parquet files a partition at a time
+        # instead of reading it into one DataFrame; read it back with e.g.
+        # pd.read_parquet(EXPORT_PATH).
+        self.export_parquet(conn, "SELECT * FROM V_DISTRIBUTION", EXPORT_PATH)
 
     # -- <) ============================== START METHOD ==============================
 
@@ -412,35 +910,217 @@ class SnwClass:
     #-----------------------------------------------------------------------------------------
     def clean_up(self, connection):
 
-        # Cleanup the stage and close connection
-
-       sql2 = "remove @DDB_STG01 pattern ='.*.csv.gz'"
-       connection.cursor().execute(sql2)
+        # The COPYs purged the files they loaded from the stage, so only the
+        # check of the load is left (a failed COPY keeps its files in
+        # self.stage_folder for a look at what went wrong).
 
        sql3 = "SELECT * FROM CUSTOMER"
-       self.fetch_pandas_old(connection,sql3)
+       rows = 0
+       for df in self.fetch_batches(connection, sql3, batch_rows=100000):
+           rows += df.shape[0]
+       print("CUSTOMER: {0} rows".format(rows))
 
     #--------------------------------------------------------------------------
 
     # -- <) ============================== START METHODS ==============================
 
-    def fetch_pandas_old(self, conn, sql):
+    def fetch_batches(self, conn, sql, batch_rows=None, as_arrow=False, compact=False):
 
-        # Create a cursor for this connection.
-        cur = conn.cursor()
-        cur.execute(sql)
+        """
+        PURPOSE:
+            Runs a query and yields its result a batch at a time, straight
+            from the connector's Arrow result batches, without building a
+            Python tuple per row.
+        INPUTS:
+            batch_rows: Rows per batch. None yields the batches the way the
+                        result arrives; otherwise they are re-cut to this size
+                        (the last one may be smaller) by slicing, which does
+                        not copy the data.
+            as_arrow: Yield pyarrow Tables instead of pandas DataFrames.
+            compact: Build the DataFrames with compact_frame, from the column
+                     types in the cursor's description.
+        """
 
+        cur = conn.cursor()
+        started = time.time()
+        clock = time.perf_counter()
         rows = 0
-        while True:
-            dat = cur.fetchmany(200)
-            if not dat:
-               break
-            df = pd.DataFrame(dat, columns=cur.description)
-            df1 = pd.DataFrame(dat)
-            rows += df.shape[0]
-            print(df1.loc[0])
-        #print(rows)
-        cur.close()
+        fetched_bytes = 0
+        try:
+            cur.execute(sql)
+            for table in self.arrow_batches(cur, batch_rows):
+                rows += table.num_rows
+                fetched_bytes += table.nbytes
+                if as_arrow:
+                    yield table
+                elif compact:
+                    frame, default_bytes = compact_frame(table, cur.description)
+                    logging.info("Compact batch of %d rows: %d bytes instead of about %d",
+                                 len(frame), frame.memory_usage(deep=True).sum(), default_bytes)
+                    yield frame
+                else:
+                    yield table.to_pandas()
+        finally:
+            cur.close()
+            # The wall time includes the caller's work between batches.
+            if self.metrics is not None:
+                self.metrics.record('fetch', started, time.perf_counter() - clock, rows=rows,
+                                    bytes=fetched_bytes, queryId=cur.sfqid)
+
+    def arrow_batches(self, cur, batch_rows=None):
+        # The Arrow batches of an executed cursor, re-cut to batch_rows rows if given.
+        pending = []
+        pending_rows = 0
+        for table in cur.fetch_arrow_batches():
+            if batch_rows is None:
+                yield table
+                continue
+            if not table.num_rows:
+                continue
+            pending.append(table)
+            pending_rows += table.num_rows
+            if pending_rows < batch_rows:
+                continue
+            combined = pyarrow.concat_tables(pending)
+            offset = 0
+            while pending_rows - offset >= batch_rows:
+                yield combined.slice(offset, batch_rows)
+                offset += batch_rows
+            pending = [combined.slice(offset)]
+            pending_rows -= offset
+        if pending_rows:
+            yield pyarrow.concat_tables(pending)
+
+    def export_parquet(self, conn, sql, path, rows_per_file=1000000, max_memory_mb=512, writers=2):
+
+        """
+        PURPOSE:
+            Streams the result of a query into Parquet files part-00000.parquet,
+            part-00001.parquet, ... in `path`, replacing the ones an earlier
+            export left there. Result batches are collected into a partition
+            until it holds `rows_per_file` rows or its share of the memory
+            budget, and each full partition is written on one of `writers`
+            threads while the next one is fetched. At most `writers`
+            partitions are being written at once, so the export holds about
+            `max_memory_mb` of results however large the query is. Prints
+            the rows and bytes done after every file.
+        RETURNS:
+            The number of rows exported.
+        """
+
+        os.makedirs(path, exist_ok=True)
+        for old_file in glob.glob(os.path.join(path, 'part-*.parquet')):
+            os.remove(old_file)
+        partition_bytes = max_memory_mb * 1024 * 1024 // (writers + 1)
+        slots = threading.Semaphore(writers)
+        lock = threading.Lock()
+        progress = {'rows': 0, 'bytes': 0, 'files': 0}
+        started = time.time()
+
+        def write(table, file_name):
+            pyarrow.parquet.write_table(table, file_name)
+            with lock:
+                progress['rows'] += table.num_rows
+                progress['bytes'] += os.path.getsize(file_name)
+                progress['files'] += 1
+                print("Exported {0} rows, {1:.1f} MB in {2} files ({3:.0f}s)".format(
+                    progress['rows'], progress['bytes'] / 1024 / 1024, progress['files'],
+                    time.time() - started))
+
+        futures = []
+        with ThreadPoolExecutor(max_workers=writers) as pool:
+
+            def flush(tables):
+                # Waits for a free writer, then hands it the partition. The slot
+                # is given back once, when the write is done or if it was never
+                # started (after an earlier write failed).
+                slots.acquire()
+                future = None
+                try:
+                    for done in futures:
+                        if done.done() and done.exception():
+                            raise done.exception()
+                    file_name = os.path.join(path, 'part-{0:05d}.parquet'.format(len(futures)))
+                    future = pool.submit(write, pyarrow.concat_tables(tables), file_name)
+                    futures.append(future)
+                finally:
+                    if future is None:
+                        slots.release()
+                    else:
+                        future.add_done_callback(lambda _: slots.release())
+
+            pending = []
+            pending_rows = 0
+            pending_bytes = 0
+            for table in self.fetch_batches(conn, sql, as_arrow=True):
+                if not table.num_rows:
+                    continue
+                pending.append(table)
+                pending_rows += table.num_rows
+                pending_bytes += table.nbytes
+                if pending_rows >= rows_per_file or pending_bytes >= partition_bytes:
+                    flush(pending)
+                    pending = []
+                    pending_rows = 0
+                    pending_bytes = 0
+            if pending:
+                flush(pending)
+        for future in futures:
+            future.result()
+        return progress['rows']
+
+    def fetch_cached(self, conn, sql, as_arrow=False):
+
+        """
+        PURPOSE:
+            Like fetch_all, but answered from the query result cache when the
+            same query was run in the same database, schema and role before;
+            otherwise the result is fetched and cached. Empty results are not
+            cached.
+        """
+
+        table = self.cache.get(conn, sql)
+        if table is None:
+            table = self.fetch_all(conn, sql, as_arrow=True)
+            if table is None:
+                return None
+            self.cache.put(conn, sql, table)
+        return table if as_arrow else table.to_pandas()
+
+    def fetch_all(self, conn, sql, as_arrow=False, compact=False):
+
+        """
+        PURPOSE:
+            Runs a query and returns its whole result as one DataFrame (or
+            pyarrow Table). The Arrow batches are joined once at the end
+            without copying; only the conversion to pandas copies the data.
+            With compact=True the DataFrame gets compact dtypes (see
+            compact_frame) and the memory saved is printed.
+        """
+
+        span = self.metrics.span('fetch') if self.metrics is not None else contextlib.nullcontext({})
+        cur = conn.cursor()
+        with span as event:
+            try:
+                cur.execute(sql)
+                event['queryId'] = cur.sfqid
+                tables = list(self.arrow_batches(cur))
+                event['rows'] = sum(table.num_rows for table in tables)
+                event['bytes'] = sum(table.nbytes for table in tables)
+                if not tables:
+                    return None
+                table = pyarrow.concat_tables(tables)
+                if as_arrow:
+                    return table
+                if not compact:
+                    return table.to_pandas()
+                frame, default_bytes = compact_frame(table, cur.description)
+            finally:
+                cur.close()
+        frame_bytes = frame.memory_usage(deep=True).sum()
+        print("Compact dtypes: {0:.1f} MB instead of about {1:.1f} MB ({2:.1f}x smaller)".format(
+            frame_bytes / 1024 / 1024, default_bytes / 1024 / 1024, default_bytes / max(frame_bytes, 1)))
+        return frame
 
         # -- <) ---------------------------- END_SECTION ---------------------
 # -- <) ==============================**** END ALL METHOD ****==============================
@@ -6,6 +6,14 @@
 # First import the threading module to support this functionality
 #======================================================================================================
 import threading
+import time
+import random
+import json
+import hashlib
+import uuid
+import asyncio
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
 # Second import the Snowflake module
 import snowflake.connector as sf
 
@@ -16,6 +24,13 @@ import sys
 
 #Import Custom Large file splitter
 import csv_splitter
+# and the per-stage metrics
+import load_metrics
+
+# Command-line parameters every run must pass (see args_to_properties); --tables can take the
+# place of --largefile (see input_tables).
+REQUIRED_PARAMETERS = ['warehouse', 'database', 'schema', 'user', 'account',
+                       'largefile', 'stage', 'fileformat']
 #==============================================================================================
 
 def log_file_setup(p_log_file_name=None):
@@ -86,7 +101,10 @@ def sfConnect(argv):
     PASSWORD = os.getenv('SNOWSQL_PWD')
 
     # Get the other login info etc. from the command line.
-    if len(argv) != 17:
+    # Optional tuning parameters (e.g. --splitworkers) may follow the required ones.
+    connection_parameters = args_to_properties(argv)
+    if any(name not in connection_parameters for name in REQUIRED_PARAMETERS
+           if name != 'largefile' or 'tables' not in connection_parameters):
         msg = "ERROR: Please pass the following command-line parameters:\n"
         msg += "--warehouse <warehouse> --database <db> --schema <schema> "
         msg += "--user <user> --account <account>  --largefile <largefile_to_split>"
@@ -94,13 +112,11 @@ def sfConnect(argv):
         print(msg)
         sys.exit(-1)
     else:
-        connection_parameters = args_to_properties(argv)
         USER = connection_parameters["user"]
         ACCOUNT = connection_parameters["account"]
         WAREHOUSE = connection_parameters["warehouse"]
         DATABASE = connection_parameters["database"]
         SCHEMA = connection_parameters["schema"]
-        LARGEFILE = connection_parameters["largefile"]
 
     # Optional: for internal testing only.
     try:
@@ -143,172 +159,1332 @@ def sfConnect(argv):
 
 # -- <) ---------- END_SECTION --------------------------------------
 # ==============================================================================================
-# Define the threads class called sfExecutionThread.
-# This class is an object which stores all the necessary details for the thread.
-# Specifically, we include a threadID so that we can identify individual threads.
-# When executed, each thread will announce that it is starting, execute sfExecuteInSnowflake(),
-# then announce that it is exiting.
-class sfExecutionThread (threading.Thread):
-   def __init__(self, threadID, sqlQuery):
-      threading.Thread.__init__(self)
-      self.threadID = threadID
-      self.sqlQuery = sqlQuery
-   def run(self):
-      print('Starting {0}: {1}'.format(self.threadID, self.sqlQuery))
-      sfExecuteInSnowflake(self.sqlQuery)
-      print('Exiting {0}: {1}'.format(self.threadID, self.sqlQuery))
-
-# Define the function that will be executed within each thread
-def sfExecuteInSnowflake (sfQuery):
+# Chunk sizing. COPY INTO loads one file per thread, and a warehouse has 8 load threads per
+# X-Small node, doubling with every size step. Files of 100-250MB compressed load best; smaller
+# files are only worth it when there is too little data to give every thread a file.
+WAREHOUSE_LOAD_THREADS = {
+    'X-SMALL': 8, 'SMALL': 16, 'MEDIUM': 32, 'LARGE': 64, 'X-LARGE': 128,
+    '2X-LARGE': 256, '3X-LARGE': 512, '4X-LARGE': 1024, '5X-LARGE': 2048, '6X-LARGE': 4096}
+MIN_CHUNK_MB = 10
+MAX_CHUNK_MB = 250
+
+# Where the split files are written (--splitdir).
+SPLIT_DIRECTORY = 'C:/Users/north/OneDrive/Documents/Snowflake/SampleData/SplitFIleFdr/'
+
+# Splitter compression (--compression) -> SOURCE_COMPRESSION of the PUT.
+SOURCE_COMPRESSION = {'gzip': 'GZIP', 'zstd': 'ZSTD', 'none': 'NONE'}
+
+def split_compression(connection_parameters):
+
+    # Returns the --splitformat and --compression of a run, lowercased, raising a ValueError that
+    # names the codecs the splitter writes for an unknown CSV compression (the splitter checks
+    # the Parquet ones).
+    split_format = connection_parameters.get('splitformat', 'csv').lower()
+    compression = connection_parameters.get('compression', 'snappy' if split_format == 'parquet' else 'gzip').lower()
+    if split_format != 'parquet' and compression not in SOURCE_COMPRESSION:
+        raise ValueError('--compression for CSV files must be one of {0}, not {1!r}'.format(
+            ', '.join(SOURCE_COMPRESSION), compression))
+    return split_format, compression
+
+def warehouse_size(conn, warehouse):
+
+    # Returns the size of the warehouse, e.g. 'X-SMALL', from SHOW WAREHOUSES.
+    cur = conn.cursor()
+    try:
+        cur.execute("SHOW WAREHOUSES LIKE '{0}'".format(warehouse))
+        row = cur.fetchone()
+        column_names = [col[0] for col in cur.description]
+        return row[column_names.index('size')].upper()
+    finally:
+        cur.close()
+
+def table_columns(conn, table):
+    # The columns of a table as csv_splitter.Columns, from DESCRIBE TABLE.
+    cur = conn.cursor()
+    try:
+        cur.execute('DESCRIBE TABLE {0}'.format(table))
+        column_names = [col[0].lower() for col in cur.description]
+        name, kind, null = (column_names.index(column) for column in ('name', 'type', 'null?'))
+        return [csv_splitter.Column(row[name], row[kind], row[null] == 'Y') for row in cur.fetchall()
+                if 'kind' not in column_names or row[column_names.index('kind')] == 'COLUMN']
+    finally:
+        cur.close()
+
+def input_tables(connection_parameters):
+
+    """
+        PURPOSE:
+            The files a run loads and the table each one goes to, in order. --largefile is a
+            file, a glob or a directory (of .csv files) to load into CUSTOMER_LARGE, and
+            --tables TABLE=<file, glob or directory>,... loads several tables in one run.
+            Tables without a database and schema are in --database.--schema.
+        RETURNS:
+            Dict of file path -> fully qualified table.
+    """
+    if 'tables' in connection_parameters:
+        specs = [spec.split('=', 1) for spec in connection_parameters['tables'].split(',')]
+    else:
+        specs = [['CUSTOMER_LARGE', connection_parameters['largefile']]]
+    inputs = {}
+    for spec in specs:
+        if len(spec) != 2:
+            raise ValueError('--tables takes TABLE=<file, glob or directory>,..., not {0!r}'.format(
+                connection_parameters['tables']))
+        table = spec[0].strip()
+        if '.' not in table:
+            table = '{0}.{1}.{2}'.format(connection_parameters['database'], connection_parameters['schema'], table)
+        for path in csv_splitter.expand_inputs(spec[1].strip()):
+            inputs.setdefault(path, table)
+    return inputs
+
+def chunk_target_mb(size, input_bytes, compression_ratio=0.25):
+
+    """
+        PURPOSE:
+            Picks the compressed MB per split file for a warehouse size: one file per load
+            thread, kept between MIN_CHUNK_MB and MAX_CHUNK_MB.
+        INPUTS:
+            size: Warehouse size as reported by SHOW WAREHOUSES (e.g. 'X-Small').
+            input_bytes: Size of the uncompressed input file.
+            compression_ratio: Expected gzip size / raw size of the input.
+        RETURNS:
+            Target size in MB.
+    """
+    threads = WAREHOUSE_LOAD_THREADS.get(size.upper(), WAREHOUSE_LOAD_THREADS['X-SMALL'])
+    per_thread_mb = input_bytes * compression_ratio / (1024 * 1024) / threads
+    return min(max(per_thread_mb, MIN_CHUNK_MB), MAX_CHUNK_MB)
+
+# ==============================================================================================
+# Statements are run by an sfStatementExecutor: a fixed number of threads (maxConcurrency) run the
+# submitted statements on pooled sessions, so the warehouse gets as many statements at once as it
+# should and no more. Every statement produces an sfStatementResult, transient failures (lost
+# connections, expired sessions) are retried with exponential backoff, and barrier() waits for
+# everything submitted so far, so one phase of the load can finish before the next one starts.
+# With an sfConcurrencyLimit the threads are only the upper bound: the limit decides how many of
+# them run a statement at a time.
+class sfStatementResult:
+    def __init__(self, statement):
+        self.statement = statement
+        self.queryId = None
+        self.rowsLoaded = None
+        self.elapsed = 0.0
+        self.attempts = 0
+        self.error = None
+        # When it started running (time.time()) and how long it waited for a free thread first.
+        self.started = None
+        self.queued = 0.0
+        # Seconds it waited for warehouse resources (seen by sfAsyncQueryEngine only) and the
+        # sfConcurrencyLimit in force when it started.
+        self.warehouseQueued = 0.0
+        self.concurrency = None
+        # The stage files a COPY names, when its submitter gave them.
+        self.files = None
+
+    @property
+    def ok(self):
+        return self.error is None
+
+# Snowflake error numbers worth retrying: could not connect, no response, session token expired.
+TRANSIENT_ERRNOS = {250001, 250003, 390114}
+
+def is_transient(error):
+    if isinstance(error, (sf.OperationalError, sf.InterfaceError)):
+        return True
+    return getattr(error, 'errno', None) in TRANSIENT_ERRNOS
+
+def rows_loaded(cursor):
+    # COPY returns one row per file with a rows_loaded column; other statements report rowcount.
+    column_names = [col[0].lower() for col in cursor.description or []]
+    if 'rows_loaded' in column_names:
+        index = column_names.index('rows_loaded')
+        return sum(row[index] or 0 for row in cursor.fetchall())
+    return cursor.rowcount
+
+def execute_batch(sfConnection, statements):
+
+    """
+        PURPOSE:
+            Runs statements that need nothing in between them (DDL, USE, ALTER SESSION) as one
+            multi-statement request, so they cost one round trip instead of one each. Snowflake
+            runs them in order and stops at the first one that fails; the ones before it are not
+            rolled back, and USE / ALTER SESSION statements stay in force for the session.
+        RETURNS:
+            An sfStatementResult per statement, with its query id and row count. When the request
+            fails, the statements whose results were not read yet all carry the error, since
+            Snowflake does not say which of them ran.
+    """
+    results = [sfStatementResult(statement) for statement in statements]
+    started = time.monotonic()
+    cursor = sfConnection.cursor()
+    done = 0
+    try:
+        cursor.execute(';\n'.join(statement.rstrip().rstrip(';') for statement in statements),
+                       num_statements=len(statements))
+        for result in results:
+            result.attempts = 1
+            result.queryId = cursor.sfqid
+            result.rowsLoaded = rows_loaded(cursor)
+            done += 1
+            if done < len(results) and not cursor.nextset():
+                raise RuntimeError('Only {0} of {1} statement results came back'.format(done, len(results)))
+    except Exception as e:
+        logging.error('Batch of %d statements failed after %d: %s', len(statements), done, e)
+        for result in results[done:]:
+            result.attempts = 1
+            result.error = e
+    finally:
+        cursor.close()
+    elapsed = time.monotonic() - started
+    for result in results:
+        result.elapsed = elapsed / len(results)
+        logging.info('%s in batch, query id %s: %s', 'Done' if result.ok else 'FAILED',
+                     result.queryId, result.statement)
+    return results
+
+class sfStatementExecutor:
+    def __init__(self, pool, maxConcurrency=4, retries=3, backoffSeconds=2.0, limit=None):
+        self.pool = pool
+        self.retries = retries
+        self.backoffSeconds = backoffSeconds
+        self.limit = limit
+        self.threads = ThreadPoolExecutor(max_workers=maxConcurrency)
+        self.lock = threading.Lock()
+        self.pending = []
+
+    def submit(self, statement, on_success=None, units=None, files=None):
+
+        """
+            PURPOSE:
+                Queues statement to run on the next free thread.
+            INPUTS:
+                on_success: Called with the sfStatementResult on the executor thread once the
+                            statement succeeded; an exception it raises marks the result failed.
+                units: Bytes the statement moves, for the sfConcurrencyLimit.
+                files: The stage files a COPY names, kept as the result's .files.
+            RETURNS:
+                A Future of the sfStatementResult. It never raises; failures are in .error.
+        """
+        future = self.threads.submit(self.execute, statement, on_success, time.monotonic(), units, files)
+        with self.lock:
+            self.pending.append(future)
+        return future
+
+    def execute(self, statement, on_success=None, submitted=None, units=None, files=None):
+        result = sfStatementResult(statement)
+        result.files = files
+        if self.limit is not None:
+            ticket = self.limit.acquire()
+            result.concurrency = self.limit.limit
+        started = time.monotonic()
+        result.started = time.time()
+        if submitted is not None:
+            result.queued = started - submitted
+        while True:
+            result.attempts += 1
+            try:
+                with self.pool.connection() as sfConnection:
+                    cursor = sfConnection.cursor()
+                    try:
+                        cursor.execute(statement)
+                        result.queryId = cursor.sfqid
+                        result.rowsLoaded = rows_loaded(cursor)
+                    finally:
+                        cursor.close()
+                result.error = None
+                break
+            except Exception as e:
+                result.error = e
+                if result.attempts > self.retries or not is_transient(e):
+                    logging.error('Failed after %d attempt(s): %s: %s', result.attempts, statement, e)
+                    break
+                delay = self.backoffSeconds * 2 ** (result.attempts - 1) * random.uniform(0.5, 1.5)
+                logging.warning('Retrying in %.1fs after %s: %s', delay, e, statement)
+                time.sleep(delay)
+        result.elapsed = time.monotonic() - started
+        if self.limit is not None:
+            self.limit.release(result, units, ticket)
+        if result.ok and on_success is not None:
+            try:
+                on_success(result)
+            except Exception as e:
+                logging.exception('Follow-up of %s failed', statement)
+                result.error = e
+        logging.info('%s in %.1fs, query id %s: %s', 'Done' if result.ok else 'FAILED',
+                     result.elapsed, result.queryId, statement)
+        return result
+
+    def barrier(self):
+        # Waits for every statement submitted so far, including ones submitted while waiting,
+        # and returns their results in submission order.
+        results = []
+        while True:
+            with self.lock:
+                futures, self.pending = self.pending, []
+            if not futures:
+                return results
+            results.extend(future.result() for future in futures)
+
+    def shutdown(self):
+        self.threads.shutdown(wait=True)
+
+def report(phase, results):
+    # Prints a one-line summary of a phase and returns its failed results.
+    failed = [result for result in results if not result.ok]
+    rows = sum(result.rowsLoaded or 0 for result in results if result.ok)
+    print('{0}: {1} statements, {2} failed, {3} retries, {4} rows, {5:.1f}s'.format(
+        phase, len(results), len(failed), sum(result.attempts - 1 for result in results), rows,
+        sum(result.elapsed for result in results)))
+    return failed
+
+# sfConcurrencyLimit adapts how many statements of one kind run at once, AIMD style as in TCP
+# congestion control, so a load settles on the concurrency that suits the warehouse and the
+# network instead of --uploaders / --copiers being tuned by hand for every warehouse size. The
+# limit is revisited after each round, i.e. once `limit` statements started under it finished:
+#  - it is cut by `decrease` when a statement of the round was retried after a transient error,
+#    spent more than maxQueuedShare of its time queued on the warehouse, or when the round's
+#    seconds per MB moved rose past `tolerance` times the best round so far: the statements are
+#    sharing the upload bandwidth or waiting for warehouse load threads, so more of them only
+#    adds latency;
+#  - it steps back by one when the last step up did not raise the round's MB/s by `gain`, and
+#    does not try that step again for probeRounds rounds;
+#  - otherwise, if the round used every slot, it grows by one up to maximum.
+# Statements that started before a change are left out of the rounds after it, so one congested
+# round does not cut the limit twice. PUTs and COPYs get a limit each, one being bound by upload
+# bandwidth and the other by warehouse slots. Warehouse queueing is only seen by the
+# sfAsyncQueryEngine, which polls the query status; on threads it shows up as latency.
+class sfConcurrencyLimit:
+    def __init__(self, name, initial=2, minimum=1, maximum=16, decrease=0.5, tolerance=1.5, gain=0.05,
+                 maxQueuedShare=0.1, probeRounds=8):
+        self.name = name
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = min(max(initial, minimum), maximum)
+        self.decrease = decrease
+        self.tolerance = tolerance
+        self.gain = gain
+        self.maxQueuedShare = maxQueuedShare
+        self.probeRounds = probeRounds
+        self.condition = threading.Condition()
+        self.running = 0
+        self.epoch = 0
+        self.round = []
+        self.saturated = False
+        self.raised = False
+        self.ceiling = None
+        self.steadyRounds = 0
+        self.bestCost = None
+        self.lastThroughput = None
+        self.history = [self.limit]
+
+    def acquire(self):
+        # Waits for a free slot; returns the ticket to give back to release().
+        with self.condition:
+            while self.running >= self.limit:
+                self.condition.wait()
+            return self.take()
+
+    def try_acquire(self):
+        # acquire() for callers that cannot block (the asyncio loop); None if no slot is free.
+        with self.condition:
+            if self.running >= self.limit:
+                return None
+            return self.take()
+
+    def take(self):
+        self.running += 1
+        if self.running >= self.limit:
+            self.saturated = True
+        return self.epoch
+
+    def release(self, result, units=None, ticket=None):
+
+        """
+            PURPOSE:
+                Gives back the slot of a finished statement and adds it to the current round.
+            INPUTS:
+                result: The statement's sfStatementResult.
+                units: Bytes it moved, None if not known.
+                ticket: What acquire() returned; statements started under an earlier limit
+                        are not counted.
+        """
+        with self.condition:
+            self.running -= 1
+            if ticket == self.epoch:
+                retried = result.attempts > 1 or (result.error is not None and is_transient(result.error))
+                self.round.append((result.elapsed, result.warehouseQueued, units or 0, retried))
+                if len(self.round) >= self.limit:
+                    self.adjust()
+            self.condition.notify_all()
+
+    def adjust(self):
+        # Called with the condition held at the end of a round.
+        samples, self.round = self.round, []
+        seconds = sum(sample[0] for sample in samples)
+        queued = sum(sample[1] for sample in samples)
+        moved = sum(sample[2] for sample in samples)
+        cost = seconds / moved if moved else None
+        # Little's law: `limit` statements at once, each moving moved / seconds bytes a second.
+        throughput = self.limit * moved / seconds if seconds else 0.0
+        previous = self.limit
+        if any(sample[3] for sample in samples):
+            reason = 'retries'
+            self.limit = max(self.minimum, int(self.limit * self.decrease))
+        elif queued > self.maxQueuedShare * seconds:
+            reason = 'warehouse queueing ({0:.0%} of the time)'.format(queued / seconds)
+            self.limit = max(self.minimum, int(self.limit * self.decrease))
+        elif cost is not None and self.bestCost is not None and cost > self.tolerance * self.bestCost:
+            reason = 'latency up {0:.1f}x'.format(cost / self.bestCost)
+            self.limit = max(self.minimum, int(self.limit * self.decrease))
+        elif self.raised and self.lastThroughput and throughput < self.lastThroughput * (1 + self.gain):
+            reason = 'no throughput gain'
+            self.ceiling = self.limit
+            self.limit = max(self.minimum, self.limit - 1)
+        else:
+            if self.steadyRounds >= self.probeRounds:
+                self.ceiling = None
+            if self.saturated and (self.ceiling is None or self.limit + 1 < self.ceiling):
+                reason = 'throughput {0:.1f} MB/s'.format(throughput / 1024 / 1024)
+                self.limit = min(self.maximum, self.limit + 1)
+        if cost is not None:
+            self.bestCost = cost if self.bestCost is None else min(self.bestCost, cost)
+        self.raised = self.limit > previous
+        self.lastThroughput = throughput
+        self.saturated = self.running >= self.limit
+        if self.limit == previous:
+            self.steadyRounds += 1
+            return
+        self.steadyRounds = 0
+        self.epoch += 1
+        self.history.append(self.limit)
+        logging.info('%s concurrency %d -> %d: %s', self.name, previous, self.limit, reason)
+
+    def summary(self):
+        return '{0} concurrency started at {1}, ranged {2}-{3} over {4} changes, settled at {5}'.format(
+            self.name, self.history[0], min(self.history), max(self.history), len(self.history) - 1, self.limit)
+
+# sfAsyncQueryEngine runs statements the way sfStatementExecutor does (same submit / barrier /
+# shutdown), but without holding a thread per statement: each statement is started with
+# execute_async() and its query id is polled from an asyncio event loop on one background thread.
+# The poll interval grows with the statement's age (10% of its elapsed time, kept between
+# minPollSeconds and maxPollSeconds), so short statements are noticed quickly and hours-long COPYs
+# cost a status call every few seconds. Blocking connector calls go to a few helper threads.
+# With a stateFile every query id is recorded as it is submitted and finished, together with the
+# files a COPY names, and resume() re-attaches to the ones a previous process left running; their
+# results carry the files, so the caller can tell which files the re-attached COPYs loaded. With
+# an sfConcurrencyLimit, maxInflight is the upper bound and the limit decides how many statements
+# run; the time a statement spends queued on the warehouse is taken from its status and fed to
+# the limit.
+class sfAsyncQueryEngine:
+    def __init__(self, pool, maxInflight=100, minPollSeconds=0.5, maxPollSeconds=30.0,
+                 stateFile=None, threads=8, retries=3, backoffSeconds=2.0, limit=None):
+        self.pool = pool
+        self.maxInflight = maxInflight
+        self.limit = limit
+        self.minPollSeconds = minPollSeconds
+        self.maxPollSeconds = maxPollSeconds
+        self.stateFile = stateFile
+        self.retries = retries
+        self.backoffSeconds = backoffSeconds
+        self.calls = ThreadPoolExecutor(max_workers=threads)
+        self.lock = threading.Lock()
+        self.pending = []
+        self.loop = asyncio.new_event_loop()
+        self.inflight = None
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    def submit(self, statement, on_success=None, queryId=None, units=None, files=None):
+        # Thread-safe; returns a concurrent.futures.Future of the sfStatementResult.
+        future = asyncio.run_coroutine_threadsafe(self.run_statement(statement, on_success, queryId, units, files),
+                                                  self.loop)
+        with self.lock:
+            self.pending.append(future)
+        return future
+
+    def barrier(self):
+        results = []
+        while True:
+            with self.lock:
+                futures, self.pending = self.pending, []
+            if not futures:
+                return results
+            results.extend(future.result() for future in futures)
+
+    def resume(self):
+        # Re-attaches to the statements recorded as submitted but not finished in stateFile.
+        futures = [self.submit(statement, queryId=queryId, files=files)
+                   for queryId, (statement, files) in self.unfinished()]
+        if futures:
+            print('Re-attached to {0} running statements'.format(len(futures)))
+        return futures
+
+    def shutdown(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        self.calls.shutdown()
+
+    async def run_statement(self, statement, on_success=None, queryId=None, units=None, files=None):
+        if self.inflight is None:
+            self.inflight = asyncio.Semaphore(self.maxInflight)
+        result = sfStatementResult(statement)
+        result.files = files
+        result.attempts = 1
+        submitted = time.monotonic()
+        async with self.inflight:
+            if self.limit is not None:
+                ticket = self.limit.try_acquire()
+                while ticket is None:
+                    await asyncio.sleep(0.1)
+                    ticket = self.limit.try_acquire()
+                result.concurrency = self.limit.limit
+            started = time.monotonic()
+            result.started = time.time()
+            result.queued = started - submitted
+            try:
+                if queryId is None:
+                    queryId = await self.call(self.start_query, statement)
+                    self.record(queryId, statement, 'submitted', files)
+                result.queryId = queryId
+                while True:
+                    running, queued = await self.call(self.query_state, queryId)
+                    if not running:
+                        break
+                    elapsed = time.monotonic() - started
+                    interval = min(max(elapsed / 10, self.minPollSeconds), self.maxPollSeconds)
+                    await asyncio.sleep(interval)
+                    if queued:
+                        result.warehouseQueued += interval
+                result.rowsLoaded = await self.call(self.query_rows_loaded, queryId)
+                if on_success is not None:
+                    await self.call(on_success, result)
+            except Exception as e:
+                logging.error('FAILED (query id %s): %s: %s', queryId, statement, e)
+                result.error = e
+            if queryId is not None:
+                self.record(queryId, statement, 'done' if result.ok else 'failed')
+            result.elapsed = time.monotonic() - started
+            if self.limit is not None:
+                self.limit.release(result, units, ticket)
+        logging.info('%s in %.1fs, query id %s: %s', 'Done' if result.ok else 'FAILED',
+                     result.elapsed, result.queryId, statement)
+        return result
+
+    async def call(self, function, *args):
+        # Runs a blocking connector call on a helper thread, retrying transient failures.
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                return await self.loop.run_in_executor(self.calls, function, *args)
+            except Exception as e:
+                if attempt > self.retries or not is_transient(e):
+                    raise
+                await asyncio.sleep(self.backoffSeconds * 2 ** (attempt - 1) * random.uniform(0.5, 1.5))
+
+    def start_query(self, statement):
+        with self.pool.connection() as sfConnection:
+            cursor = sfConnection.cursor()
+            cursor.execute_async(statement)
+            return cursor.sfqid
+
+    def query_state(self, queryId):
+        # Returns (still running, queued on the warehouse); raises the statement's error if it failed.
+        with self.pool.connection() as sfConnection:
+            status = sfConnection.get_query_status_throw_if_error(queryId)
+            return (sfConnection.is_still_running(status),
+                    str(getattr(status, 'name', status)).startswith('QUEUED'))
+
+    def query_rows_loaded(self, queryId):
+        with self.pool.connection() as sfConnection:
+            cursor = sfConnection.cursor()
+            try:
+                cursor.get_results_from_sfqid(queryId)
+                return rows_loaded(cursor)
+            finally:
+                cursor.close()
+
+    def record(self, queryId, statement, state, files=None):
+        if self.stateFile is None:
+            return
+        entry = {'queryId': queryId, 'statement': statement, 'state': state}
+        if files is not None:
+            entry['files'] = files
+        with self.lock, open(self.stateFile, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+
+    def unfinished(self):
+        if self.stateFile is None or not os.path.exists(self.stateFile):
+            return []
+        submitted = {}
+        with open(self.stateFile) as f:
+            for line in f:
+                entry = json.loads(line)
+                if entry['state'] == 'submitted':
+                    submitted[entry['queryId']] = (entry['statement'], entry.get('files'))
+                else:
+                    submitted.pop(entry['queryId'], None)
+        return list(submitted.items())
+
+# Open a session the way every statement here expects it to be set up
+def sfSession(argv):
 
     # Establish connection
     ## Make sure you insert the right login credentials below.
-    list_conn_wh = sfConnect(sys.argv)
+    list_conn_wh = sfConnect(argv)
     sfConnection=list_conn_wh[0]
     sfWarehouse=list_conn_wh[1]
 
-    # Use role defined in function input
-    sfConnection.cursor().execute('USE ROLE ACCOUNTADMIN')
-    # Use warehouse defined in function input
-    sfConnection.cursor().execute('USE WAREHOUSE {0}'.format(sfWarehouse))
+    # Use role and warehouse defined in function input and increase the session timeout if
+    # desired, in one round trip
+    failed = [result for result in execute_batch(sfConnection, [
+        'USE ROLE ACCOUNTADMIN',
+        'USE WAREHOUSE {0}'.format(sfWarehouse),
+        'ALTER SESSION SET STATEMENT_TIMEOUT_IN_SECONDS = 86400']) if not result.ok]
+    if failed:
+        sfConnection.close()
+        raise failed[0].error
+
+    return sfConnection
+
+#==================================================================================================
+# A pool of sessions shared by every thread of the load. Each connection is logged in and set
+# up by sfSession() once, then checked out for a statement and checked back in, instead of
+# logging in and running USE ROLE / USE WAREHOUSE / ALTER SESSION for every statement.
+# Connections that sat idle longer than maxIdleSeconds are closed instead of reused, and ones
+# idle longer than healthCheckSeconds are checked with SELECT 1 before they are handed out.
+class sfConnectionPool:
+    def __init__(self, argv, size=8, maxIdleSeconds=3600, healthCheckSeconds=300):
+        self.argv = argv
+        self.size = size
+        self.maxIdleSeconds = maxIdleSeconds
+        self.healthCheckSeconds = healthCheckSeconds
+        self.idle = []
+        self.created = 0
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def acquire(self, timeout=None):
+
+        """
+            PURPOSE:
+                Checks out a session, waiting up to timeout seconds (None = forever) for one
+                to be returned when all `size` sessions are in use.
+            RETURNS:
+                A connection that must be given back with release().
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.condition:
+            while True:
+                if self.closed:
+                    raise RuntimeError('Connection pool is closed')
+                if self.idle:
+                    sfConnection, lastUsed = self.idle.pop()
+                    if time.monotonic() - lastUsed > self.maxIdleSeconds:
+                        self.discard(sfConnection)
+                        continue
+                    break
+                if self.created < self.size:
+                    self.created += 1
+                    sfConnection, lastUsed = None, None
+                    break
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError('No Snowflake session free after {0}s'.format(timeout))
+                self.condition.wait(remaining)
+
+        # Log in or health-check outside the lock so other threads are not held up.
+        if sfConnection is not None and time.monotonic() - lastUsed > self.healthCheckSeconds \
+                and not self.is_healthy(sfConnection):
+            with self.condition:
+                self.discard(sfConnection)
+                self.created += 1
+            sfConnection = None
+        if sfConnection is None:
+            try:
+                sfConnection = sfSession(self.argv)
+            except Exception:
+                with self.condition:
+                    self.created -= 1
+                    self.condition.notify()
+                raise
+        return sfConnection
 
-    # Increase the session timeout if desired
-    sfConnection.cursor().execute('ALTER SESSION SET STATEMENT_TIMEOUT_IN_SECONDS = 86400')
+    def release(self, sfConnection, broken=False):
+        # Checks a session back in. Broken and closed sessions (and any returned after close())
+        # are closed and dropped, so the next acquire() logs in a new one in their place.
+        with self.condition:
+            if broken or self.closed or sfConnection.is_closed():
+                self.discard(sfConnection)
+            else:
+                self.idle.append((sfConnection, time.monotonic()))
+            self.condition.notify()
 
+    @contextlib.contextmanager
+    def connection(self, timeout=None):
+        # A session for the with block. One that raised a transient error (a dropped or expired
+        # session) is not put back: a retry on it would fail the same way.
+        sfConnection = self.acquire(timeout)
+        broken = False
+        try:
+            yield sfConnection
+        except Exception as e:
+            broken = is_transient(e)
+            raise
+        finally:
+            self.release(sfConnection, broken)
 
+    def is_healthy(self, sfConnection):
+        try:
+            sfConnection.cursor().execute('SELECT 1')
+            return True
+        except Exception:
+            logging.info('Recycling a Snowflake session that failed its health check')
+            return False
 
-    # Execute the query sfQuery in Snowflake
-    sfConnection.cursor().execute(sfQuery)
+    def discard(self, sfConnection):
+        # Caller holds the condition.
+        self.created -= 1
+        try:
+            sfConnection.close()
+        except Exception:
+            logging.exception('Closing a Snowflake session failed')
+
+    def close(self):
+        # Closes the idle sessions now and the checked-out ones as they are released.
+        with self.condition:
+            self.closed = True
+            while self.idle:
+                self.discard(self.idle.pop()[0])
+            self.condition.notify_all()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
 #==================================================================================================
+# A record of how far a load got, so that a rerun after a failure only redoes the missing work.
+# Every split file is recorded with its piece number, rows, uncompressed bytes, byte range in the
+# input (when the splitter knows it) and SHA-256, and moves from 'split' to 'uploaded' to 'copied'
+# as its PUT and COPY succeed. Like sfAsyncQueryEngine's state file this is a JSON-lines log that
+# is only appended to; reading it back replays the lines in order. The first line holds the
+# signature of the run (input file, its size and mtime, and the split settings) and the run id its
+# files are staged under; a manifest written for a different signature is started over, with a new
+# run id, since its pieces would not match. A resumed load keeps the run id, so it COPYs the files
+# the earlier run staged from where they are.
+class sfLoadManifest:
+    def __init__(self, path, signature):
+        self.path = path
+        self.signature = signature
+        self.runId = None
+        self.lock = threading.Lock()
+        self.chunks = {}
+        self.splitComplete = False
+        self.load()
 
-def clean_up(argv):
+    def load(self):
+        entries = []
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        # The last line of a killed run may be cut short.
+                        break
+        if entries and entries[0].get('signature') == self.signature and entries[0].get('runId'):
+            self.runId = entries[0]['runId']
+            for entry in entries[1:]:
+                if entry.get('splitComplete'):
+                    self.splitComplete = True
+                else:
+                    self.chunks.setdefault(entry['name'], {}).update(entry)
+            print('Resuming from {0}: {1} files recorded, {2} uploaded, {3} copied'.format(
+                self.path, len(self.chunks), len(self.names('uploaded', 'copied')), len(self.names('copied'))))
+            return
+        if entries:
+            logging.warning('%s was written for a different input or split settings; starting over',
+                            self.path)
+        self.runId = new_run_id()
+        with open(self.path, 'w') as f:
+            f.write(json.dumps({'signature': self.signature, 'runId': self.runId}) + '\n')
+
+    def append(self, entry):
+        with self.lock, open(self.path, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+            if 'name' in entry:
+                self.chunks.setdefault(entry['name'], {}).update(entry)
+
+    def chunk_split(self, piece, digest):
+        self.append({'name': os.path.basename(piece.path), 'path': piece.path, 'piece': piece.number,
+                     'rows': piece.rows, 'bytes': piece.raw_bytes, 'start': piece.start,
+                     'end': piece.end, 'source': piece.source, 'sha256': digest, 'state': 'split'})
+
+    def mark(self, names, state, queryId=None):
+        for name in names:
+            self.append({'name': name, 'state': state, 'queryId': queryId})
+
+    def split_done(self):
+        self.append({'splitComplete': True})
+        self.splitComplete = True
+
+    def names(self, *states):
+        with self.lock:
+            return sorted(name for name, chunk in self.chunks.items() if chunk.get('state') in states)
+
+    def is_staged(self, name, digest):
+        # True if this exact file was already PUT by an earlier run.
+        with self.lock:
+            chunk = self.chunks.get(name, {})
+            return chunk.get('state') in ('uploaded', 'copied') and chunk.get('sha256') == digest
+
+    def staged_pieces(self):
+        # Piece numbers the splitter does not need to write again.
+        return {self.chunks[name]['piece'] for name in self.names('uploaded', 'copied')
+                if self.chunks[name].get('piece') is not None}
+
+    def split_needed(self):
+        return not self.splitComplete or len(self.names('uploaded', 'copied')) < len(self.chunks)
+
+    def complete(self):
+        return self.splitComplete and len(self.names('copied')) == len(self.chunks)
+
+def new_run_id():
+    # A stage folder name no other load uses: the start time, readable in a LIST of the stage,
+    # and a random suffix for loads started in the same second.
+    return '{0}_{1}'.format(time.strftime('%Y%m%d%H%M%S'), uuid.uuid4().hex[:8])
+
+def file_digest(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+#==================================================================================================
+# The load pipeline. The splitter hands every finished file to chunk_ready(), which submits its
+# PUT to the upload executor. Once a file is staged it is deleted locally and added to a batch;
+# every full batch is loaded with COPY INTO ... FILES = (...) PURGE = TRUE on the COPY executor,
+# so each COPY removes the files it loaded from the stage as it completes and the load needs no
+# REMOVE at the end. A failed COPY purges nothing, which leaves its files staged for a rerun. Only
+# the files named in FILES are touched, so loads that stage to their own folders (a run id under
+# stageLocation) can share a stage. A semaphore caps the split files on disk: the splitter waits
+# in chunk_ready() once maxInflight finished files are waiting or uploading. run() ends with a
+# barrier on each executor, so every COPY is finished (or has failed) before anything that
+# follows the load, such as the MERGE of an incremental load, starts.
+# Each PUT uploads one file over one of `uploaders` sessions; putParallel is the PUT's own
+# PARALLEL option, the threads it uses to upload the parts of a large file. copyExecutor can be
+# an sfAsyncQueryEngine instead of the default `copiers`-thread sfStatementExecutor. With a
+# manifest, files an earlier run already staged are not PUT again, and run() first COPYs the ones
+# it staged but did not load. With metrics (a load_metrics.StageMetrics) every split file, PUT and
+# COPY is recorded as an event of stage 'split', 'put' or 'copy'; a split event's queued time is
+# how long the splitter waited for disk slots, i.e. for the uploads to catch up. uploadLimit and
+# copyLimit (sfConcurrencyLimits) let the PUTs and COPYs find their own concurrency, with
+# `uploaders` and `copiers` threads as the upper bound. With splitFormat='parquet' the files are
+# the splitter's Parquet files and are COPYed into the table's columns by name, rather than with
+# the named fileFormat. destinationTable can also be a dict of input file -> table for a split of
+# several files (csv_splitter.split_files): each file's pieces are then PUT to a folder of
+# stageLocation named after its table, and COPYed in batches per table.
+class sfLoadPipeline:
+    def __init__(self, pool, stageLocation, destinationTable, fileFormat, sourceCompression,
+                 uploaders=4, copiers=2, copyBatch=8, maxInflight=8, retries=3, putParallel=4,
+                 copyExecutor=None, manifest=None, metrics=None, uploadLimit=None, copyLimit=None,
+                 splitFormat='csv'):
+        self.stageLocation = stageLocation
+        self.destinationTable = destinationTable
+        self.fileFormat = fileFormat
+        self.splitFormat = splitFormat
+        self.sourceCompression = sourceCompression
+        self.copyBatch = copyBatch
+        self.putParallel = putParallel
+        self.uploadExecutor = sfStatementExecutor(pool, uploaders, retries, limit=uploadLimit)
+        self.copyExecutor = copyExecutor or sfStatementExecutor(pool, copiers, retries, limit=copyLimit)
+        self.diskSlots = threading.Semaphore(maxInflight)
+        self.batches = {}
+        self.batchLock = threading.Lock()
+        self.manifest = manifest
+        self.metrics = metrics
+        self.sizes = {}
+        self.lastChunk = time.time()
+
+    def chunk_ready(self, piece):
+        # Called by the splitter with each finished file (a csv_splitter.Piece); blocks while the
+        # disk budget is used up.
+        produced = time.time()
+        path = piece.path
+        if self.manifest is not None:
+            digest = file_digest(path)
+            if self.manifest.is_staged(os.path.basename(path), digest):
+                os.remove(path)
+                return
+            self.manifest.chunk_split(piece, digest)
+        size = os.path.getsize(path)
+        waited = time.monotonic()
+        self.diskSlots.acquire()
+        if self.metrics is not None:
+            self.metrics.record('split', self.lastChunk, produced - self.lastChunk, bytes=piece.raw_bytes,
+                                rows=piece.rows, files=1, piece=piece.number,
+                                queued=time.monotonic() - waited)
+        with self.batchLock:
+            self.sizes[os.path.basename(path)] = size
+        route = self.route(piece.source)
+        statement = "put file://{0} {1} parallel={2} auto_compress=false source_compression={3}".format(
+            os.path.abspath(path).replace(os.sep, '/'), route[1], self.putParallel,
+            self.sourceCompression)
+        future = self.uploadExecutor.submit(statement, lambda result: self.uploaded(path, route), units=size)
+
+        def put_done(future):
+            self.diskSlots.release()
+            if self.metrics is not None:
+                result = future.result()
+                self.metrics.record('put', result.started, result.elapsed, bytes=size, rows=piece.rows, files=1,
+                                    queryId=result.queryId, retries=result.attempts - 1, queued=result.queued,
+                                    concurrency=result.concurrency, error=result.error)
+
+        future.add_done_callback(put_done)
+        self.lastChunk = time.time()
+
+    def upload_files(self, pieces, order='largest'):
+
+        """
+            PURPOSE:
+                Stages the Pieces of a split that ran to the end before uploading. With
+                order='largest' the biggest files are PUT first, so the upload sessions finish
+                close together instead of one of them ending the run on a big file;
+                order='name' keeps the split order.
+        """
+        if order == 'largest':
+            pieces = sorted(pieces, key=lambda piece: os.path.getsize(piece.path), reverse=True)
+        else:
+            pieces = sorted(pieces)
+        for piece in pieces:
+            self.chunk_ready(piece)
+
+    def route(self, source):
+        # The table the pieces split from `source` go to, and the stage location they are PUT to.
+        if not isinstance(self.destinationTable, dict):
+            return self.destinationTable, self.stageLocation
+        table = self.destinationTable[source]
+        return table, '{0}{1}/'.format(self.stageLocation, table.split('.')[-1].lower())
+
+    def uploaded(self, path, route):
+        if self.manifest is not None:
+            self.manifest.mark([os.path.basename(path)], 'uploaded')
+        os.remove(path)
+        with self.batchLock:
+            batch = self.batches.setdefault(route, [])
+            batch.append(os.path.basename(path))
+            if len(batch) < self.copyBatch:
+                return
+            names = self.batches.pop(route)
+        self.copy_files(names, route)
+
+    def copy_files(self, names, route):
+        fileFormat = "(FORMAT_NAME = {0})".format(self.fileFormat)
+        if self.splitFormat == 'parquet':
+            fileFormat = "(TYPE = PARQUET) MATCH_BY_COLUMN_NAME = CASE_INSENSITIVE"
+        statement = "COPY INTO {0} FROM {1} FILES = ({2}) FILE_FORMAT = {3} PURGE = TRUE;".format(
+            route[0], route[1], ', '.join("'{0}'".format(name) for name in names), fileFormat)
+        on_success = None
+        if self.manifest is not None:
+            on_success = lambda result: self.manifest.mark(names, 'copied', result.queryId)
+        with self.batchLock:
+            size = sum(self.sizes.pop(name, 0) for name in names)
+        future = self.copyExecutor.submit(statement, on_success, units=size or None, files=names)
+        if self.metrics is not None:
+
+            def copy_done(future):
+                result = future.result()
+                self.metrics.record('copy', result.started, result.elapsed, bytes=size, rows=result.rowsLoaded,
+                                    files=len(names), queryId=result.queryId, retries=result.attempts - 1,
+                                    queued=result.queued, warehouseQueued=result.warehouseQueued or None,
+                                    concurrency=result.concurrency, error=result.error)
+
+            future.add_done_callback(copy_done)
+
+    def resume(self):
+        # COPYs the files the manifest lists as staged but not loaded, and deletes local copies
+        # of staged files that a killed run did not get to remove.
+        for name in self.manifest.names('uploaded', 'copied'):
+            path = self.manifest.chunks[name].get('path')
+            if path and os.path.exists(path):
+                os.remove(path)
+        routes = {}
+        for name in self.manifest.names('uploaded'):
+            routes.setdefault(self.route(self.manifest.chunks[name].get('source')), []).append(name)
+        for route, names in routes.items():
+            for i in range(0, len(names), self.copyBatch):
+                self.copy_files(names[i:i + self.copyBatch], route)
+
+    def run(self, split):
+
+        """
+            PURPOSE:
+                Runs split(on_chunk) with the uploads and COPYs running alongside it, and waits
+                until every file it produced is uploaded and loaded. With a manifest the split
+                is recorded as complete once split() returns.
+            RETURNS:
+                The sfStatementResults of the PUTs and of the COPYs.
+            RAISES:
+                RuntimeError if any PUT or COPY failed; failed files are left on disk.
+        """
+        try:
+            if self.manifest is not None:
+                self.resume()
+            self.lastChunk = time.time()
+            split(self.chunk_ready)
+            if self.manifest is not None:
+                self.manifest.split_done()
+        finally:
+            uploads = self.uploadExecutor.barrier()
+            with self.batchLock:
+                batches, self.batches = self.batches, {}
+            for route, names in batches.items():
+                self.copy_files(names, route)
+            copies = self.copyExecutor.barrier()
+            self.uploadExecutor.shutdown()
+            self.copyExecutor.shutdown()
+        failed = report('PUT', uploads) + report('COPY', copies)
+        for limit in (self.uploadExecutor.limit, self.copyExecutor.limit):
+            if limit is not None:
+                print(limit.summary())
+        if failed:
+            raise RuntimeError('{0} load statements failed, first: {1}'.format(len(failed), failed[0].error))
+        return uploads, copies
+#==================================================================================================
+
+def merge_changes(pool, table, delta_table, columns, changes, metrics=None):
+
+    # MERGEs the rows an incremental load COPYed into delta_table into table by the key of the
+    # csv_splitter.ChangeIndex changes (updating the rows whose key is there, inserting the
+    # others), empties delta_table and makes the index of this load the one the next compares with.
+    names = [column.name for column in columns]
+    key = [names[column] if isinstance(column, int) else column for column in changes.key]
+    updates = ', '.join('{0} = s.{0}'.format(name) for name in names if name not in key)
+    sql = "MERGE INTO {0} t USING {1} s ON {2} {3}WHEN NOT MATCHED THEN INSERT ({4}) VALUES ({5})".format(
+        table, delta_table,
+        ' AND '.join('t.{0} = s.{0}'.format(name) for name in key),
+        'WHEN MATCHED THEN UPDATE SET {0} '.format(updates) if updates else '',
+        ', '.join(names),
+        ', '.join('s.{0}'.format(name) for name in names))
+    span = metrics.span('merge') if metrics is not None else contextlib.nullcontext({})
+    with span as event:
+        with pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql)
+            event['queryId'] = cursor.sfqid
+            event['rows'] = cursor.rowcount
+            cursor.execute('TRUNCATE TABLE {0}'.format(delta_table))
+    if changes.pending():
+        changes.commit()
+    print('Merged into {0}: {1}'.format(table, changes.summary()))
 
-    # Get the password from an appropriate environment variable, if
-    # available.
-    PASSWORD = os.getenv('SNOWSQL_PWD')
-    connection_parameters = args_to_properties(argv)
-    USER = connection_parameters["user"]
-    ACCOUNT = connection_parameters["account"]
-    WAREHOUSE = connection_parameters["warehouse"]
-    DATABASE = connection_parameters["database"]
-    SCHEMA = connection_parameters["schema"]
-    LARGEFILE = connection_parameters["largefile"]
-    # Cleanup the stage and close connection
-
-    conn = sf.connect(
-    user=USER,
-    password=PASSWORD,
-    account=ACCOUNT,
-    warehouse=WAREHOUSE,
-    database=DATABASE,
-    schema=SCHEMA
-    )
-    # Use role defined in function input
-    conn.cursor().execute('USE ROLE ACCOUNTADMIN')
-
-    sql = "remove @DDB_STG01/customer pattern ='.*.csv.gz'"
-    conn.cursor().execute(sql)
-    conn.close()
 # -- <) ===============================================================================
 #++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
 # M A I N     F L O W
 #++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
-log_file_setup()
-connection_parameters = args_to_properties(sys.argv)
-
-
-# Split LARGE files
-csv_splitter.split(connection_parameters['largefile'])
-
-DATABASE = connection_parameters["database"]
-SCHEMA = connection_parameters["schema"]
-STAGE = connection_parameters["stage"]
-FILEFORMAT = connection_parameters["fileformat"]
-LARGEFILE = connection_parameters["largefile"]
-
-
-#========================================================================================
-# STEP 1 - Move split files to the Stage Location in Snowflake
-# Define the list of variables which determine the data that will be loaded
-#========================================================================================
-splittedFIles=csv_file = 'C:/Users/north/OneDrive/Documents/Snowflake/SampleData/SplitFIleFdr/*.csv'
-variablesList = [
-    {
-        'sourceLocation': f'{splittedFIles}',
-        'destinationTable': f'{STAGE}/customer/'
-    }]
-
-# Define an empty list to populate with COPY INTO statements
-PutStatements = []
-
-# Loop through the members of variablesList and construct the PUT statements
-# Use .format()  replace the {0} and {1} with variables destinationTable and sourceLocation
-for member in variablesList:
-  PutStatements.append(f"put file://{member['sourceLocation']}  {member['destinationTable']} auto_compress=true")
-  #PutStatements.append(f"put file://{member['destinationTable']} {member['sourceTable']} FILE_FORMAT = (FORMAT_NAME = {FILEFORMAT});")
-
-# Create the empty list of threads
-threads = []
-
-# Define a counter which will be used as the threadID
-counter = 0
-
-# Loop through each statement in the copyIntoStatements list,
-# adding the sfExecutionThread thread to the list of threads
-# and incrementing the counter by 1 each time.
-for statement in PutStatements:
-    threads.append(sfExecutionThread(counter, statement))
-    counter += 1
-# Execute the threads
-for thread in threads:
-    thread.start()
+def main(argv):
 
-#==============================================================================================
-# STEP 2 - Move taged files to Snowflake Tables
-# Define the list of variables which determine the data that will be loaded
-# =============================================================================================
-variablesList = [
-  {
-    'sourceLocation': f'{STAGE}/customer',
-    'destinationTable': f'{DATABASE}.{SCHEMA}.CUSTOMER_LARGE'
-  },
-  {
-    'sourceLocation': f'{STAGE}/customer',
-    'destinationTable': f'{DATABASE}.{SCHEMA}.CUSTOMER_LARGE'
-  }]
-
-# Define an empty list to populate with COPY INTO statements
-copyIntoStatements = []
-
-# Loop through the members of variablesList and construct the COPY INTO statements
-# Use .format() to replace the {0} and {1} with variables destinationTable and sourceLocation
-for member in variablesList:
-  copyIntoStatements.append("COPY INTO {0} FROM {1} FILE_FORMAT = (FORMAT_NAME = {2});".format(member['destinationTable'], member['sourceLocation'],FILEFORMAT))
-
-# Create the empty list of threads
-threads = []
-
-# Define a counter which will be used as the threadID
-counter = 1
-
-# Loop through each statement in the copyIntoStatements list,
-# adding the sfExecutionThread thread to the list of threads
-# and incrementing the counter by 1 each time.
-for statement in copyIntoStatements:
-    threads.append(sfExecutionThread(counter, statement))
-    counter += 1
-# Execute the threads
-for thread in threads:
-    thread.start()
-#-----------------------------------------------------------------------------------------
-clean_up(sys.argv)
+    # Runs the whole load: split, PUT to the stage, COPY INTO the table (which purges the staged files).
+    connection_parameters = args_to_properties(argv)
+    log_file_setup(connection_parameters.get('logfile'))
+    uploaders, copiers = load_threads(connection_parameters)
+    # Bad settings fail here, before any session logs in or file is split.
+    split_compression(connection_parameters)
+
+    # Per-stage metrics: events go to --metrics as they happen (default load_metrics.jsonl in the
+    # split directory, 'none' to turn them off); --prometheus <file> writes the stage totals for
+    # the node_exporter textfile collector and --trace <file> a Chrome trace of the run, both
+    # when the run ends, whether or not it succeeded.
+    metrics_file = connection_parameters.get(
+        'metrics', os.path.join(connection_parameters.get('splitdir', SPLIT_DIRECTORY), 'load_metrics.jsonl'))
+    metrics = load_metrics.StageMetrics(
+        eventsFile=None if metrics_file.lower() == 'none' else metrics_file,
+        prometheusFile=connection_parameters.get('prometheus'),
+        traceFile=connection_parameters.get('trace'))
+
+    # Every statement of the run uses a session from this pool (--poolsize, default one per
+    # upload and COPY thread, up to the adaptive maximum); main() closes it when the run is over.
+    try:
+        with sfConnectionPool(argv, size=int(connection_parameters.get('poolsize', uploaders + copiers))) as pool:
+            load(connection_parameters, pool, metrics)
+    finally:
+        metrics.close()
+
+def load_threads(connection_parameters):
+
+    # --concurrency adaptive (the default) lets an sfConcurrencyLimit each find how many PUTs and
+    # COPYs to run at once: they start at --uploaders / --copiers and move between 1 and
+    # --maxuploaders (default 16) / --maxcopiers (default 8), so the same settings suit any
+    # warehouse size. --concurrency fixed runs exactly --uploaders PUTs and --copiers COPYs.
+    # Returns the upload and COPY threads to start.
+    if connection_parameters.get('concurrency', 'adaptive') == 'fixed':
+        return int(connection_parameters.get('uploaders', 4)), int(connection_parameters.get('copiers', 2))
+    return int(connection_parameters.get('maxuploaders', 16)), int(connection_parameters.get('maxcopiers', 8))
+
+def load(connection_parameters, pool, metrics=None):
+
+    # The load itself, with every statement running on a session from pool, recording its stages
+    # in metrics (a load_metrics.StageMetrics) if given.
+
+    # --largefile or --tables name the files to load (see input_tables). Several files are
+    # split together by csv_splitter.split_files, on every core unless --splitworkers says
+    # otherwise, and each one's pieces are loaded into its own table.
+    inputs = input_tables(connection_parameters)
+    several = len(inputs) > 1
+    if several and (connection_parameters.get('profile', 'none').lower() != 'none'
+                    or 'partitionby' in connection_parameters or 'incremental' in connection_parameters):
+        raise ValueError('--profile, --partitionby and --incremental load one file at a time; '
+                         '{0} files were given'.format(len(inputs)))
+
+    # Split LARGE files. --splitworkers N splits with N processes (0 = every core).
+    # --chunkmb <MB> cuts files of about that many compressed MB, and --chunkmb auto picks
+    # the size from the warehouse; without it files are cut every 100,000 rows.
+    # An --incremental load (below) compares the rows in file order, so always splits serially.
+    split_workers = int(connection_parameters.get('splitworkers', 0 if several else 1)) or None
+    if 'incremental' in connection_parameters and split_workers != 1:
+        print('--incremental splits serially (--splitworkers 1)')
+        split_workers = 1
+    # --maxinflight caps the split files on disk by holding up the splitter, which a parallel
+    # split of one file cannot honour: it cuts the file into one range per worker and each worker
+    # writes all of its range's files without waiting for the uploads. (Several files are split
+    # in small ranges, handed out only a couple per worker ahead of the uploads.)
+    if not several and split_workers != 1 and 'maxinflight' in connection_parameters:
+        raise ValueError('--maxinflight cannot cap the files of a parallel split of one file; '
+                         'use --splitworkers 1 or leave out --maxinflight')
+    chunk_mb = connection_parameters.get('chunkmb')
+    if chunk_mb == 'auto':
+        with pool.connection() as conn:
+            size = warehouse_size(conn, connection_parameters['warehouse'])
+        chunk_mb = chunk_target_mb(size, sum(os.path.getsize(path) for path in inputs))
+        print('Warehouse size {0}: splitting into ~{1:.0f}MB compressed files'.format(size, chunk_mb))
+    target_size = int(float(chunk_mb) * 1024 * 1024) if chunk_mb else None
+
+    # The splitter compresses the files itself (--compression gzip|zstd|none, default gzip,
+    # --compressionlevel N), so PUT does not have to read and compress every byte again.
+    # A serial split compresses each file on every core; parallel split workers use one each.
+    # Files without quoted newlines are cut as raw byte slices instead of being parsed.
+    # --splitformat parquet writes typed Parquet files instead (see below), whose columns are
+    # compressed with --compression snappy (the default), gzip, zstd or none.
+    split_format, compression = split_compression(connection_parameters)
+    source_compression = 'NONE' if split_format == 'parquet' else SOURCE_COMPRESSION[compression]
+    compression_level = connection_parameters.get('compressionlevel')
+    compression_threads = int(connection_parameters.get('compressionthreads',
+                                                        os.cpu_count() if split_workers == 1 else 1))
+
+    DATABASE = connection_parameters["database"]
+    SCHEMA = connection_parameters["schema"]
+    STAGE = connection_parameters["stage"]
+    FILEFORMAT = connection_parameters["fileformat"]
+    LARGEFILE, TABLE = next(iter(inputs.items()))
+    SPLIT_DIR = connection_parameters.get('splitdir', SPLIT_DIRECTORY)
+
+
+    #========================================================================================
+    # STEP 1 - Move split files to the Stage Location in Snowflake
+    # STEP 2 - Move staged files to Snowflake Tables
+    # Both steps run as a pipeline while the file is being split: every split file is PUT as
+    # soon as the splitter closes it (and then deleted locally), and staged files are COPYed
+    # in batches as soon as they arrive, so splitting, uploading and loading overlap.
+    # --uploaders / --copiers set the number of PUT / COPY sessions (where the adaptive limits
+    # start, see load_threads()), --copybatch the files per COPY, --maxinflight how many
+    # finished split files may wait on disk for upload, and --retries how often a PUT or COPY
+    # that failed transiently is retried. --putparallel sets PUT's PARALLEL option (threads per
+    # file), and --putmode directory splits the whole file before uploading, largest files first.
+    #========================================================================================
+    uploaders, copiers = load_threads(connection_parameters)
+    uploadLimit = copyLimit = None
+    if connection_parameters.get('concurrency', 'adaptive') != 'fixed':
+        uploadLimit = sfConcurrencyLimit('PUT', int(connection_parameters.get('uploaders', 4)), maximum=uploaders)
+        copyLimit = sfConcurrencyLimit('COPY', int(connection_parameters.get('copiers', 2)), maximum=copiers)
+
+    # --copymode async runs the COPYs on an sfAsyncQueryEngine, with as many running at once as
+    # the COPY threads would run and their query ids kept in --asyncstate, so a rerun first
+    # re-attaches to COPYs that a killed run left running. The files those COPYs loaded are
+    # marked copied in the manifest below: their PURGE has taken them off the stage, so the
+    # manifest must not COPY them again.
+    copyExecutor = None
+    reattached = []
+    if connection_parameters.get('copymode', 'threads') == 'async':
+        copyExecutor = sfAsyncQueryEngine(
+            pool, maxInflight=copiers, limit=copyLimit,
+            stateFile=connection_parameters.get('asyncstate', os.path.join(SPLIT_DIR, 'async_queries.jsonl')))
+        reattached = [future.result() for future in copyExecutor.resume()]
+        for result in reattached:
+            print('Re-attached COPY {0}: {1}'.format(result.queryId, 'loaded' if result.ok else result.error))
+
+    # --manifest keeps a record of every split file and how far its PUT and COPY got (default
+    # load_manifest.jsonl in the split directory, 'none' to turn it off). Rerun after a failure,
+    # the load skips the pieces already staged (the raw and row-count splits do not even write
+    # them), COPYs the staged ones that were not loaded, and does not split again at all if the
+    # split had finished and every file was staged. Delete the manifest to load the same file again.
+    # --profile checks every row against the table's columns (DESCRIBE TABLE) while it is split:
+    # 'reject' leaves rows that would fail the COPY (too long, bad number or date, wrong column
+    # count, NULL in a NOT NULL column) out of the split files and writes them to --rejectfile
+    # (default rejects.csv in the split directory); 'fail' stops the load at the first such row,
+    # and unless --putmode says otherwise splits the whole file before anything is uploaded.
+    # Either way a profile of the columns is printed once the split is done.
+    columns = None
+    profile = None
+    profile_mode = connection_parameters.get('profile', 'none').lower()
+    if profile_mode != 'none':
+        with pool.connection() as conn:
+            columns = table_columns(conn, TABLE)
+        profile = csv_splitter.Profile(columns, reject_path=connection_parameters.get(
+            'rejectfile', os.path.join(SPLIT_DIR, 'rejects.csv')) if profile_mode == 'reject' else None)
+
+    # --partitionby <column> splits the rows of each --partitions period of a date column (year,
+    # month or day, the default) or of each of N hash buckets of a key column (--partitions N)
+    # into files of their own, so the table is loaded clustered on that column; --maxopenfiles
+    # caps the split files written at once (default 32).
+    partition_by = None
+    if 'partitionby' in connection_parameters:
+        partitions = connection_parameters.get('partitions', 'day')
+        partition_by = csv_splitter.Partitioning(
+            connection_parameters['partitionby'],
+            ranges=None if partitions.isdigit() else partitions,
+            buckets=int(partitions) if partitions.isdigit() else None,
+            max_open_files=int(connection_parameters.get('maxopenfiles', 32)))
+
+    # --incremental <key columns> loads only the rows that are new or changed since the last
+    # incremental load of the file: --rowindex (default CUSTOMER_LARGE.rowindex in the split
+    # directory) keeps a hash of every row by key, the split writes just the rows whose hash
+    # differs, they are COPYed into the transient table CUSTOMER_LARGE_DELTA and MERGEd into
+    # the table from there. The index only takes the new hashes once the MERGE is done, so a
+    # failed run finds the same changes again. Rows missing from the file stay in the table.
+    changes = None
+    delta_table = f'{TABLE}_DELTA'
+    if 'incremental' in connection_parameters:
+        key = [column.strip() for column in connection_parameters['incremental'].split(',')]
+        changes = csv_splitter.ChangeIndex(
+            connection_parameters.get('rowindex', os.path.join(SPLIT_DIR, TABLE.split('.')[-1] + '.rowindex')), key)
+        with pool.connection() as conn:
+            if columns is None:
+                columns = table_columns(conn, TABLE)
+            conn.cursor().execute('CREATE TRANSIENT TABLE IF NOT EXISTS {0} LIKE {1}'.format(delta_table, TABLE))
+
+    # --splitformat parquet types the split files by the table's columns (DESCRIBE TABLE, per
+    # table when several are loaded) and writes them in row groups of --rowgroupsize rows
+    # (default 100,000). They are COPYed with MATCH_BY_COLUMN_NAME, so the warehouse reads typed
+    # columns rather than parsing text, and the columns compress better than gzipped CSV rows.
+    table_columns_for = {}
+    if split_format == 'parquet':
+        with pool.connection() as conn:
+            for table in set(inputs.values()):
+                table_columns_for[table] = columns if table == TABLE and columns else table_columns(conn, table)
+
+    manifest = None
+    manifest_path = connection_parameters.get('manifest', os.path.join(SPLIT_DIR, 'load_manifest.jsonl'))
+    if manifest_path.lower() != 'none':
+        stats = [os.stat(path) for path in inputs]
+        files = {'largefile': [os.path.abspath(path) for path in inputs], 'size': [stat.st_size for stat in stats],
+                 'mtime': [stat.st_mtime_ns for stat in stats], 'table': list(inputs.values())}
+        if not several:
+            # The signature of a one file load is the one manifests had before several files could be loaded.
+            files = {name: values[0] for name, values in files.items()}
+        manifest = sfLoadManifest(manifest_path, {
+            **files,
+            'workers': split_workers, 'targetSize': target_size, 'compression': compression,
+            'compressionLevel': compression_level, 'profile': profile_mode,
+            'partitionBy': connection_parameters.get('partitionby'),
+            'partitions': connection_parameters.get('partitions'),
+            'incremental': connection_parameters.get('incremental'), 'splitFormat': split_format,
+            'rowGroupSize': connection_parameters.get('rowgroupsize')})
+        for result in reattached:
+            if result.ok and result.files:
+                manifest.mark([name for name in result.files if name in manifest.chunks], 'copied', result.queryId)
+        if manifest.complete():
+            print('{0} is already loaded according to {1}'.format(', '.join(inputs), manifest_path))
+            if changes is not None and changes.pending():
+                merge_changes(pool, TABLE, delta_table, columns, changes, metrics)
+            return
+    if changes is not None and (manifest is None or not manifest.chunks):
+        # A fresh load starts from an empty delta table (a resumed one keeps the rows its
+        # COPYs loaded); TRUNCATE also drops the table's load metadata, so files of the
+        # same name and content as an earlier run's are loaded again.
+        with pool.connection() as conn:
+            conn.cursor().execute('TRUNCATE TABLE {0}'.format(delta_table))
+
+    # Every run stages its files under a folder of its own, so loads running at the same time
+    # never COPY or purge each other's files; a resumed run reuses the folder of the run it resumes.
+    run_id = manifest.runId if manifest is not None else new_run_id()
+    print('Staging to {0}/customer/{1}/'.format(STAGE, run_id))
+    pipeline = sfLoadPipeline(
+        pool,
+        stageLocation=f'{STAGE}/customer/{run_id}/',
+        destinationTable=inputs if several else TABLE if changes is None else delta_table,
+        fileFormat=FILEFORMAT,
+        sourceCompression=source_compression,
+        splitFormat=split_format,
+        uploaders=uploaders,
+        copiers=copiers,
+        copyBatch=int(connection_parameters.get('copybatch', 8)),
+        maxInflight=int(connection_parameters.get('maxinflight', 8)),
+        retries=int(connection_parameters.get('retries', 3)),
+        putParallel=int(connection_parameters.get('putparallel', 4)),
+        copyExecutor=copyExecutor,
+        manifest=manifest,
+        metrics=metrics,
+        uploadLimit=uploadLimit,
+        copyLimit=copyLimit)
+
+    def split(on_chunk):
+        if manifest is not None and not manifest.split_needed():
+            return
+        row_group_size = int(connection_parameters.get('rowgroupsize', 100000))
+        if several:
+            csv_splitter.split_files(
+                list(inputs), output_path=SPLIT_DIR, workers=split_workers,
+                target_size=target_size, size_basis='compressed',
+                compression=None if compression == 'none' else compression,
+                compression_level=int(compression_level) if compression_level else None,
+                compression_threads=compression_threads, on_chunk=on_chunk, file_format=split_format,
+                columns={path: table_columns_for.get(table) for path, table in inputs.items()},
+                row_group_size=row_group_size)
+            return
+        csv_splitter.split(
+            LARGEFILE, output_path=SPLIT_DIR, workers=split_workers,
+            target_size=target_size, size_basis='compressed',
+            compression=None if compression == 'none' else compression,
+            compression_level=int(compression_level) if compression_level else None,
+            compression_threads=compression_threads, raw_copy='auto', on_chunk=on_chunk,
+            skip_pieces=manifest.staged_pieces() if manifest is not None else (), profile=profile,
+            partition_by=partition_by, changes=changes, file_format=split_format,
+            columns=table_columns_for.get(TABLE), row_group_size=row_group_size)
+        if changes is not None:
+            print('Changes since the last load: {0}'.format(changes.summary()))
+        if profile is not None:
+            print(profile.summary())
+            logging.info('Profile of %s:\n%s', LARGEFILE, profile.summary())
+
+    def split_then_upload(on_chunk):
+        # --putmode directory: split everything first, then fan the files out over the upload
+        # sessions in --putorder (largest first by default).
+        pieces = []
+        split(pieces.append)
+        pipeline.upload_files(pieces, connection_parameters.get('putorder', 'largest'))
+
+    if connection_parameters.get('putmode', 'directory' if profile_mode == 'fail' else 'pipeline') == 'directory':
+        pipeline.run(split_then_upload)
+    else:
+        pipeline.run(split)
+    #-----------------------------------------------------------------------------------------
+    # run() returned, so every PUT and COPY is done and the COPYs have purged what they loaded.
+    if changes is not None:
+        merge_changes(pool, TABLE, delta_table, columns, changes, metrics)
+
+# The main flow is guarded so the splitter's worker processes can re-import this
+# module safely on platforms that spawn rather than fork.
+if __name__ == '__main__':
+    main(sys.argv)
 #=========================================================================================
 #                     E           N              D
 #=========================================================================================
 # OBSERVATION- As an experiment, there were 3 jobs fired in this program. They were each assigned a
 # separate thread. You will see that even though they were fired 1 after the other, they did end in the
 # same order since they were processed parallely. It is assumed that the tasks did not have dependancies.
-# This process increases the performance drastically.
+# This process increases the performance drastically. The statements now run on a bounded executor
+# instead of one thread each, and each phase waits for the previous one where it depends on it.
 #
 #------------------------------------------------------------------------------------------------
 # Whilst Snowflake is designed for elastic warehouses that can be scaled up on demand, as
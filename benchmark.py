@@ -0,0 +1,625 @@
+# Offline benchmarks for the splitter, the bulk load and the fetch methods.
+# Snowflake is simulated by a fake snowflake.connector (installed for this process only) whose
+# PUT, COPY and SELECT take a configurable latency plus their bytes over a configurable
+# bandwidth, so runs measure the client side of a load without an account. The input files are
+# synthetic TPC-H shaped CUSTOMER, ORDERS and LINEITEM tables, and the results are saved as JSON.
+#
+#   python benchmark.py --mb 200 --concurrency 1,2,4,8 --output before.json
+#   python benchmark.py --mb 200 --concurrency 1,2,4,8 --output after.json --compare before.json
+#
+# --benchmarks verify checks instead that the parallel, raw-copy and multi-file splits write the
+# same pieces as the serial split (see verify_splits), and exits with status 1 if any differ:
+#
+#   python benchmark.py --benchmarks verify
+#
+# Every option is a "--name value" pair, as in MultiThreadBulkLoad_V1.py; see DEFAULTS.
+#======================================================================================================
+import contextlib
+import csv
+import datetime
+import io
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import sys
+import threading
+import time
+import types
+import uuid
+
+DEFAULTS = {
+    'workdir': 'benchmark_work',        # generated files and split output
+    'output': None,                     # results file, benchmark_<time>.json by default
+    'compare': None,                    # earlier results file to compare with
+    'benchmarks': 'split,load,fetch',   # and verify
+    'mb': '100',                        # size of the generated LINEITEM file
+    'workers': '1,4',                   # split workers to measure
+    'concurrency': '1,2,4,8',           # PUT sessions to measure the load with
+    'chunkmb': '10',                    # compressed MB per split file in the load benchmark
+    'fetchrows': '2000000',             # rows the fake SELECT returns
+    'connectlatency': '0.3',            # seconds to log in
+    'latency': '0.05',                  # seconds for any other statement
+    'putlatency': '0.2',
+    'putmbps': '50',                    # per PUT stream
+    'uplinkmbps': '200',                # shared by all PUT streams
+    'copylatency': '1.0',
+    'copymbps': '200',                  # per warehouse load thread
+    'warehousethreads': '8',            # COPY files loaded at once (X-Small)
+    'selectlatency': '0.5',
+    'fetchmbps': '200',
+}
+
+#======================================================================================================
+# The fake connector
+#======================================================================================================
+class FakeError(Exception):
+    def __init__(self, msg='', errno=None, sfqid=None):
+        super().__init__(msg)
+        self.msg = msg
+        self.errno = errno
+        self.sfqid = sfqid
+
+class FakeDatabaseError(FakeError):
+    pass
+
+class FakeOperationalError(FakeDatabaseError):
+    pass
+
+class FakeInterfaceError(FakeError):
+    pass
+
+class FakeSnowflake:
+
+    # The state shared by every fake session: the timings, the files on the stage, the
+    # warehouse load threads and the queries started with execute_async.
+
+    def __init__(self, settings, select_table=None, select_description=None):
+        self.settings = settings
+        self.select_table = select_table
+        self.select_description = select_description
+        self.stage = {}
+        self.lock = threading.Lock()
+        self.warehouse = threading.Semaphore(int(settings['warehousethreads']))
+        self.queries = {}
+        self.uploads = 0
+
+    def setting(self, name):
+        return float(self.settings[name])
+
+    def connector(self):
+        # A module that can stand in for snowflake.connector.
+        connector = types.ModuleType('snowflake.connector')
+        connector.connect = lambda **kwargs: FakeConnection(self, kwargs)
+        connector.Error = FakeError
+        connector.ProgrammingError = FakeError
+        connector.DatabaseError = FakeDatabaseError
+        connector.OperationalError = FakeOperationalError
+        connector.InterfaceError = FakeInterfaceError
+        return connector
+
+    def run(self, sql, round_trip=True):
+        # Simulates a statement and returns (description, rows, rowcount, arrow table or None).
+        # Without round_trip it is one of a multi-statement request after the first, and the
+        # plain statements take no latency of their own.
+        words = sql.split()
+        verb = words[0].upper() if words else ''
+        if verb == 'PUT':
+            path = re.match(r'put\s+file://(\S+)', sql, re.IGNORECASE).group(1)
+            size = os.path.getsize(path)
+            # Concurrent PUTs share the uplink, each at no more than putmbps.
+            with self.lock:
+                self.uploads += 1
+                mbps = min(self.setting('putmbps'), self.setting('uplinkmbps') / self.uploads)
+            time.sleep(self.setting('putlatency') + size / (mbps * 1024 * 1024))
+            with self.lock:
+                self.uploads -= 1
+                self.stage[os.path.basename(path)] = size
+            return ([('source',), ('target',), ('source_size',), ('status',)],
+                    [(path, os.path.basename(path), size, 'UPLOADED')], 1, None)
+        if verb == 'COPY':
+            files = re.search(r'FILES\s*=\s*\(([^)]*)\)', sql, re.IGNORECASE)
+            with self.lock:
+                names = re.findall(r"'([^']+)'", files.group(1)) if files else list(self.stage)
+                sizes = [self.stage.get(name, 0) for name in names]
+                if re.search(r'PURGE\s*=\s*TRUE', sql, re.IGNORECASE):
+                    for name in names:
+                        self.stage.pop(name, None)
+            time.sleep(self.setting('copylatency'))
+            # Each file is loaded by one warehouse thread.
+            threads = [threading.Thread(target=self.load_file, args=(size,)) for size in sizes]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            return ([('file',), ('status',), ('rows_parsed',), ('rows_loaded',)],
+                    [(name, 'LOADED', None, None) for name in names], len(names), None)
+        if verb == 'REMOVE':
+            with self.lock:
+                self.stage.clear()
+        if verb == 'SHOW':
+            time.sleep(self.setting('latency'))
+            return ([('name',), ('state',), ('size',)], [('WH', 'STARTED', 'X-Small')], 1, None)
+        if verb == 'SELECT' and self.select_table is not None and 'V_DISTRIBUTION' in sql.upper():
+            time.sleep(self.setting('selectlatency'))
+            return self.select_description, None, self.select_table.num_rows, self.select_table
+        if round_trip:
+            time.sleep(self.setting('latency'))
+        return [('status',)], [('Statement executed successfully.',)], 1, None
+
+    def load_file(self, size):
+        with self.warehouse:
+            time.sleep(size / (self.setting('copymbps') * 1024 * 1024))
+
+class FakeConnection:
+    def __init__(self, snowflake, kwargs):
+        self.snowflake = snowflake
+        self.database = kwargs.get('database')
+        self.schema = kwargs.get('schema')
+        self.role = None
+        self.closed = False
+        time.sleep(snowflake.setting('connectlatency'))
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def close(self):
+        self.closed = True
+
+    def is_closed(self):
+        return self.closed
+
+    def get_query_status_throw_if_error(self, queryId):
+        thread, outcome = self.snowflake.queries[queryId]
+        if thread.is_alive():
+            return 'RUNNING'
+        if 'error' in outcome:
+            raise outcome['error']
+        return 'SUCCESS'
+
+    def is_still_running(self, status):
+        return status in ('RUNNING', 'QUEUED')
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self.description = None
+        self.rowcount = None
+        self.sfqid = None
+        self.rows = []
+        self.table = None
+        self.results = []
+
+    def execute(self, sql, *args, **kwargs):
+        if self.connection.closed:
+            raise FakeError('Connection is closed')
+        # A multi-statement request (num_statements) runs every statement now; nextset() moves
+        # on to the result of the next one.
+        statements = sql.split(';\n') if kwargs.get('num_statements', 1) != 1 else [sql]
+        self.results = []
+        for number, statement in enumerate(statements):
+            self.results.append((str(uuid.uuid4()), self.connection.snowflake.run(statement, number == 0)))
+            if statement.upper().startswith('USE ROLE'):
+                self.connection.role = statement.split()[-1]
+        self.nextset()
+        return self
+
+    def nextset(self):
+        if not self.results:
+            return None
+        self.sfqid, result = self.results.pop(0)
+        self.set_result(result)
+        return self
+
+    def set_result(self, result):
+        self.description, self.rows, self.rowcount, self.table = result
+        self.rows = list(self.rows or [])
+
+    def execute_async(self, sql):
+        self.sfqid = str(uuid.uuid4())
+        outcome = {}
+
+        def run():
+            try:
+                outcome['result'] = self.connection.snowflake.run(sql)
+            except Exception as e:
+                outcome['error'] = e
+
+        thread = threading.Thread(target=run, daemon=True)
+        self.connection.snowflake.queries[self.sfqid] = (thread, outcome)
+        thread.start()
+        return {'queryId': self.sfqid}
+
+    def get_results_from_sfqid(self, queryId):
+        thread, outcome = self.connection.snowflake.queries[queryId]
+        thread.join()
+        self.set_result(outcome['result'])
+
+    def fetchone(self):
+        return self.rows.pop(0) if self.rows else None
+
+    def fetchall(self):
+        rows, self.rows = self.rows, []
+        return rows
+
+    def fetchmany(self, size):
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+    def fetch_arrow_batches(self):
+        # The result arrives in batches of about 100,000 rows, at fetchmbps.
+        if self.table is None:
+            return
+        bytes_per_second = self.connection.snowflake.setting('fetchmbps') * 1024 * 1024
+        for offset in range(0, self.table.num_rows, 100000):
+            batch = self.table.slice(offset, 100000)
+            time.sleep(batch.nbytes / bytes_per_second)
+            yield batch
+
+    def close(self):
+        pass
+
+def install_fake_connector(snowflake):
+    # Makes `import snowflake.connector` return the fake in this process.
+    package = types.ModuleType('snowflake')
+    package.connector = snowflake.connector()
+    sys.modules['snowflake'] = package
+    sys.modules['snowflake.connector'] = package.connector
+
+#======================================================================================================
+# TPC-H shaped data, with the columns of the MYTEST.py tables
+#======================================================================================================
+WORDS = ('furiously regular deposits sleep carefully final packages among the quickly ironic '
+         'accounts haggle blithely pending requests detect slyly express instructions wake bold '
+         'foxes use silent theodolites nag even pinto beans boost').split()
+SEGMENTS = ['AUTOMOBILE', 'BUILDING', 'FURNITURE', 'HOUSEHOLD', 'MACHINERY']
+PRIORITIES = ['1-URGENT', '2-HIGH', '3-MEDIUM', '4-NOT SPECIFIED', '5-LOW']
+INSTRUCTIONS = ['DELIVER IN PERSON', 'COLLECT COD', 'NONE', 'TAKE BACK RETURN']
+SHIP_MODES = ['REG AIR', 'AIR', 'RAIL', 'SHIP', 'TRUCK', 'MAIL', 'FOB']
+START_DATE = datetime.date(1992, 1, 1)
+
+def comment(rng, low, high):
+    text = ' '.join(rng.choice(WORDS) for _ in range(high // 5))
+    return text[:rng.randint(low, high)].strip()
+
+def date(rng, days=2400):
+    return (START_DATE + datetime.timedelta(rng.randint(0, days))).isoformat()
+
+def customer_row(rng, key):
+    return [key, 'Customer#%09d' % key, comment(rng, 10, 40), rng.randint(0, 24),
+            '%02d-%03d-%03d-%04d' % (rng.randint(10, 34), rng.randint(100, 999), rng.randint(100, 999),
+                                     rng.randint(1000, 9999)),
+            '%.2f' % rng.uniform(-999.99, 9999.99), rng.choice(SEGMENTS), comment(rng, 29, 116)]
+
+def orders_row(rng, key):
+    return [key, rng.randint(1, 150000), rng.choice('FOP'), '%.2f' % rng.uniform(850, 550000),
+            date(rng), rng.choice(PRIORITIES), 'Clerk#%09d' % rng.randint(1, 1000), 0, comment(rng, 19, 78)]
+
+def lineitem_row(rng, key):
+    quantity = rng.randint(1, 50)
+    ship_date = START_DATE + datetime.timedelta(rng.randint(0, 2400))
+    return [key // 4 + 1, rng.randint(1, 200000), rng.randint(1, 10000), key % 4 + 1, quantity,
+            '%.2f' % (quantity * rng.uniform(900, 2100)), '%.2f' % (rng.randint(0, 10) / 100),
+            '%.2f' % (rng.randint(0, 8) / 100), rng.choice('RAN'), rng.choice('OF'), ship_date.isoformat(),
+            (ship_date + datetime.timedelta(rng.randint(-60, 60))).isoformat(),
+            (ship_date + datetime.timedelta(rng.randint(1, 30))).isoformat(), rng.choice(INSTRUCTIONS),
+            rng.choice(SHIP_MODES), comment(rng, 10, 43)]
+
+TABLES = {
+    'CUSTOMER': (['C_CUSTKEY', 'C_NAME', 'C_ADDRESS', 'C_NATIONKEY', 'C_PHONE', 'C_ACCTBAL',
+                  'C_MKTSEGMENT', 'C_COMMENT'], customer_row),
+    'ORDERS': (['O_ORDERKEY', 'O_CUSTKEY', 'O_ORDERSTATUS', 'O_TOTALPRICE', 'O_ORDERDATE',
+                'O_ORDERPRIORITY', 'O_CLERK', 'O_SHIPPRORITY', 'O_COMMENT'], orders_row),
+    'LINEITEM': (['L_ORDERKEY', 'L_PARTKEY', 'L_SUPPKEY', 'L_LINENUMBER', 'L_QUANTITY',
+                  'L_EXTENDEDPRICE', 'L_DISCOUNT', 'L_TAX', 'L_RETURNFLAG', 'L_LINESTATUS',
+                  'L_SHIPDATE', 'L_COMMITDATE', 'L_RECEIPTDATE', 'L_SHIPINSTRUCT', 'L_SHIPMODE',
+                  'L_COMMENT'], lineitem_row),
+}
+
+def generate(table, path, mb=None, rows=None, seed=0):
+
+    """
+        PURPOSE:
+            Writes a CSV file (with a header) of table CUSTOMER, ORDERS or LINEITEM, either
+            `rows` rows or rows until it is `mb` MB. The same seed gives the same file.
+        RETURNS:
+            The number of rows written.
+    """
+    columns, make_row = TABLES[table]
+    rng = random.Random(seed)
+    limit = mb * 1024 * 1024 if mb else None
+    key = 0
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        while (rows is None or key < rows) and (limit is None or f.tell() < limit):
+            for _ in range(10000 if rows is None else min(10000, rows - key)):
+                key += 1
+                writer.writerow(make_row(rng, key))
+    return key
+
+def cached_input(workdir, table, mb):
+    # Generates a table once per size and reuses it across runs.
+    path = os.path.join(workdir, '{0}_{1}MB.csv'.format(table, mb))
+    if not os.path.exists(path):
+        print('Generating {0}...'.format(path))
+        generate(table, path + '.tmp', mb=mb)
+        os.replace(path + '.tmp', path)
+    return path
+
+#======================================================================================================
+# Benchmarks
+#======================================================================================================
+def timed(function):
+    started = time.perf_counter()
+    result = function()
+    return time.perf_counter() - started, result
+
+def fresh_directory(path):
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+    return path
+
+def benchmark_split(options):
+    import csv_splitter
+    source = cached_input(options['workdir'], 'LINEITEM', int(options['mb']))
+    source_mb = os.path.getsize(source) / 1024 / 1024
+    output = os.path.join(options['workdir'], 'split')
+    cases = []
+    for workers in [int(n) for n in options['workers'].split(',')]:
+        cases += [
+            ('rows workers={0}'.format(workers), dict(workers=workers)),
+            ('rows gzip workers={0}'.format(workers), dict(workers=workers, compression='gzip')),
+            ('raw workers={0}'.format(workers), dict(workers=workers, raw_copy=True)),
+            ('raw gzip workers={0}'.format(workers), dict(workers=workers, raw_copy=True, compression='gzip')),
+            ('sized gzip workers={0}'.format(workers),
+             dict(workers=workers, compression='gzip', target_size=10 * 1024 * 1024, size_basis='compressed')),
+        ]
+    results = []
+    for case, kwargs in cases:
+        fresh_directory(output)
+        pieces = []
+        seconds, _ = timed(lambda: csv_splitter.split(source, output_path=output + '/', on_chunk=pieces.append,
+                                                      **kwargs))
+        results.append({'benchmark': 'split', 'case': case, 'seconds': seconds,
+                        'mb_per_s': source_mb / seconds, 'files': len(pieces)})
+        print('split {0}: {1:.1f} MB/s'.format(case, source_mb / seconds))
+    shutil.rmtree(output, ignore_errors=True)
+    return results
+
+def benchmark_load(options):
+    import MultiThreadBulkLoad_V1 as loader
+    source = cached_input(options['workdir'], 'LINEITEM', int(options['mb']))
+    source_mb = os.path.getsize(source) / 1024 / 1024
+    results = []
+    # Fixed PUT sessions at each --concurrency (half as many COPY sessions), then the adaptive
+    # limits starting from one COPY and two PUTs.
+    cases = [(uploaders, max(1, uploaders // 2), 'fixed')
+             for uploaders in [int(n) for n in options['concurrency'].split(',')]]
+    cases.append((2, 1, 'adaptive'))
+    for uploaders, copiers, concurrency in cases:
+        for copymode in ('threads', 'async'):
+            split_dir = fresh_directory(os.path.join(options['workdir'], 'load')) + '/'
+            argv = ['benchmark', '--warehouse', 'WH', '--database', 'DEMO_DB', '--schema', 'PUBLIC',
+                    '--user', 'bench', '--account', 'fake', '--largefile', source, '--stage', '@DDB_STG01',
+                    '--fileformat', 'DDB_FFT01', '--splitdir', split_dir, '--manifest', 'none',
+                    '--chunkmb', options['chunkmb'], '--uploaders', str(uploaders), '--copiers', str(copiers),
+                    '--copymode', copymode, '--concurrency', concurrency]
+            parameters = loader.args_to_properties(argv)
+            output = io.StringIO()
+
+            def run():
+                with contextlib.redirect_stdout(output):
+                    with loader.sfConnectionPool(argv, size=sum(loader.load_threads(parameters))) as pool:
+                        loader.load(parameters, pool)
+
+            seconds, _ = timed(run)
+            if concurrency == 'fixed':
+                case = 'uploaders={0} copiers={1} copymode={2}'.format(uploaders, copiers, copymode)
+            else:
+                case = 'adaptive copymode={0}'.format(copymode)
+            results.append({'benchmark': 'load', 'case': case, 'seconds': seconds,
+                            'mb_per_s': source_mb / seconds})
+            print('load {0}: {1:.1f}s'.format(case, seconds))
+            for line in output.getvalue().splitlines():
+                if ' concurrency ' in line:
+                    print('  ' + line)
+    shutil.rmtree(os.path.join(options['workdir'], 'load'), ignore_errors=True)
+    return results
+
+def benchmark_fetch(options):
+    import MYTEST
+    work = options['workdir']
+    test = MYTEST.SnwClass(os.path.join(work, 'fetch.log'), fresh_directory(os.path.join(work, 'cache')))
+    connection = sys.modules['snowflake.connector'].connect(database='DEMO_DB', schema='PUBLIC')
+    sql = 'SELECT * FROM V_DISTRIBUTION'
+    rows = int(options['fetchrows'])
+    cases = [
+        ('arrow batches', lambda: sum(t.num_rows for t in test.fetch_batches(connection, sql, as_arrow=True))),
+        ('pandas batches', lambda: sum(len(df) for df in test.fetch_batches(connection, sql))),
+        ('fetch_all', lambda: len(test.fetch_all(connection, sql))),
+        ('fetch_all compact', lambda: len(test.fetch_all(connection, sql, compact=True))),
+        ('fetch_cached miss', lambda: len(test.fetch_cached(connection, sql))),
+        ('fetch_cached hit', lambda: len(test.fetch_cached(connection, sql))),
+    ]
+    results = []
+    for case, function in cases:
+        with contextlib.redirect_stdout(io.StringIO()):
+            seconds, fetched = timed(function)
+        assert fetched == rows, (case, fetched)
+        results.append({'benchmark': 'fetch', 'case': case, 'seconds': seconds, 'rows_per_s': rows / seconds})
+        print('fetch {0}: {1:,.0f} rows/s'.format(case, rows / seconds))
+    shutil.rmtree(os.path.join(work, 'cache'), ignore_errors=True)
+    return results
+
+#======================================================================================================
+# Split output checks
+#======================================================================================================
+def verify_inputs(work):
+    # Small files covering the cases the splits handle differently: \r\n and \n line endings,
+    # quoted fields holding newlines and quotes, a header without rows and an empty file.
+    crlf = os.path.join(work, 'crlf.csv')
+    generate('ORDERS', crlf, rows=20000)
+    lf = os.path.join(work, 'lf.csv')
+    with open(crlf, newline='') as source, open(lf, 'w', newline='') as f:
+        csv.writer(f, lineterminator='\n').writerows(csv.reader(source))
+    quoted = os.path.join(work, 'quoted.csv')
+    rng = random.Random(1)
+    with open(quoted, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(TABLES['ORDERS'][0])
+        for key in range(1, 20001):
+            row = orders_row(rng, key)
+            if key % 7 == 0:
+                row[-1] = row[-1].replace(' ', '\n', 2) + ' "quoted"'
+            writer.writerow(row)
+    header = os.path.join(work, 'header.csv')
+    with open(header, 'w', newline='') as f:
+        csv.writer(f).writerow(TABLES['ORDERS'][0])
+    empty = os.path.join(work, 'empty.csv')
+    open(empty, 'w').close()
+    return [crlf, lf, quoted, header, empty]
+
+def split_output(output, function, *args, **kwargs):
+    # Runs a split into a fresh `output` directory and returns (what it returned, the pieces as
+    # (number, rows, content) in number order, gzip pieces decompressed).
+    import gzip
+    fresh_directory(output)
+    pieces = []
+    returned = function(*args, output_path=output + '/', on_chunk=pieces.append, **kwargs)
+    written = []
+    for piece in sorted(pieces, key=lambda piece: piece.number):
+        with (gzip.open if piece.path.endswith('.gz') else open)(piece.path, 'rb') as f:
+            written.append((piece.number, piece.rows, f.read()))
+    return returned, written
+
+def parsed_rows(pieces):
+    # The rows of the pieces as csv reads them, headers and all, for outputs that keep the
+    # input's own bytes.
+    return [(number, rows, list(csv.reader(io.StringIO(content.decode(), newline=''))))
+            for number, rows, content in pieces]
+
+def verify_splits(options):
+
+    """
+        PURPOSE:
+            Checks that parallel_split, raw_split and split_files write the pieces the serial
+            split writes, for row limits that cut every piece into several ranges and none, with
+            and without gzip, on every verify_inputs file. The pieces must hold the same bytes
+            (decompressed), except that raw_split keeps the input's own line endings, so on the
+            \\n file its rows are compared as parsed; on the quoted file it must refuse. split_files
+            with small ranges cuts a short piece at the end of every range, so there the rows of
+            all pieces together are compared.
+        RETURNS:
+            A result per case, with 'identical' False where the output differs.
+    """
+    import csv_splitter
+    work = fresh_directory(os.path.join(options['workdir'], 'verify'))
+    output = os.path.join(work, 'out')
+    results = []
+    for path in verify_inputs(work):
+        name = os.path.basename(path)
+        for row_limit in (3000, 50000):
+            for compression in (None, 'gzip'):
+                common = dict(row_limit=row_limit, compression=compression)
+                _, expected = split_output(output, csv_splitter.split, path, **common)
+                cases = [
+                    ('parallel_split workers=3', csv_splitter.parallel_split, dict(workers=3)),
+                    ('split workers=3', csv_splitter.split, dict(workers=3)),
+                    ('parallel_split workers=3 skip', csv_splitter.parallel_split,
+                     dict(workers=3, skip_pieces={2})),
+                    ('raw_split workers=1', csv_splitter.raw_split, dict(workers=1)),
+                    ('raw_split workers=3', csv_splitter.raw_split, dict(workers=3)),
+                    ('split_files', csv_splitter.split_files, dict(workers=3)),
+                    ('split_files ranges', csv_splitter.split_files, dict(workers=3, range_size=64 * 1024)),
+                ]
+                for case, function, kwargs in cases:
+                    started = time.perf_counter()
+                    source = [path] if function is csv_splitter.split_files else path
+                    returned, pieces = split_output(output, function, source, **common, **kwargs)
+                    want = expected
+                    if 'skip_pieces' in kwargs:
+                        want = [piece for piece in expected if piece[0] not in kwargs['skip_pieces']]
+                    if function is csv_splitter.raw_split and name == 'quoted.csv':
+                        identical = returned is False
+                    elif function is csv_splitter.raw_split and name == 'lf.csv':
+                        identical = parsed_rows(pieces) == parsed_rows(want)
+                    elif case == 'split_files ranges':
+                        identical = (sum(rows for _, rows, _ in pieces) == sum(rows for _, rows, _ in want)
+                                     and [row for _, _, rows in parsed_rows(pieces) for row in rows[1:]]
+                                     == [row for _, _, rows in parsed_rows(want) for row in rows[1:]])
+                    else:
+                        identical = pieces == want
+                    label = '{0} {1} rows={2}{3}'.format(case, name, row_limit, ' gzip' if compression else '')
+                    results.append({'benchmark': 'verify', 'case': label, 'identical': identical,
+                                    'seconds': time.perf_counter() - started})
+                    if not identical:
+                        print('verify {0}: DIFFERENT'.format(label))
+    print('verify: {0} of {1} cases identical to the serial split'.format(
+        sum(result['identical'] for result in results), len(results)))
+    shutil.rmtree(work, ignore_errors=True)
+    return results
+
+def select_result(options):
+    # The result the fake SELECT returns: ORDERS rows, with the description the connector gives.
+    import pyarrow
+    import pyarrow.csv
+    path = os.path.join(options['workdir'], 'ORDERS_select.csv')
+    generate('ORDERS', path, rows=100000)
+    batch = pyarrow.csv.read_csv(path)
+    rows = int(options['fetchrows'])
+    table = pyarrow.concat_tables([batch] * (rows // batch.num_rows + 1)).slice(0, rows)
+    table = pyarrow.Table.from_batches(table.combine_chunks().to_batches())
+    types = {'O_ORDERKEY': (0, 38, 0), 'O_CUSTKEY': (0, 38, 0), 'O_TOTALPRICE': (0, 12, 2),
+             'O_SHIPPRORITY': (0, 38, 0), 'O_ORDERDATE': (3, None, None)}
+    description = [(name,) + (types.get(name, (2, None, None))[0], None, None)
+                   + types.get(name, (2, None, None))[1:] + (True,) for name in table.column_names]
+    return table, description
+
+def compare(results, old_path):
+    with open(old_path) as f:
+        old = {(r['benchmark'], r['case']): r for r in json.load(f)['results']}
+    print('\nCompared with {0} (time ratio, < 1 is faster):'.format(old_path))
+    for result in results:
+        before = old.get((result['benchmark'], result['case']))
+        if before:
+            print('  {0} {1}: {2:.2f}s -> {3:.2f}s ({4:.2f})'.format(
+                result['benchmark'], result['case'], before['seconds'], result['seconds'],
+                result['seconds'] / before['seconds']))
+
+def main(argv):
+    options = dict(DEFAULTS)
+    i = 1
+    while i < len(argv) - 1:
+        options[argv[i][2:]] = argv[i + 1]
+        i += 2
+    os.makedirs(options['workdir'], exist_ok=True)
+    benchmarks = options['benchmarks'].split(',')
+
+    select_table = select_description = None
+    if 'fetch' in benchmarks:
+        select_table, select_description = select_result(options)
+    install_fake_connector(FakeSnowflake(options, select_table, select_description))
+
+    results = []
+    for name, benchmark in (('split', benchmark_split), ('load', benchmark_load), ('fetch', benchmark_fetch),
+                            ('verify', verify_splits)):
+        if name in benchmarks:
+            results += benchmark(options)
+
+    output = options['output'] or 'benchmark_{0}.json'.format(time.strftime('%Y%m%d_%H%M%S'))
+    with open(output, 'w') as f:
+        json.dump({'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': sys.version.split()[0],
+                   'platform': platform.platform(), 'cpus': os.cpu_count(), 'options': options,
+                   'results': results}, f, indent=2)
+    print('Results saved to {0}'.format(output))
+    if options['compare']:
+        compare(results, options['compare'])
+    if any(result.get('identical') is False for result in results):
+        sys.exit(1)
+
+# Guarded so the splitter's worker processes can re-import this module.
+if __name__ == '__main__':
+    main(sys.argv)
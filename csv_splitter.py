@@ -1,7 +1,119 @@
+import array
 import csv
+import datetime
+import decimal
+import glob
+import gzip
+import hashlib
+import heapq
+import io
+import bisect
+import itertools
+import math
+import mmap
 import os
+import re
+import shutil
+import zlib
+from collections import deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
 
-def split(filehandler, delimiter=',', row_limit=100000, output_name_template='output_%s.csv', output_path='C://Users//north//OneDrive//Documents//Snowflake//SampleData//SplitFIleFdr//', keep_headers=True):
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+try:
+  import zstandard
+except ImportError:
+  zstandard = None
+
+try:
+  import pyarrow
+  import pyarrow.compute
+  import pyarrow.parquet
+except ImportError:
+  pyarrow = None
+
+# Block sizes used when scanning the raw bytes of the large file.
+_SCAN_BLOCK = 16 * 1024 * 1024
+_SEEK_BLOCK = 64 * 1024
+
+# Bytes per byte range when many files are split together (see `split_files`).
+_RANGE_SIZE = 64 * 1024 * 1024
+
+# Sampling used to estimate the compressed size of the rows written.
+_SAMPLE_SIZE = 256 * 1024
+_SAMPLE_STRIDE = 4 * 1024 * 1024
+
+# Output compression: file extension and default level per codec, and the
+# uncompressed block size each gzip thread compresses at a time.
+_COMPRESSION_EXTENSIONS = {'gzip': '.gz', 'zstd': '.zst'}
+_COMPRESSION_LEVELS = {'gzip': 6, 'zstd': 3}
+_GZIP_BLOCK = 4 * 1024 * 1024
+
+# Parquet output (see `split`'s file_format): the codecs of the column chunks,
+# and the CSV values written as NULL, as Snowflake's CSV defaults load them
+# (EMPTY_FIELD_AS_NULL and NULL_IF = ('\\N')).
+_PARQUET_COMPRESSIONS = (None, 'snappy', 'gzip', 'zstd')
+_PARQUET_NULLS = ('', '\\N')
+_PARQUET_TRUE = {'true', 't', 'yes', 'y', 'on', '1'}
+_PARQUET_FALSE = {'false', 'f', 'no', 'n', 'off', '0'}
+
+# The first bytes of a ChangeIndex file; files without them hold the 64-bit
+# keys of earlier versions.
+_INDEX_MAGIC = b'CHGIDX02'
+
+# What `on_chunk` is called with for each output file: its 1-based number, its
+# path, the rows and uncompressed bytes written to it (header included), the
+# byte range of the input it holds when that is known (None otherwise), the
+# bucket of a partitioned split (see `Partitioning`) and the input file it was
+# split from when `split_files` splits several.
+Piece = namedtuple('Piece', 'number path rows raw_bytes start end partition source', defaults=(None, None))
+
+# A column of the table the rows are checked against (see `Profile`): its
+# name, its Snowflake type as in the DDL ('VARCHAR(25)', 'NUMBER(12,2)',
+# 'DATE') and whether it may hold NULLs.
+Column = namedtuple('Column', 'name type nullable')
+
+class ConformanceError(ValueError):
+
+  # Raised by a split with a `Profile` that has no reject file, at the first
+  # row that would not load. `column` is None when the row has the wrong
+  # number of fields.
+
+  def __init__(self, row, column, reason):
+    super().__init__(row, column, reason)
+    self.row = row
+    self.column = column
+    self.reason = reason
+
+  def __str__(self):
+    return 'row %d, %s: %s' % (self.row, self.column or 'row', self.reason)
+
+# How types are checked by `Profile`, and the bad rows it keeps as samples.
+_TEXT_TYPES = {'VARCHAR', 'STRING', 'TEXT', 'CHAR', 'CHARACTER', 'NCHAR', 'NVARCHAR', 'NVARCHAR2',
+               'CHAR VARYING', 'NCHAR VARYING', 'CHARACTER VARYING'}
+_NUMBER_TYPES = {'NUMBER', 'DECIMAL', 'DEC', 'NUMERIC'}
+_INTEGER_TYPES = {'INT', 'INTEGER', 'BIGINT', 'SMALLINT', 'TINYINT', 'BYTEINT'}
+_FLOAT_TYPES = {'FLOAT', 'FLOAT4', 'FLOAT8', 'DOUBLE', 'DOUBLE PRECISION', 'REAL'}
+_BOOLEANS = {'true', 'false', 't', 'f', 'yes', 'no', 'y', 'n', 'on', 'off', '1', '0'}
+_NUMBER = re.compile(r'[+-]?(\d*)(?:\.\d*)?(?:[eE][+-]?\d+)?$')
+# Room for the 38 digits of a NUMBER(38,s) value; the default context keeps 28.
+_NUMBER_CONTEXT = decimal.Context(prec=38)
+# A quoted stretch of a CSV file, up to its closing quote or the end of the text.
+_QUOTED = re.compile(rb'"[^"]*(?:"|\Z)')
+_COLUMN_DEFINITION = re.compile(
+  r'\s*("[^"]+"|[\w$]+)\s+([a-z_0-9]+(?:\s+(?:precision|varying))?)\s*'
+  r'(?:\(\s*(\d+)\s*(?:,\s*(\d+)\s*)?\))?(.*)', re.IGNORECASE | re.DOTALL)
+_NOT_NULL = re.compile(r'\bNOT\s+NULL\b', re.IGNORECASE)
+_REJECT_SAMPLES = 20
+
+# Date periods of a range `Partitioning`, with the length of their labels.
+_PERIODS = {'year': 4, 'month': 7, 'day': 10}
+
+def split(filehandler, delimiter=',', row_limit=100000, output_name_template='output_%s.csv', output_path='C://Users//north//OneDrive//Documents//Snowflake//SampleData//SplitFIleFdr//', keep_headers=True, workers=1, target_size=None, size_basis='raw', compression=None, compression_level=None, compression_threads=1, raw_copy=False, on_chunk=None, skip_pieces=(), profile=None, partition_by=None,
+          changes=None, file_format='csv', columns=None, row_group_size=100000):
 
   """
   Splits a CSV file into multiple pieces.
@@ -14,6 +126,62 @@ def split(filehandler, delimiter=',', row_limit=100000, output_name_template='ou
     `output_name_template`: A %s-style template for the numbered output files.
     `output_path`: Where to stick the output files.
     `keep_headers`: Whether or not to print the headers in each output file.
+    `workers`: Number of processes to split with. 1 (the default) reads the file
+      with a single csv.reader; more than 1 cuts the file into byte ranges and
+      splits each range in its own process (see `parallel_split`). None uses
+      every core.
+    `target_size`: Bytes per output file. When set, a new file is started once
+      the current one reaches this size and `row_limit` is ignored.
+    `size_basis`: What `target_size` measures: 'raw' for the bytes written, or
+      'compressed' for the gzip size estimated from samples of the rows as they
+      stream past.
+    `compression`: None for plain .csv files, or 'gzip' / 'zstd' to write
+      compressed files directly; the codec's extension is added to
+      `output_name_template`. zstd needs the zstandard package.
+    `compression_level`: Codec level. Defaults to 6 for gzip and 3 for zstd.
+    `compression_threads`: Threads compressing each output file. gzip files are
+      then written as a series of independently compressed members, which any
+      gzip reader (and Snowflake) reads as one stream.
+    `raw_copy`: True copies the input bytes of each piece straight from a
+      memory map instead of parsing and re-writing every row (see `raw_split`);
+      'auto' does so only when that is safe and otherwise parses as usual.
+    `on_chunk`: Called with a `Piece` for each output file as soon as it is
+      complete, in piece order, so the files can be uploaded while the split
+      goes on. The split waits while the call blocks, which lets the caller cap
+      how many finished files are on disk at once.
+    `skip_pieces`: Numbers of pieces to leave out, e.g. the ones an interrupted
+      run already loaded. They are not passed to `on_chunk` and are not left
+      on disk. The raw copy and the `row_limit` splits do not write them at
+      all; size-targeted splits write and delete them, since their boundaries
+      are only known once written. The numbering of the other pieces is the
+      same as without `skip_pieces`.
+    `profile`: A `Profile` to fill in while the rows are split and to check
+      them with, so rows that would not load into the table are rejected (or
+      stop the split) before any piece holding them is written. It needs the
+      rows parsed, so `raw_copy='auto'` parses and `raw_copy=True` is an
+      error. A row_limit split counts rejected rows in its pieces' rows, so
+      the pieces are the same with or without rejects, just shorter.
+    `partition_by`: A `Partitioning` to write the rows of each date range or
+      hash bucket of a column to files of their own, rolling over at
+      `row_limit` or `target_size` within each. It needs the rows parsed, as
+      `profile` does, and the pieces are reported as they fill up, so not in
+      file order.
+    `changes`: A `ChangeIndex` to write only the rows that are new or changed
+      since the previous load; `row_limit` and `target_size` count those rows
+      only. It needs the rows parsed and a serial split (`workers=1`), and
+      writes the pending index once the split is done.
+    `file_format`: 'csv', or 'parquet' to write typed Parquet files (named
+      .parquet instead of .csv) for COPY ... MATCH_BY_COLUMN_NAME. The fields
+      of each row are the `columns` in order, '' and \\N are NULL, and
+      `compression` is then the codec of the column chunks: 'snappy', 'gzip',
+      'zstd' or None. Sizes are measured on the rows as CSV text, and with
+      size_basis='compressed' at the ratio of the row groups written so far.
+      It needs pyarrow and the rows parsed, and cannot be partitioned; a
+      parallel row_limit split cuts pieces of up to `row_limit` rows per byte
+      range rather than stitching pieces across ranges.
+    `columns`: The `Column`s of the table for Parquet output (from
+      `parse_columns` or DESCRIBE TABLE), which give its names and types.
+    `row_group_size`: Rows per Parquet row group.
 
   Example usage:
 
@@ -21,25 +189,1767 @@ def split(filehandler, delimiter=',', row_limit=100000, output_name_template='ou
     >> csv_splitter.split(open('/home/ben/input.csv', 'r'));
 
   """
+  if size_basis not in ('raw', 'compressed'):
+    raise ValueError("size_basis must be 'raw' or 'compressed', not %r" % (size_basis,))
+  if profile is not None or partition_by is not None or changes is not None or file_format != 'csv':
+    if raw_copy is True:
+      raise ValueError('profile, partition_by, changes and Parquet output need the rows parsed; '
+                       'they cannot be used with raw_copy=True')
+    raw_copy = False
+  if partition_by is not None and file_format != 'csv':
+    raise ValueError('partition_by writes CSV files only, since Parquet files cannot be appended to')
+  if changes is not None and (workers is None or workers > 1):
+    raise ValueError('changes needs a serial split (workers=1)')
+  if raw_copy:
+    done = raw_split(filehandler, row_limit=row_limit, output_name_template=output_name_template,
+                     output_path=output_path, keep_headers=keep_headers, workers=workers,
+                     target_size=target_size, size_basis=size_basis, compression=compression,
+                     compression_level=compression_level,
+                     compression_threads=compression_threads, on_chunk=on_chunk,
+                     skip_pieces=skip_pieces)
+    if done:
+      return
+    if raw_copy != 'auto':
+      raise ValueError('%s has quoted newlines or bare \\r line endings; it cannot be split with raw_copy'
+                       % (filehandler,))
+  if workers is None or workers > 1:
+    return parallel_split(filehandler, delimiter=delimiter, row_limit=row_limit,
+                          output_name_template=output_name_template,
+                          output_path=output_path, keep_headers=keep_headers,
+                          workers=workers, target_size=target_size, size_basis=size_basis,
+                          compression=compression, compression_level=compression_level,
+                          compression_threads=compression_threads, on_chunk=on_chunk,
+                          skip_pieces=skip_pieces, profile=profile, partition_by=partition_by,
+                          file_format=file_format, columns=columns, row_group_size=row_group_size)
+  codec = _output_codec(file_format, compression, compression_level, compression_threads, columns, row_group_size)
+  output_name_template = _with_extension(output_name_template, codec)
   with open(filehandler) as largefile:
     reader = csv.reader(largefile, delimiter=delimiter)
-    current_piece = 1
-    current_out_path = os.path.join(output_path, output_name_template % current_piece)
-    current_out_writer = csv.writer(open(current_out_path, 'w', newline=''), delimiter=delimiter)
-    current_limit = row_limit
+    headers = next(reader, None) if keep_headers else None
+    if profile is not None:
+      profile.start(headers)
+    rows = reader
+    if changes is not None:
+      # Rows are checked before they are compared, so the row numbers of the
+      # profile are the file's and rejected rows stay out of the index.
+      changes.start(headers)
+      if profile is not None:
+        rows = profile.filter(rows)
+      rows = changes.filter(rows)
+      profile_pieces = None
+    else:
+      profile_pieces = profile
+    try:
+      if partition_by is not None:
+        pieces = _write_partitions(
+          rows, delimiter, headers, partition_by, row_limit, target_size, size_basis, codec,
+          lambda label, n: os.path.join(output_path, '.partition_%s_%d.part' % (label, n)),
+          lambda label, piece: os.path.join(output_path, output_name_template % ('%s_%d' % (label, piece))),
+          on_chunk, skip_pieces, profile_pieces)
+      else:
+        pieces = _write_pieces(rows, delimiter, headers, row_limit, target_size, size_basis, codec,
+                               lambda piece: os.path.join(output_path, output_name_template % piece),
+                               on_chunk, skip_pieces, profile_pieces)
+    finally:
+      if profile is not None:
+        profile.close()
+  if changes is not None:
+    changes.finish()
+  if not pieces:
+    _write_empty(os.path.join(output_path, output_name_template % 1), delimiter, headers, codec, on_chunk,
+                 skip_pieces)
+
+def parallel_split(filehandler, delimiter=',', row_limit=100000, output_name_template='output_%s.csv', output_path='C://Users//north//OneDrive//Documents//Snowflake//SampleData//SplitFIleFdr//', keep_headers=True, workers=None, target_size=None, size_basis='raw', compression=None, compression_level=None, compression_threads=1, on_chunk=None, skip_pieces=(), profile=None, partition_by=None, file_format='csv', columns=None, row_group_size=100000):
+
+  """
+  Splits a CSV file into multiple pieces using a pool of processes.
+
+  The file is cut into one byte range per worker. Each cut is moved forward to
+  the next newline that is not inside a quoted field, which is found from the
+  parity of the quote characters before it, so quoted fields with embedded
+  newlines are never broken. The output files are identical to the ones the
+  serial `split` writes. With `target_size` each range is filled into pieces
+  of that size on its own and the pieces are numbered in file order, so the
+  last piece of every range may be short. Ranges are written concurrently, so
+  a blocking `on_chunk` holds back the reporting (and stitching) of pieces
+  but not the writing of the ranges already running. With a `profile` every
+  range is profiled (and rejects its rows to a file) of its own, and the parts
+  are merged in file order; a `ConformanceError` is raised once the ranges
+  before the failing one are done, so its row number is that of the file.
+  With `partition_by` every range is partitioned on its own, so each bucket
+  has up to one short piece per range.
+
+  This assumes standard CSV quoting (a quote only opens or closes a whole field,
+  and a literal quote is doubled) and an ASCII-compatible encoding such as UTF-8.
+
+  Arguments:
+
+    Same as `split`, plus
+    `workers`: Number of processes (and byte ranges). None uses every core.
+
+  """
+  workers = workers or os.cpu_count() or 1
+  size = os.path.getsize(filehandler)
+  codec = _output_codec(file_format, compression, compression_level, compression_threads, columns, row_group_size)
+  output_name_template = _with_extension(output_name_template, codec)
+
+  headers = None
+  data_start = 0
+  if keep_headers:
+    data_start = _find_row_start(filehandler, 0, False, size)
+    with _open_range(filehandler, 0, data_start) as header_text:
+      headers = next(csv.reader(header_text, delimiter=delimiter), None)
+  if profile is not None:
+    profile.start(headers)
+  try:
+    _parallel_split(filehandler, delimiter, row_limit, output_name_template, output_path, workers, target_size,
+                    size_basis, codec, on_chunk, skip_pieces, profile, partition_by, size, data_start, headers)
+  finally:
+    if profile is not None:
+      profile.close()
+
+def _parallel_split(filehandler, delimiter, row_limit, output_name_template, output_path, workers, target_size,
+                    size_basis, codec, on_chunk, skip_pieces, profile, partition_by, size, data_start, headers):
+  # The body of parallel_split, once the header is read. If a range fails,
+  # the ranges not started are cancelled, the running ones waited for, and
+  # the files the split wrote but did not hand to on_chunk are deleted before
+  # the error is raised again.
+  jobs = []
+  reported = set()
+  total_rows = None
+
+  def report(piece):
+    reported.add(piece.path)
+    _report(piece, on_chunk, skip_pieces)
+
+  with ProcessPoolExecutor(max_workers=workers) as pool:
+    # Cut the file into nominal ranges and count the quotes in each of them so
+    # the quoting state at every cut is known without a serial scan.
+    step = max(1, -(-(size - data_start) // workers))
+    nominal = list(range(data_start, size, step))
+    quote_counts = list(pool.map(_count_quotes, [filehandler] * len(nominal), nominal,
+                                 nominal[1:] + [size]))
+
+    ranges = _row_ranges(filehandler, data_start, size, nominal, quote_counts)
+
+    try:
+      if partition_by is not None:
+        jobs += [pool.submit(_write_partitioned_range, filehandler, start, end, index, delimiter, partition_by,
+                             row_limit, target_size, size_basis, codec, output_path, headers,
+                             profile.part(index) if profile is not None else None)
+                 for index, (start, end) in enumerate(ranges)]
+        piece = 0
+        for job in jobs:
+          for written in _range_result(job, profile):
+            piece += 1
+            piece_path = os.path.join(output_path, output_name_template % ('%s_%d' % (written.partition, piece)))
+            os.replace(written.path, piece_path)
+            report(written._replace(number=piece, path=piece_path))
+        if piece == 0:
+          _write_empty(os.path.join(output_path, output_name_template % 1), delimiter, headers, codec, on_chunk,
+                       skip_pieces)
+        return
+
+      if target_size or isinstance(codec, _ParquetFormat):
+        # Parquet pieces cannot be stitched, so a row_limit split cuts them per range too.
+        jobs += [pool.submit(_write_sized_range, filehandler, start, end, index, delimiter,
+                             target_size, size_basis, codec, output_path, headers,
+                             profile.part(index) if profile is not None else None, row_limit=row_limit)
+                 for index, (start, end) in enumerate(ranges)]
+        # Number the pieces in file order as each range finishes.
+        piece = 0
+        for job in jobs:
+          for written in _range_result(job, profile):
+            piece += 1
+            piece_path = os.path.join(output_path, output_name_template % piece)
+            os.replace(written.path, piece_path)
+            report(written._replace(number=piece, path=piece_path))
+        if piece == 0:
+          _write_empty(os.path.join(output_path, output_name_template % 1), delimiter, headers, codec, on_chunk,
+                       skip_pieces)
+        return
+
+      row_counts = list(pool.map(_count_rows, [filehandler] * len(ranges),
+                                 [start for start, end in ranges],
+                                 [end for start, end in ranges]))
+      total_rows = sum(row_counts)
+
+      first_row = 0
+      for index, ((start, end), count) in enumerate(zip(ranges, row_counts)):
+        jobs.append(pool.submit(_write_range, filehandler, start, end, first_row, count,
+                                index == len(ranges) - 1, index, delimiter, row_limit,
+                                codec, output_name_template, output_path, headers, skip_pieces,
+                                profile.part(index) if profile is not None else None))
+        first_row += count
+
+      # A piece that straddles two ranges is written as one fragment per range
+      # and stitched together, in range order, once the range holding its last
+      # row is done. Concatenated gzip members and zstd frames decompress as one
+      # stream, so this works for compressed pieces too.
+      fragments = {}
+      end_row = 0
+      for index, (job, count) in enumerate(zip(jobs, row_counts)):
+        end_row += count
+        for written, is_fragment in _range_result(job, profile):
+          if is_fragment:
+            fragments.setdefault(written.number, []).append(written)
+            if written.number * row_limit > end_row and index < len(jobs) - 1:
+              continue
+            written = _stitch(output_path, output_name_template, fragments.pop(written.number))
+          report(written)
+      # Trailing ranges without rows leave the last piece's fragments behind.
+      for piece, parts in sorted(fragments.items()):
+        report(_stitch(output_path, output_name_template, parts))
+    except BaseException:
+      for job in jobs:
+        job.cancel()
+      wait(jobs)
+      _remove_unreported(output_path, output_name_template, row_limit, total_rows, skip_pieces, reported,
+                         profile)
+      raise
+
+  if total_rows == 0:
+    _write_empty(os.path.join(output_path, output_name_template % 1), delimiter, headers, codec, on_chunk,
+                 skip_pieces)
+
+def _row_ranges(path, data_start, size, nominal, quote_counts):
+  # The byte ranges of whole rows that the nominal cuts (at least one, the
+  # first at `data_start`) are moved forward to, from the quotes counted in
+  # each nominal range but the last.
+  boundaries = [data_start]
+  parity = _count_quotes(path, 0, data_start) % 2
+  for offset, count in zip(nominal[1:], quote_counts):
+    parity = (parity + count) % 2
+    start = _find_row_start(path, offset, bool(parity), size)
+    if start > boundaries[-1]:
+      boundaries.append(start)
+  return list(zip(boundaries, boundaries[1:] + [size]))
+
+def _remove_unreported(output_path, output_name_template, row_limit, total_rows, skip_pieces, reported,
+                       profile=None):
+  # Deletes what a failed parallel_split leaves behind: the temporary files of
+  # its ranges and fragments, the reject files of the profile parts not
+  # merged, and, once the rows are counted, the pieces written to their final
+  # names but not yet handed to on_chunk.
+  paths = glob.glob(os.path.join(glob.escape(output_path), '.range*.part'))
+  paths += glob.glob(os.path.join(glob.escape(output_path), '.range*.tmp'))
+  paths += glob.glob(os.path.join(glob.escape(output_path), glob.escape(output_name_template) % '*' + '.part*'))
+  if profile is not None and profile.reject_path is not None:
+    paths += glob.glob(glob.escape(profile.reject_path) + '.part*')
+  if total_rows is not None:
+    for piece in range(1, -(-total_rows // row_limit) + 1):
+      path = os.path.join(output_path, output_name_template % piece)
+      if piece not in skip_pieces and path not in reported and os.path.exists(path):
+        paths.append(path)
+  for path in paths:
+    os.remove(path)
+
+def _range_result(job, profile):
+  # What a range job wrote, once its profile is merged into `profile`. A
+  # ConformanceError is raised again with its row number counted from the
+  # start of the file, which is known since the ranges are merged in order.
+  try:
+    written, part = job.result()
+  except ConformanceError as e:
+    raise ConformanceError(e.row + profile.rows, e.column, e.reason) from None
+  if part is not None:
+    profile.merge(part)
+  return written
+
+def _stitch(output_path, output_name_template, fragments):
+  # Joins the fragments of one piece, in order, into its final file and
+  # returns the Piece for it.
+  piece = fragments[0].number
+  piece_path = os.path.join(output_path, output_name_template % piece)
+  with open(piece_path, 'wb') as piece_file:
+    for fragment in fragments:
+      with open(fragment.path, 'rb') as fragment_file:
+        shutil.copyfileobj(fragment_file, piece_file)
+      os.remove(fragment.path)
+  return Piece(piece, piece_path, sum(fragment.rows for fragment in fragments),
+               sum(fragment.raw_bytes for fragment in fragments), None, None)
+
+def _report(piece, on_chunk, skip_pieces):
+  # Hands a finished piece to on_chunk, or deletes it if it is to be skipped.
+  if piece.number in skip_pieces:
+    os.remove(piece.path)
+  elif on_chunk:
+    on_chunk(piece)
+
+def _write_empty(path, delimiter, headers, codec, on_chunk, skip_pieces=(), source=None):
+  # The first piece is written even when there are no rows, as the serial split does.
+  if 1 in skip_pieces:
+    return
+  chunk = _open_chunk(path, delimiter, headers, codec)
+  chunk.close()
+  if on_chunk:
+    on_chunk(Piece(1, path, 0, chunk.raw_bytes, None, None, source=source))
+
+def expand_inputs(patterns):
+
+  """
+  Returns the files named by `patterns` (a path, glob or directory, or a list
+  of them) in order, each once: a directory stands for the *.csv files in it,
+  and the matches of a glob are sorted. A pattern that matches nothing is an
+  error rather than an empty load.
+  """
+  if isinstance(patterns, str):
+    patterns = [patterns]
+  paths = []
+  for pattern in patterns:
+    if os.path.isdir(pattern):
+      matches = sorted(glob.glob(os.path.join(pattern, '*.csv')))
+    else:
+      matches = sorted(path for path in glob.glob(pattern) if os.path.isfile(path))
+    if not matches:
+      raise FileNotFoundError('no input files match %r' % (pattern,))
+    paths += [path for path in matches if path not in paths]
+  return paths
+
+def split_files(inputs, delimiter=',', row_limit=100000, output_path='C://Users//north//OneDrive//Documents//Snowflake//SampleData//SplitFIleFdr//', keep_headers=True, workers=None, target_size=None, size_basis='raw', compression=None, compression_level=None, compression_threads=1, on_chunk=None, range_size=_RANGE_SIZE, file_format='csv', columns=None, row_group_size=100000):
+
+  """
+  Splits many CSV files with one pool of processes.
+
+  Every file is cut into byte ranges of about `range_size`, at row starts
+  found as `parallel_split` finds them, and the ranges of all the files go to
+  the workers as one queue, each next one taken from the file with the most
+  bytes not handed out yet. A worker that is done with one file's range thus
+  takes on the biggest of the files still left, so one large file does not
+  keep a single core busy at the end while the others sit idle.
+
+  Each range is split into pieces of its own, of `row_limit` rows or of
+  `target_size`, so the last piece of every range may be short. The pieces of
+  each file are numbered in file order and passed to `on_chunk` once the
+  ranges before them are done, with `source` set to the file; a file without
+  rows gets an empty piece 1. Only a couple of ranges per worker are handed
+  out ahead of the ones reported, so a blocking `on_chunk` throttles the split
+  as it does for `raw_split`.
+
+  Arguments:
+
+    `inputs`: The files, as a list of paths or a dict of path ->
+      output_name_template. Listed paths get '<file name>_%s.csv', with the
+      file's position in the list added to names that occur more than once.
+    `workers`: Number of processes. None uses every core.
+    `range_size`: Bytes per byte range.
+    `columns`: For Parquet output, the `Column`s of every file, or a dict of
+      path -> `Column`s when the files go to different tables.
+    The others are the same as for `split`.
+
+  """
+  if size_basis not in ('raw', 'compressed'):
+    raise ValueError("size_basis must be 'raw' or 'compressed', not %r" % (size_basis,))
+  if not isinstance(inputs, dict):
+    inputs = _output_templates(inputs)
+  workers = workers or os.cpu_count() or 1
+  codecs = {path: _output_codec(file_format, compression, compression_level, compression_threads,
+                                columns[path] if isinstance(columns, dict) else columns, row_group_size)
+            for path in inputs}
+
+  with ProcessPoolExecutor(max_workers=workers) as pool:
+    # Count the quotes before every nominal cut of every file at once, then
+    # move the cuts to row starts.
+    paths = list(inputs)
+    headers = []
+    cuts = []
+    for path in paths:
+      size = os.path.getsize(path)
+      data_start = 0
+      header = None
+      if keep_headers:
+        data_start = _find_row_start(path, 0, False, size)
+        with _open_range(path, 0, data_start) as header_text:
+          header = next(csv.reader(header_text, delimiter=delimiter), None)
+      nominal = list(range(data_start, size, range_size)) or [data_start]
+      headers.append(header)
+      cuts.append((data_start, size, nominal,
+                   [pool.submit(_count_quotes, path, start, start + range_size) for start in nominal[:-1]]))
+    ranges = [_row_ranges(path, data_start, size, nominal, [count.result() for count in counts])
+              for path, (data_start, size, nominal, counts) in zip(paths, cuts)]
+
+    # The queue: the next range of the file with the most bytes left, in turn.
+    left = [(start - size, number, 0) for number, (start, size, _, _) in enumerate(cuts)]
+    heapq.heapify(left)
+    submitted = 0
+    running = {}
+    # Ranges handed out but not reported yet; a range done before the ones
+    # ahead of it in its file waits in `done`.
+    unreported = 0
+    done = [{} for _ in paths]
+    reported = [0] * len(paths)
+    pieces = [0] * len(paths)
+    while left or running:
+      # A file's ranges are handed out in order, so the one its next report
+      # waits for is always running or done.
+      while left and unreported < 2 * workers:
+        remaining, number, position = heapq.heappop(left)
+        start, end = ranges[number][position]
+        job = pool.submit(_write_sized_range, paths[number], start, end, submitted, delimiter, target_size,
+                          size_basis, codecs[paths[number]], output_path, headers[number], row_limit=row_limit)
+        running[job] = (number, position)
+        submitted += 1
+        unreported += 1
+        if position + 1 < len(ranges[number]):
+          heapq.heappush(left, (remaining + end - start, number, position + 1))
+
+      # Report each file's pieces in file order as its ranges come in.
+      finished, _ = wait(running, return_when=FIRST_COMPLETED)
+      for job in finished:
+        number, position = running.pop(job)
+        done[number][position] = job
+        template = _with_extension(inputs[paths[number]], codecs[paths[number]])
+        while reported[number] in done[number]:
+          written, _ = done[number].pop(reported[number]).result()
+          reported[number] += 1
+          unreported -= 1
+          for piece in written:
+            pieces[number] += 1
+            piece_path = os.path.join(output_path, template % pieces[number])
+            os.replace(piece.path, piece_path)
+            _report(piece._replace(number=pieces[number], path=piece_path, source=paths[number]), on_chunk, ())
+
+  for path, header, count in zip(paths, headers, pieces):
+    if count == 0:
+      _write_empty(os.path.join(output_path, _with_extension(inputs[path], codecs[path]) % 1), delimiter,
+                   header, codecs[path], on_chunk, source=path)
+
+def _output_templates(paths):
+  # '<file name>_%s.csv' for each path, made unique with its position in the
+  # list where two paths have the same file name.
+  names = [os.path.splitext(os.path.basename(path))[0] for path in paths]
+  return {path: ('%s_%d' % (name, number) if names.count(name) > 1 else name) + '_%s.csv'
+          for number, (path, name) in enumerate(zip(paths, names), 1)}
+
+def parse_columns(ddl):
+
+  """
+  Returns the `Column`s of a CREATE TABLE statement, in order, for a
+  `Profile`. Types are kept as written, without the spaces ('NUMBER (38, 0)'
+  becomes 'NUMBER(38,0)'); table constraints are left out.
+  """
+  body = ddl[ddl.index('(') + 1:ddl.rindex(')')]
+  items = []
+  depth = start = 0
+  for i, character in enumerate(body):
+    if character == '(':
+      depth += 1
+    elif character == ')':
+      depth -= 1
+    elif character == ',' and depth == 0:
+      items.append(body[start:i])
+      start = i + 1
+  items.append(body[start:])
+  columns = []
+  for item in items:
+    match = _COLUMN_DEFINITION.match(item)
+    if match is None or match.group(1).upper() in ('CONSTRAINT', 'PRIMARY', 'UNIQUE', 'FOREIGN'):
+      continue
+    name, type_name, size, scale, rest = match.groups()
+    type_text = ' '.join(type_name.upper().split())
+    if size is not None:
+      type_text += '(%s)' % size if scale is None else '(%s,%s)' % (size, scale)
+    columns.append(Column(name.strip('"'), type_text, _NOT_NULL.search(rest) is None))
+  return columns
+
+class Profile:
+
+  """
+  Profiles the columns of the rows a split writes and checks each row against
+  a table definition, in the same pass that writes the pieces.
+
+  Per column it records the widest value, the NULLs, how many values parse as
+  numbers and as dates, and the smallest and largest value of numeric and
+  date columns. A row is bad if it has the wrong number of fields, a NULL in a
+  NOT NULL column, text longer than the column, a number with more integer
+  digits than the column's precision allows, or a value that is not a number,
+  date, timestamp or boolean where the column needs one. Bad rows are not
+  written to the pieces: without `reject_path` the split stops at the first
+  one with a `ConformanceError`, otherwise they are written to that CSV file
+  with their row number and the reason in front.
+
+  Arguments:
+
+    `columns`: The table's `Column`s, in file order (see `parse_columns`).
+    `reject_path`: Where to quarantine bad rows, or None to fail instead.
+    `null_if`: Field values loaded as NULL, besides the empty field.
+
+  Pass it to `split` as `profile`; afterwards `rows`, `rejected`, `samples`
+  (the first bad rows as (row, column, reason)) and `summary()` hold the
+  results. Row numbers count data rows from 1, without the header.
+
+  """
+
+  def __init__(self, columns, reject_path=None, null_if=('\\N',)):
+    self.columns = [Column(*column) for column in columns]
+    self.reject_path = reject_path
+    self.null_if = frozenset(null_if) | {''}
+    self.rules = [_column_rule(column.type) for column in self.columns]
+    self.headers = None
+    self.rows = 0
+    self.rejected = 0
+    self.samples = []
+    count = len(self.columns)
+    self.widths = [0] * count
+    self.nulls = [0] * count
+    self.numbers = [0] * count
+    self.dates = [0] * count
+    self.minimums = [None] * count
+    self.maximums = [None] * count
+    self.errors = [0] * count
+    self._rejects = None
+    self._writer = None
+
+  def start(self, headers):
+    # Called by the split before the first row; removes rejects of an earlier run.
+    self.headers = headers
+    if self.reject_path is not None and os.path.exists(self.reject_path):
+      os.remove(self.reject_path)
+
+  def part(self, index):
+    # An empty Profile with the same definition for one byte range of a
+    # parallel split, rejecting to a file of its own (without a header); see
+    # merge().
+    return Profile(self.columns, None if self.reject_path is None else '%s.part%d' % (self.reject_path, index),
+                   self.null_if)
+
+  def merge(self, part):
+    # Adds a range's Profile to this one. Ranges are merged in file order, so
+    # the rows merged so far are the offset of the part's row numbers.
+    offset = self.rows
+    self.rows += part.rows
+    self.rejected += part.rejected
+    for row, column, reason in part.samples:
+      self._sample(row + offset, column, reason)
+    for i in range(len(self.columns)):
+      self.widths[i] = max(self.widths[i], part.widths[i])
+      self.nulls[i] += part.nulls[i]
+      self.numbers[i] += part.numbers[i]
+      self.dates[i] += part.dates[i]
+      self.errors[i] += part.errors[i]
+      for value in (part.minimums[i], part.maximums[i]):
+        if value is not None:
+          self._extremes(i, value)
+    if part.rejected and part.reject_path is not None:
+      with open(part.reject_path, newline='') as rejects:
+        for record in csv.reader(rejects):
+          record[0] = int(record[0]) + offset
+          self._reject_record(record)
+      os.remove(part.reject_path)
+
+  def filter(self, rows):
+    # Yields the rows that would load and quarantines (or raises on) the rest.
+    for row in rows:
+      problem = self.check(row)
+      if problem is None:
+        yield row
+        continue
+      column, reason = problem
+      self.rejected += 1
+      self._sample(self.rows, column, reason)
+      if self.reject_path is None:
+        raise ConformanceError(self.rows, column, reason)
+      self._reject_record([self.rows, '%s: %s' % (column or 'row', reason)] + row)
+
+  def check(self, row):
+    # Adds a row to the statistics and returns (column name, reason) if it
+    # would not load, or None.
+    self.rows += 1
+    if len(row) != len(self.columns):
+      return None, '%d fields, the table has %d columns' % (len(row), len(self.columns))
+    problem = None
+    for i, value in enumerate(row):
+      width = len(value)
+      if width > self.widths[i]:
+        self.widths[i] = width
+      kind, size, scale = self.rules[i]
+      if value in self.null_if:
+        self.nulls[i] += 1
+        if not self.columns[i].nullable:
+          reason = 'NULL in a NOT NULL column'
+        else:
+          continue
+      else:
+        reason = None
+        number = _parse_number(value)
+        if number is not None:
+          self.numbers[i] += 1
+        day = _parse_date(value) if width <= 11 and not value.isdigit() else None
+        if day is not None:
+          self.dates[i] += 1
+        if kind == 'text':
+          if width > size:
+            reason = '%d characters, the column holds %d' % (width, size)
+        elif kind == 'number':
+          if number is None or not _number_fits(value, size, scale):
+            reason = '%r is not a NUMBER(%d,%d)' % (value, size, scale)
+          else:
+            self._extremes(i, _exact_number(value, scale))
+        elif kind == 'float':
+          if number is None:
+            reason = '%r is not a number' % (value,)
+          elif math.isinf(number):
+            reason = '%r is out of the FLOAT range' % (value,)
+          else:
+            self._extremes(i, number)
+        elif kind == 'date':
+          if day is None:
+            reason = '%r is not a date' % (value,)
+          else:
+            self._extremes(i, day)
+        elif kind == 'timestamp':
+          moment = _parse_timestamp(value)
+          if moment is None:
+            reason = '%r is not a timestamp' % (value,)
+          else:
+            self._extremes(i, moment.replace(tzinfo=None))
+        elif kind == 'boolean':
+          if value.lower() not in _BOOLEANS:
+            reason = '%r is not a boolean' % (value,)
+        if reason is None:
+          continue
+      self.errors[i] += 1
+      if problem is None:
+        problem = self.columns[i].name, reason
+    return problem
+
+  def close(self):
+    if self._rejects is not None:
+      self._rejects.close()
+      self._rejects = self._writer = None
+
+  def summary(self):
+    # The profile as text: one line per column, then the bad rows.
+    lines = ['%d rows, %d rejected%s' % (
+      self.rows, self.rejected, ' (to %s)' % self.reject_path if self.rejected and self.reject_path else '')]
+    lines.append('%-20s %-16s %7s %9s %9s %9s %7s  %s' % ('column', 'type', 'width', 'nulls', 'numbers',
+                                                          'dates', 'errors', 'min .. max'))
+    for i, column in enumerate(self.columns):
+      extremes = ''
+      if self.minimums[i] is not None:
+        extremes = '%s .. %s' % (self.minimums[i], self.maximums[i])
+      lines.append('%-20s %-16s %7d %9d %9d %9d %7d  %s' % (
+        column.name, column.type, self.widths[i], self.nulls[i], self.numbers[i], self.dates[i],
+        self.errors[i], extremes))
+    for row, column, reason in self.samples:
+      lines.append('row %d, %s: %s' % (row, column or 'row', reason))
+    return '\n'.join(lines)
+
+  def _extremes(self, i, value):
+    if self.minimums[i] is None or value < self.minimums[i]:
+      self.minimums[i] = value
+    if self.maximums[i] is None or value > self.maximums[i]:
+      self.maximums[i] = value
+
+  def _sample(self, row, column, reason):
+    if len(self.samples) < _REJECT_SAMPLES:
+      self.samples.append((row, column, reason))
+
+  def _reject_record(self, record):
+    # The reject file is only created once there is a row to put in it.
+    if self._writer is None:
+      self._rejects = open(self.reject_path, 'w', newline='')
+      self._writer = csv.writer(self._rejects)
+      if self.headers is not None:
+        self._writer.writerow(['row', 'error'] + list(self.headers))
+    self._writer.writerow(record)
+
+  def __getstate__(self):
+    # Parts travel to and from the worker processes without their open file.
+    state = self.__dict__.copy()
+    state['_rejects'] = state['_writer'] = None
+    return state
+
+def _column_rule(type_text):
+  # (kind, size, scale) for checking the values of a column of `type_text`.
+  match = re.match(r'\s*([A-Z_0-9 ]*?)\s*(?:\(\s*(\d+)\s*(?:,\s*(\d+)\s*)?\))?\s*$', type_text.upper())
+  name = match.group(1) if match else type_text.upper().strip()
+  size = int(match.group(2)) if match and match.group(2) else None
+  scale = int(match.group(3)) if match and match.group(3) else 0
+  if name in _TEXT_TYPES:
+    if size is None:
+      size = 1 if name in ('CHAR', 'CHARACTER', 'NCHAR') else 16777216
+    return 'text', size, 0
+  if name in _NUMBER_TYPES:
+    return 'number', 38 if size is None else size, scale
+  if name in _INTEGER_TYPES:
+    return 'number', 38, 0
+  if name in _FLOAT_TYPES:
+    return 'float', None, 0
+  if name == 'DATE':
+    return 'date', None, 0
+  if name.startswith('TIMESTAMP') or name == 'DATETIME':
+    return 'timestamp', None, 0
+  if name == 'BOOLEAN':
+    return 'boolean', None, 0
+  return 'other', None, 0
+
+def _parse_number(value):
+  try:
+    number = float(value)
+  except ValueError:
+    return None
+  return number if _NUMBER.match(value) else None
+
+def _exact_number(value, scale):
+  # A NUMBER value as Snowflake stores it: an int for scale 0, otherwise a
+  # Decimal rounded to the scale. Floats lose digits past 2**53, which keys
+  # of NUMBER(38,0) columns often have.
+  number = decimal.Decimal(value)
+  if scale == 0:
+    return int(number.to_integral_value(decimal.ROUND_HALF_UP))
+  return number.quantize(decimal.Decimal(1).scaleb(-scale), decimal.ROUND_HALF_UP, _NUMBER_CONTEXT)
+
+def _number_fits(value, size, scale):
+  # Whether the integer part of a number fits NUMBER(size, scale); extra
+  # decimals are rounded by Snowflake, extra integer digits fail the row. The
+  # digits come from the exponent, so 1e400 is too long rather than a float
+  # infinity.
+  number = decimal.Decimal(value)
+  digits = number.adjusted() + 1 if number and abs(number) >= 1 else 0
+  return digits <= size - scale
+
+def _parse_date(value):
+  # The date formats Snowflake's DATE_FORMAT AUTO recognizes: 2024-01-31,
+  # 31-Jan-2024 and 01/31/2024.
+  if len(value) < 8 or not value[0].isdigit():
+    return None
+  try:
+    return datetime.date.fromisoformat(value)
+  except ValueError:
+    pass
+  date_format = {'-': '%d-%b-%Y', '/': '%m/%d/%Y'}.get(value[2])
+  if date_format is not None:
+    try:
+      return datetime.datetime.strptime(value, date_format).date()
+    except ValueError:
+      pass
+  return None
+
+def _parse_timestamp(value):
+  try:
+    return datetime.datetime.fromisoformat(value)
+  except ValueError:
+    return None
+
+def _naive_datetime(moment):
+  # A date or datetime as a datetime without a time zone, for comparing.
+  if not isinstance(moment, datetime.datetime):
+    return datetime.datetime.combine(moment, datetime.time())
+  return moment.replace(tzinfo=None)
+
+class Partitioning:
+
+  """
+  How `split` routes rows to files by the value of one column, so each file
+  holds one date range or one set of keys and the table Snowflake loads from
+  them is clustered on that column from the start.
+
+  Arguments:
+
+    `column`: The column's name (the file needs a header) or 0-based index.
+    `ranges`: For range buckets: 'year', 'month' or 'day' to put the rows of
+      each period of a date or timestamp column in files of their own, or a
+      sorted list of boundaries (dates, datetimes, numbers or strings) where
+      bucket i holds the values from boundary i - 1 up to, but not including,
+      i. With datetime boundaries the values are read as timestamps (a date
+      is its midnight) and time zones are ignored, as in `Profile`.
+    `buckets`: For hash buckets: the number of buckets the column's values are
+      hashed to (a stable CRC32 of the text), e.g. for a key column.
+    `max_open_files`: Output files kept open at once. Rows are buffered per
+      bucket and a file is (re)opened, in append mode, when its buffer is
+      written; the least recently written one is closed when more would be
+      open. Concatenated gzip members and zstd frames read as one stream.
+    `buffer_size`: Characters of rows buffered over all buckets before the
+      largest buffer is written out.
+
+  Values that cannot be bucketed go to 'other', empty ones to 'null'. Each
+  bucket's files roll over at `row_limit` rows or `target_size` like an
+  unpartitioned split. Pieces are numbered in the order they are finished,
+  which is when they are full or, for the last piece of every bucket, when
+  the input ends, in bucket order; their file names hold the bucket as well,
+  e.g. output_1994-03_12.csv, and `Piece.partition` is the bucket.
+
+  """
+
+  def __init__(self, column, ranges=None, buckets=None, max_open_files=32, buffer_size=64 * 1024 * 1024):
+    if (ranges is None) == (buckets is None):
+      raise ValueError('a Partitioning needs either ranges or buckets')
+    if isinstance(ranges, str) and ranges not in _PERIODS:
+      raise ValueError("ranges must be 'year', 'month', 'day' or a list of boundaries, not %r" % (ranges,))
+    self.column = column
+    if ranges is not None and not isinstance(ranges, str):
+      if any(isinstance(boundary, datetime.datetime) for boundary in ranges):
+        ranges = [_naive_datetime(boundary) for boundary in ranges]
+      ranges = sorted(ranges)
+    self.ranges = ranges
+    self.buckets = buckets
+    self.max_open_files = max(1, max_open_files)
+    self.buffer_size = buffer_size
+
+  def index(self, headers):
+    # The position of the column in the rows.
+    if isinstance(self.column, int):
+      return self.column
+    if headers is None:
+      raise ValueError('partitioning by column name %r needs the file to have headers' % (self.column,))
+    return list(headers).index(self.column)
+
+  def bucket(self, value):
+    # The bucket label of a value; it becomes part of the file names.
+    if value == '':
+      return 'null'
+    if self.buckets is not None:
+      return 'h%03d' % (zlib.crc32(value.encode()) % self.buckets)
+    if isinstance(self.ranges, str):
+      day = _parse_date(value[:10] if len(value) > 10 and value[10] in ' T' else value)
+      if day is None:
+        return 'other'
+      return day.isoformat()[:_PERIODS[self.ranges]]
+    boundary = self.ranges[0]
+    if isinstance(boundary, datetime.datetime):
+      key = _parse_timestamp(value)
+      if key is None:
+        key = _parse_date(value)
+      key = None if key is None else _naive_datetime(key)
+    elif isinstance(boundary, datetime.date):
+      key = _parse_date(value[:10] if len(value) > 10 and value[10] in ' T' else value)
+    elif isinstance(boundary, (int, float)):
+      key = _parse_number(value)
+    else:
+      key = value
+    if key is None:
+      return 'other'
+    return 'r%02d' % bisect.bisect_right(self.ranges, key)
+
+class _PartitionWriter:
+
+  # Writes the rows of a partitioned split: buffers them per bucket, writes
+  # the buffers through at most `max_open_files` open files and finishes a
+  # bucket's piece once it is full. See Partitioning.
+
+  def __init__(self, partitioning, delimiter, headers, row_limit, target_size, size_basis, codec,
+               temp_for, path_for, on_chunk, skip_pieces):
+    self.partitioning = partitioning
+    self.column = partitioning.index(headers)
+    self.delimiter = delimiter
+    self.headers = headers
+    self.row_limit = row_limit
+    self.target_size = target_size
+    self.codec = codec
+    self.temp_for = temp_for
+    self.path_for = path_for
+    self.on_chunk = on_chunk
+    self.skip_pieces = skip_pieces
+    self.estimator = _CompressionEstimator() if target_size and size_basis == 'compressed' else None
+    self.open = {}
+    self.buffered = 0
+    self.pieces = []
+    self.files = 0
+
+  def write(self, rows):
+    buckets = {}
+    column = self.column
+    for row in rows:
+      label = self.partitioning.bucket(row[column]) if column < len(row) else 'other'
+      bucket = buckets.get(label)
+      if bucket is None:
+        bucket = buckets[label] = _Bucket(label, self.temp_for(label, self.files))
+        self.files += 1
+      bucket.rows.append(row)
+      bucket.count += 1
+      size = sum(map(len, row)) + len(row)
+      bucket.chars += size
+      self.buffered += size
+      if self.target_size:
+        ratio = self.estimator.ratio if self.estimator is not None and self.estimator.ratio else 1.0
+        full = bucket.chars * ratio >= self.target_size
+      else:
+        full = bucket.count >= self.row_limit
+      if full:
+        self.finish(buckets.pop(label))
+      elif self.buffered > self.partitioning.buffer_size:
+        self.flush(max(buckets.values(), key=lambda bucket: bucket.buffered_chars()))
+    for label in sorted(buckets):
+      self.finish(buckets[label])
+    return self.pieces
+
+  def flush(self, bucket):
+    # Writes a bucket's buffered rows to its file, opening it if need be. The
+    # open files are kept least recently written first.
+    chunk, _ = self.open.pop(bucket.label, (None, None))
+    if chunk is None:
+      if len(self.open) >= self.partitioning.max_open_files:
+        self.close(self.open.pop(next(iter(self.open))))
+      chunk = _Chunk(bucket.path, self.delimiter, None if bucket.written else self.headers, self.codec,
+                     self.estimator, append=bucket.written, buffer_size=_SEEK_BLOCK)
+      bucket.written = True
+    self.open[bucket.label] = (chunk, bucket)
+    if self.estimator is not None:
+      for row in bucket.rows:
+        chunk.writerow(row)
+    else:
+      chunk.writerows(bucket.rows)
+    self.buffered -= bucket.buffered_chars()
+    bucket.flushed = bucket.chars
+    bucket.rows = []
+
+  def close(self, entry):
+    chunk, bucket = entry
+    chunk.close()
+    bucket.raw_bytes += chunk.raw_bytes
+
+  def finish(self, bucket):
+    # Completes a bucket's piece, numbers it and hands it on.
+    self.flush(bucket)
+    self.close(self.open.pop(bucket.label))
+    number = len(self.pieces) + 1
+    path = self.path_for(bucket.label, number)
+    piece = Piece(number, path, bucket.count, bucket.raw_bytes, None, None, bucket.label)
+    self.pieces.append(piece)
+    if number in self.skip_pieces:
+      os.remove(bucket.path)
+      return
+    os.replace(bucket.path, path)
+    if self.on_chunk:
+      self.on_chunk(piece)
+
+class _Bucket:
+
+  # The piece being written for one partition: its temporary path, its rows
+  # so far, and those not written to the file yet.
+
+  def __init__(self, label, path):
+    self.label = label
+    self.path = path
+    self.rows = []
+    self.count = 0
+    self.chars = 0
+    self.flushed = 0
+    self.raw_bytes = 0
+    self.written = False
+
+  def buffered_chars(self):
+    return self.chars - self.flushed
+
+def _write_partitions(reader, delimiter, headers, partitioning, row_limit, target_size, size_basis, codec,
+                      temp_for, path_for, on_chunk=None, skip_pieces=(), profile=None):
+  # Writes the rows from `reader` partitioned by `partitioning` and returns
+  # the Pieces, skipped ones included (their files are deleted). Pieces are
+  # written to temp_for(label, n) and moved to path_for(label, number).
+  rows = iter(reader)
+  if profile is not None:
+    rows = profile.filter(rows)
+  writer = _PartitionWriter(partitioning, delimiter, headers, row_limit, target_size, size_basis, codec,
+                            temp_for, path_for, on_chunk, skip_pieces)
+  return writer.write(rows)
+
+class ChangeIndex:
+
+  """
+  Row-level change detection for incremental loads: an index of row key ->
+  content hash from the previous load, against which `split` keeps only the
+  rows that are new or changed.
+
+  The key is kept as a 128-bit and the content as a 64-bit BLAKE2b digest of
+  the fields (joined by \\x1f), so the index file takes 24 bytes a row however
+  wide the rows are, and two keys are only taken for one if their digests
+  collide, which is not to be expected at any row count. In memory the index
+  is a dict, about 120 bytes a row; a split holds the old and the new index,
+  so about 250 bytes a row of the file (2.5GB for 10 million rows). A key
+  that occurs more than once in the file is only passed on the first time;
+  the later rows are counted in `duplicates`. Keys of the old index that are
+  not in the file are counted in `deleted` once the split is done; their rows
+  are not removed anywhere. Blank lines are dropped; rows too short to hold
+  the key columns are passed on unindexed (the load reports them as it would
+  without change detection) and counted in `short`.
+
+  The index is only replaced once the changed rows are loaded: the split
+  writes the new index next to the old one as `path` + '.pending', and
+  `commit()` moves it into place. A load that fails before then leaves the
+  old index, so the next run finds the same changes again.
+
+  Arguments:
+
+    `path`: The index file. Without one every row is new.
+    `key`: The key columns, as names (the file needs a header) or 0-based
+      indexes.
+
+  """
+
+  def __init__(self, path, key):
+    self.path = path
+    self.key = [key] if isinstance(key, (str, int)) else list(key)
+    self.old = self._read(path) if os.path.exists(path) else {}
+    self.new = {}
+    self.inserted = self.changed = self.unchanged = self.duplicates = self.short = 0
+    self.deleted = None
+    self.columns = None
+
+  def start(self, headers):
+    # Called by the split before the first row.
+    self.columns = [column if isinstance(column, int) else self._index(headers, column) for column in self.key]
+    self.new = {}
+    self.inserted = self.changed = self.unchanged = self.duplicates = self.short = 0
+
+  def filter(self, rows):
+    # Yields the rows that are new or changed since the previous load.
+    columns = self.columns
+    old = self.old
+    new = self.new
+    width = max(columns) + 1 if columns else 0
+    for row in rows:
+      if not row:
+        continue
+      if len(row) < width:
+        self.short += 1
+        yield row
+        continue
+      key = _row_hash([row[column] for column in columns], 16)
+      if key in new:
+        self.duplicates += 1
+        continue
+      content = _row_hash(row)
+      new[key] = content
+      previous = old.get(key)
+      if previous == content:
+        self.unchanged += 1
+        continue
+      if previous is None:
+        self.inserted += 1
+      else:
+        self.changed += 1
+      yield row
+
+  def finish(self):
+    # Called by the split once every row is read: writes the pending index.
+    self.deleted = sum(1 for key in self.old if key not in self.new)
+    records = array.array('Q')
+    for key, content in self.new.items():
+      records.append(key & 0xFFFFFFFFFFFFFFFF)
+      records.append(key >> 64)
+      records.append(content)
+    with open(self.path + '.pending', 'wb') as f:
+      f.write(_INDEX_MAGIC)
+      records.tofile(f)
+
+  def pending(self):
+    return os.path.exists(self.path + '.pending')
+
+  def commit(self):
+    # Makes the index of the last split the one the next split compares with.
+    os.replace(self.path + '.pending', self.path)
+    self.old, self.new = self.new, {}
+
+  def summary(self):
+    return '%d new, %d changed, %d unchanged, %s deleted, %d duplicate keys, %d short rows' % (
+      self.inserted, self.changed, self.unchanged, '?' if self.deleted is None else self.deleted, self.duplicates,
+      self.short)
+
+  def _index(self, headers, column):
+    if headers is None:
+      raise ValueError('change detection by column name %r needs the file to have headers' % (column,))
+    if column not in headers:
+      raise ValueError('change detection column %r is not in the header' % (column,))
+    return list(headers).index(column)
+
+  @staticmethod
+  def _read(path):
+    records = array.array('Q')
+    with open(path, 'rb') as f:
+      if f.read(len(_INDEX_MAGIC)) != _INDEX_MAGIC:
+        raise ValueError('%s is not a row index of this version (its keys are 64-bit hashes); '
+                         'delete it to load every row again' % (path,))
+      records.frombytes(f.read())
+    return {low | high << 64: content
+            for low, high, content in zip(records[0::3], records[1::3], records[2::3])}
+
+def _row_hash(fields, digest_size=8):
+  return int.from_bytes(hashlib.blake2b('\x1f'.join(fields).encode(), digest_size=digest_size).digest(), 'little')
+
+def raw_split(filehandler, row_limit=100000, output_name_template='output_%s.csv', output_path='C://Users//north//OneDrive//Documents//Snowflake//SampleData//SplitFIleFdr//', keep_headers=True, workers=1, target_size=None, size_basis='raw', compression=None, compression_level=None, compression_threads=1, on_chunk=None, skip_pieces=()):
+
+  """
+  Splits a CSV file by copying byte slices instead of parsing rows.
+
+  The file is memory-mapped and its newlines are located a block at a time
+  with numpy. When no newline falls inside a quoted field and every \\r is part
+  of a \\r\\n, each newline ends a row, so the pieces are plain slices of the
+  input and are written without going through csv at all. The rows in each
+  piece are the ones `split` puts there; the bytes are the input's own (line
+  endings and quoting are not normalized).
+
+  Arguments:
+
+    Same as `split`; `workers` processes copy (and compress) pieces in
+    parallel, a couple per worker ahead of `on_chunk`.
+
+  Returns False, having written nothing, if the file is not safe to copy this
+  way or numpy is not installed, and True once the pieces are written.
+
+  """
+  if numpy is None:
+    return False
+  codec = _codec(compression, compression_level, compression_threads)
+  if codec is not None:
+    output_name_template += _COMPRESSION_EXTENSIONS[compression]
+
+  with open(filehandler, 'rb') as f, _map(f) as mm:
+    size = len(mm)
+    header = b''
+    data_start = 0
     if keep_headers:
-      headers = next(reader)
-      current_out_writer.writerow(headers)
-    for i, row in enumerate(reader):
-      if i + 1 > current_limit:
-          current_piece += 1
-          current_limit = row_limit * current_piece
-          current_out_path = os.path.join(output_path,output_name_template % current_piece)
-          current_out_writer = csv.writer(open(current_out_path, 'w', newline=''), delimiter=delimiter)
-          if keep_headers:
-              current_out_writer.writerow(headers)
-      current_out_writer.writerow(row)
+      data_start = _find_row_start(filehandler, 0, False, size)
+      header = bytes(mm[:data_start])
+      if header.replace(b'\r\n', b'').count(b'\r'):
+        return False
+      if header and not header.endswith(b'\n'):
+        header += b'\r\n'
+    target_bytes = None
+    if target_size:
+      target_bytes = target_size
+      if size_basis == 'compressed':
+        target_bytes = target_size / _sample_ratio(mm, data_start)
+    scanned = _scan_raw(mm, data_start, row_limit, target_bytes)
+    if scanned is None:
+      return False
+    cuts, row_ends, rows = scanned
+    if not cuts or cuts[-1] < size:
+      cuts.append(size)
+      # A last row without a newline still counts.
+      row_ends.append(rows + (size > data_start and mm[size - 1] != 10))
+
+  starts = [data_start] + cuts[:-1]
+  pieces = [Piece(number, os.path.join(output_path, output_name_template % number),
+                  row_end - row_start, len(header) + end - start, start, end)
+            for number, start, end, row_start, row_end
+            in zip(itertools.count(1), starts, cuts, [0] + row_ends[:-1], row_ends)
+            if number not in skip_pieces]
+  if workers is None or workers > 1:
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+      # Only run a couple of copies per worker ahead of on_chunk, so a blocking
+      # callback throttles the split.
+      running = deque()
+      for piece in pieces:
+        running.append((pool.submit(_copy_piece, filehandler, piece.start, piece.end, header, piece.path,
+                                    codec), piece))
+        if len(running) >= 2 * workers:
+          _finish_copy(running.popleft(), on_chunk)
+      while running:
+        _finish_copy(running.popleft(), on_chunk)
+  else:
+    for piece in pieces:
+      _copy_piece(filehandler, piece.start, piece.end, header, piece.path, codec)
+      if on_chunk:
+        on_chunk(piece)
+  return True
+
+def _finish_copy(running, on_chunk):
+  job, piece = running
+  job.result()
+  if on_chunk:
+    on_chunk(piece)
+
+def _map(f):
+  # Read-only memory map of a file; an empty file gets an empty buffer since
+  # mmap cannot map zero bytes.
+  if os.fstat(f.fileno()).st_size == 0:
+    return memoryview(b'')
+  return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+def _sample_ratio(mm, start):
+  # gzip ratio of a few samples spread across the data, for size_basis='compressed'.
+  size = len(mm)
+  step = max(_SAMPLE_SIZE, (size - start) // 8)
+  raw = compressed = 0
+  for offset in range(start, size, step):
+    sample = mm[offset:offset + _SAMPLE_SIZE]
+    raw += len(sample)
+    compressed += len(zlib.compress(sample, 6))
+  return compressed / raw if raw else 1.0
+
+def _scan_raw(mm, start, row_limit, target_bytes):
+  # Offsets at which pieces end (just past a newline), cutting every
+  # `row_limit` rows or, with `target_bytes`, at the first newline at or past
+  # that many bytes into the piece. Returns (cuts, rows up to each cut, total
+  # newlines), or None if a newline is inside a quoted field or a \r is not
+  # followed by \n.
+  size = len(mm)
+  cuts = []
+  row_ends = []
+  rows = 0
+  piece_start = start
+  quote_parity = 0
+  for block_start in range(start, size, _SCAN_BLOCK):
+    length = min(_SCAN_BLOCK, size - block_start)
+    block = numpy.frombuffer(mm, numpy.uint8, length, block_start)
+    newlines = numpy.flatnonzero(block == 10)
+    quotes = numpy.flatnonzero(block == 34)
+    returns = numpy.flatnonzero(block == 13)
+    if len(returns):
+      following = returns + 1
+      if following[-1] == length:
+        if block_start + length == size or mm[block_start + length] != 10:
+          return None
+        following = following[:-1]
+      if (block[following] != 10).any():
+        return None
+    if len(quotes):
+      # Quotes from the start of the data up to each newline must be even.
+      if ((numpy.searchsorted(quotes, newlines) + quote_parity) % 2).any():
+        return None
+      quote_parity = (quote_parity + len(quotes)) % 2
+    elif quote_parity and len(newlines):
+      # A field opened in an earlier block is still open at these newlines.
+      return None
+    ends = newlines + (block_start + 1)
+    if target_bytes:
+      while True:
+        i = numpy.searchsorted(ends, piece_start + target_bytes)
+        if i == len(ends):
+          break
+        piece_start = int(ends[i])
+        cuts.append(piece_start)
+        row_ends.append(rows + int(i) + 1)
+    else:
+      first = row_limit - rows % row_limit - 1
+      for end in ends[first::row_limit]:
+        cuts.append(int(end))
+        row_ends.append(len(row_ends) * row_limit + row_limit)
+    rows += len(newlines)
+  return cuts, row_ends, rows
+
+def _copy_piece(path, start, end, header, piece_path, codec):
+  # Writes header + bytes [start, end) of `path` to `piece_path`.
+  with open(path, 'rb') as f, _map(f) as mm:
+    out = _open_output(piece_path, codec)
+    try:
+      out.write(header)
+      view = memoryview(mm)
+      try:
+        for offset in range(start, end, _GZIP_BLOCK):
+          out.write(view[offset:min(offset + _GZIP_BLOCK, end)])
+      finally:
+        view.release()
+    finally:
+      out.close()
+
+class _CompressionEstimator:
+
+  # Running estimate of the gzip ratio of the rows being written. Every
+  # `_SAMPLE_STRIDE` characters a `_SAMPLE_SIZE` sample is compressed at the
+  # level PUT's auto_compress uses, so the estimate follows the data as it
+  # changes without compressing all of it.
+
+  def __init__(self):
+    self.ratio = None
+    self._sample = []
+    self._sampled = 0
+    self._skip = 0
+
+  def update(self, text):
+    if self._skip > 0:
+      self._skip -= len(text)
+      return
+    self._sample.append(text)
+    self._sampled += len(text)
+    if self._sampled >= _SAMPLE_SIZE:
+      raw = ''.join(self._sample).encode()
+      ratio = len(zlib.compress(raw, 6)) / len(raw)
+      self.ratio = ratio if self.ratio is None else (self.ratio + ratio) / 2
+      self._sample = []
+      self._sampled = 0
+      self._skip = _SAMPLE_STRIDE
+
+class _Chunk:
+
+  # One output file. Counts the rows and characters written to it so callers
+  # can roll to a new file by size; after close `raw_bytes` is the exact
+  # uncompressed size.
+
+  def __init__(self, path, delimiter, headers, codec=None, estimator=None, append=False,
+               buffer_size=_GZIP_BLOCK):
+    self.path = path
+    self.rows = 0
+    self.raw_bytes = 0
+    self._estimator = estimator
+    self._counter = _CountingWriter(_open_output(path, codec, 'ab' if append else 'wb'))
+    self._file = io.TextIOWrapper(io.BufferedWriter(self._counter, buffer_size), newline='')
+    self._writer = csv.writer(self, delimiter=delimiter)
+    if headers is not None:
+      self._writer.writerow(headers)
+
+  def write(self, text):
+    # Called by csv.writer once per row.
+    self._file.write(text)
+    self.raw_bytes += len(text)
+    if self._estimator is not None:
+      self._estimator.update(text)
+
+  def size(self):
+    if self._estimator is not None:
+      return self.raw_bytes * (self._estimator.ratio or 1.0)
+    return self.raw_bytes
+
+  def writerow(self, row):
+    self._writer.writerow(row)
+    self.rows += 1
+
+  def writerows(self, rows):
+    # Fast path for row_limit splitting: csv.writer writes straight to the
+    # file without the per-row size bookkeeping.
+    writer = csv.writer(self._file, delimiter=self._writer.dialect.delimiter)
+    for row in rows:
+      writer.writerow(row)
+      self.rows += 1
+
+  def close(self):
+    self._file.close()
+    self.raw_bytes = self._counter.count
+
+class _CountingWriter(io.RawIOBase):
+
+  # Byte sink that counts the bytes passing through it to `target`.
+
+  def __init__(self, target):
+    self.target = target
+    self.count = 0
+
+  def writable(self):
+    return True
+
+  def write(self, data):
+    self.target.write(data)
+    n = len(data)
+    self.count += n
+    return n
+
+  def close(self):
+    if not self.closed:
+      self.target.close()
+    super().close()
+
+class _ParallelGzipWriter(io.RawIOBase):
+
+  # gzip writer that compresses _GZIP_BLOCK sized blocks as independent gzip
+  # members on a thread pool (zlib releases the GIL) and writes them in order.
+
+  def __init__(self, path, level, threads, mode='wb'):
+    self._file = open(path, mode)
+    self._level = level
+    self._threads = threads
+    self._pool = ThreadPoolExecutor(max_workers=threads)
+    self._pending = deque()
+    self._buffer = bytearray()
+
+  def writable(self):
+    return True
+
+  def write(self, data):
+    self._buffer += data
+    if len(self._buffer) >= _GZIP_BLOCK:
+      self._submit()
+    return len(data)
+
+  def _submit(self):
+    self._pending.append(self._pool.submit(gzip.compress, bytes(self._buffer), self._level, mtime=0))
+    self._buffer = bytearray()
+    # Keep at most two blocks per thread in memory.
+    while len(self._pending) > 2 * self._threads:
+      self._file.write(self._pending.popleft().result())
+
+  def close(self):
+    if not self.closed:
+      if self._buffer:
+        self._submit()
+      while self._pending:
+        self._file.write(self._pending.popleft().result())
+      self._pool.shutdown()
+      self._file.close()
+    super().close()
+
+def _codec(compression, level, threads):
+  # Normalizes the compression arguments of split into (name, level, threads),
+  # or None for plain output.
+  if compression is None:
+    return None
+  if compression not in _COMPRESSION_EXTENSIONS:
+    raise ValueError("compression must be None, 'gzip' or 'zstd', not %r" % (compression,))
+  if compression == 'zstd' and zstandard is None:
+    raise ImportError("compression='zstd' needs the zstandard package")
+  if level is None:
+    level = _COMPRESSION_LEVELS[compression]
+  return (compression, level, max(1, threads or 1))
+
+def _open_output(path, codec, mode='wb'):
+  # Binary stream that writes `path` with the codec from _codec; mode 'ab'
+  # appends a new gzip member or zstd frame to an existing file.
+  if codec is None:
+    return open(path, mode)
+  compression, level, threads = codec
+  if compression == 'gzip':
+    if threads > 1:
+      return _ParallelGzipWriter(path, level, threads, mode)
+    return gzip.GzipFile(path, mode, compresslevel=level, mtime=0)
+  compressor = zstandard.ZstdCompressor(level=level, threads=threads if threads > 1 else 0)
+  return compressor.stream_writer(open(path, mode))
+
+# What a Parquet split writes (the `codec` of its pieces): the Arrow schema of
+# the table's columns, the column chunk codec and level, and the rows per row
+# group.
+_ParquetFormat = namedtuple('_ParquetFormat', 'schema compression level row_group_size')
+
+def _output_codec(file_format, compression, level, threads, columns, row_group_size):
+  # The codec argument of the writers for split's output arguments: _codec's
+  # for CSV, or a _ParquetFormat.
+  if file_format == 'csv':
+    return _codec(compression, level, threads)
+  if file_format != 'parquet':
+    raise ValueError("file_format must be 'csv' or 'parquet', not %r" % (file_format,))
+  if pyarrow is None:
+    raise ImportError("file_format='parquet' needs the pyarrow package")
+  if not columns:
+    raise ValueError("file_format='parquet' needs the table's columns")
+  if compression not in _PARQUET_COMPRESSIONS:
+    raise ValueError('Parquet compression must be one of %s, not %r' % (_PARQUET_COMPRESSIONS, compression))
+  schema = pyarrow.schema([pyarrow.field(column.name, _arrow_type(column.type), column.nullable)
+                           for column in columns])
+  return _ParquetFormat(schema, compression, level, row_group_size)
+
+def _with_extension(output_name_template, codec):
+  # The output name template with the extension of the codec: .parquet in
+  # place of .csv for Parquet, .gz or .zst added for compressed CSV.
+  if isinstance(codec, _ParquetFormat):
+    if output_name_template.endswith('.csv'):
+      output_name_template = output_name_template[:-len('.csv')]
+    return output_name_template + '.parquet'
+  if codec is not None:
+    return output_name_template + _COMPRESSION_EXTENSIONS[codec[0]]
+  return output_name_template
+
+def _open_chunk(path, delimiter, headers, codec, estimator=None):
+  # A new output file for the codec from _output_codec.
+  if isinstance(codec, _ParquetFormat):
+    return _ParquetChunk(path, codec, estimator)
+  return _Chunk(path, delimiter, headers, codec, estimator)
+
+def _arrow_type(type_text):
+  # The Arrow type Parquet files hold a column of Snowflake `type_text` in.
+  kind, size, scale = _column_rule(type_text)
+  if kind == 'number':
+    return pyarrow.int64() if scale == 0 and size <= 18 else pyarrow.decimal128(size, scale)
+  if kind == 'float':
+    return pyarrow.float64()
+  if kind == 'date':
+    return pyarrow.date32()
+  if kind == 'timestamp':
+    zoned = type_text.upper().split('(')[0].strip() in ('TIMESTAMP_TZ', 'TIMESTAMP_LTZ')
+    return pyarrow.timestamp('us', tz='UTC' if zoned else None)
+  if kind == 'boolean':
+    return pyarrow.bool_()
+  return pyarrow.string()
+
+def _arrow_array(values, field):
+  # A column of CSV values as an array of the field's type. pyarrow casts
+  # what it can parse; the rest (1.5 for an integer, 31-Jan-2024 for a date)
+  # is converted value by value as Snowflake would load it.
+  strings = pyarrow.array([None if value in _PARQUET_NULLS else value for value in values], pyarrow.string())
+  if pyarrow.types.is_string(field.type):
+    return strings
+  try:
+    return pyarrow.compute.cast(strings, field.type)
+  except (pyarrow.ArrowInvalid, pyarrow.ArrowNotImplementedError):
+    return pyarrow.array([_arrow_value(value, field) for value in strings.to_pylist()], field.type)
+
+def _arrow_value(value, field):
+  if value is None:
+    return None
+  kind = field.type
+  converted = None
+  try:
+    if pyarrow.types.is_integer(kind):
+      converted = int(decimal.Decimal(value).to_integral_value(decimal.ROUND_HALF_UP))
+    elif pyarrow.types.is_decimal(kind):
+      converted = decimal.Decimal(value).quantize(decimal.Decimal(1).scaleb(-kind.scale), decimal.ROUND_HALF_UP)
+    elif pyarrow.types.is_floating(kind):
+      converted = float(value)
+    elif pyarrow.types.is_date(kind):
+      converted = _parse_date(value)
+    elif pyarrow.types.is_timestamp(kind):
+      converted = _parse_timestamp(value)
+    elif pyarrow.types.is_boolean(kind):
+      converted = True if value.lower() in _PARQUET_TRUE else False if value.lower() in _PARQUET_FALSE else None
+  except (ValueError, ArithmeticError):
+    pass
+  if converted is None:
+    raise ValueError('%r is not a valid %s for column %s' % (value, kind, field.name))
+  return converted
+
+class _ParquetChunk:
+
+  # One Parquet output file. Rows are collected by column and written as a
+  # row group every `row_group_size` rows. `raw_bytes` counts the rows as CSV
+  # text, so size-targeted splits roll over as they do for CSV; with an
+  # estimator, size() is the file size so far plus the pending rows at the
+  # ratio of the row groups already written.
+
+  def __init__(self, path, parquet_format, estimator=None):
+    self.path = path
+    self.rows = 0
+    self.raw_bytes = 0
+    self._format = parquet_format
+    self._estimator = estimator
+    self._columns = [[] for _ in parquet_format.schema]
+    self._pending_bytes = 0
+    self._sink = pyarrow.OSFile(path, 'wb')
+    self._writer = pyarrow.parquet.ParquetWriter(
+      self._sink, parquet_format.schema, compression=parquet_format.compression or 'none',
+      compression_level=parquet_format.level)
+
+  def size(self):
+    if self._estimator is None:
+      return self.raw_bytes
+    written = self.raw_bytes - self._pending_bytes
+    ratio = self._sink.tell() / written if written else 1.0
+    return self._sink.tell() + self._pending_bytes * ratio
+
+  def writerow(self, row):
+    columns = self._columns
+    if len(row) != len(columns):
+      raise ValueError('a row of %d fields does not fit the %d columns of %s'
+                       % (len(row), len(columns), self.path))
+    for values, value in zip(columns, row):
+      values.append(value)
+    line_bytes = sum(map(len, row)) + len(row)
+    self.raw_bytes += line_bytes
+    self._pending_bytes += line_bytes
+    self.rows += 1
+    if len(columns[0]) >= self._format.row_group_size:
+      self._flush()
+
+  def writerows(self, rows):
+    for row in rows:
+      self.writerow(row)
+
+  def _flush(self):
+    schema = self._format.schema
+    arrays = [_arrow_array(values, schema.field(i)) for i, values in enumerate(self._columns)]
+    table = pyarrow.Table.from_arrays(arrays, schema=schema)
+    self._writer.write_table(table, row_group_size=max(1, len(table)))
+    self._columns = [[] for _ in schema]
+    self._pending_bytes = 0
+
+  def close(self):
+    if self._columns and self._columns[0]:
+      self._flush()
+    self._writer.close()
+    self._sink.close()
+
+def _write_pieces(reader, delimiter, headers, row_limit, target_size, size_basis, codec, path_for,
+                  on_chunk=None, skip_pieces=(), profile=None):
+  # Writes the rows from `reader` to pieces 1, 2, ... (paths from `path_for`),
+  # rolling every `row_limit` rows or, if `target_size` is set, whenever the
+  # current piece reaches it, and passes the Piece for each closed file to
+  # `on_chunk`. Returns those Pieces (not the skipped ones). A piece is only
+  # opened once it has a row to hold. With a `profile` the rows go through
+  # it, rejected rows counting towards `row_limit` (skipped pieces' rows are
+  # profiled too, so the rejects are the same on a rerun).
+  estimator = _CompressionEstimator() if target_size and size_basis == 'compressed' else None
+  pieces = []
+  rows = iter(reader)
+  if profile is not None and target_size:
+    rows = profile.filter(rows)
+  for number, first in enumerate(rows, 1):
+    if not target_size:
+      piece_rows = itertools.chain((first,), itertools.islice(rows, row_limit - 1))
+      if profile is not None:
+        piece_rows = profile.filter(piece_rows)
+    if number in skip_pieces and not target_size:
+      deque(piece_rows, maxlen=0)
+      continue
+    chunk = _open_chunk(path_for(number), delimiter, headers, codec, estimator)
+    if target_size:
+      chunk.writerow(first)
+      while chunk.size() < target_size:
+        row = next(rows, None)
+        if row is None:
+          break
+        chunk.writerow(row)
+    else:
+      chunk.writerows(piece_rows)
+    chunk.close()
+    piece = Piece(number, chunk.path, chunk.rows, chunk.raw_bytes, None, None)
+    if number in skip_pieces:
+      os.remove(chunk.path)
+      continue
+    pieces.append(piece)
+    if on_chunk:
+      on_chunk(piece)
+  return pieces
+
+class _RangeReader(io.RawIOBase):
+
+  # Raw byte stream over the slice [start, end) of a file.
+
+  def __init__(self, path, start, end):
+    self._file = open(path, 'rb')
+    self._file.seek(start)
+    self._remaining = end - start
+
+  def readable(self):
+    return True
+
+  def readinto(self, buffer):
+    if self._remaining <= 0:
+      return 0
+    view = memoryview(buffer)[:self._remaining]
+    n = self._file.readinto(view)
+    self._remaining -= n
+    return n
+
+  def close(self):
+    self._file.close()
+    super().close()
+
+def _open_range(path, start, end):
+  # Text view of a byte range, decoded the same way open(path) decodes the
+  # whole file (default encoding, universal newlines).
+  return io.TextIOWrapper(io.BufferedReader(_RangeReader(path, start, end), _SEEK_BLOCK * 16))
+
+def _count_quotes(path, start, end):
+  count = 0
+  with open(path, 'rb') as f:
+    f.seek(start)
+    remaining = end - start
+    while remaining > 0:
+      block = f.read(min(_SCAN_BLOCK, remaining))
+      if not block:
+        break
+      count += block.count(b'"')
+      remaining -= len(block)
+  return count
+
+def _find_row_start(path, offset, in_quotes, size):
+  # Offset just past the first newline at or after `offset` that is outside a
+  # quoted field, or `size` if there is none.
+  with open(path, 'rb') as f:
+    f.seek(offset)
+    position = offset
+    while position < size:
+      block = f.read(_SEEK_BLOCK)
+      if not block:
+        break
+      i = 0
+      while True:
+        newline = block.find(b'\n', i)
+        if newline < 0:
+          in_quotes ^= block.count(b'"', i) % 2 == 1
+          break
+        in_quotes ^= block.count(b'"', i, newline) % 2 == 1
+        if not in_quotes:
+          return position + newline + 1
+        i = newline + 1
+      position += len(block)
+  return size
+
+def _count_rows(path, start, end):
+  # The rows csv.reader reads from a byte range that starts at a row, counted
+  # from the bytes rather than parsed: the line ends outside quoted fields
+  # (universal newlines reads '\r\n', '\r' and '\n' as one each), plus a
+  # last row without one. Quoted stretches are masked with a regular
+  # expression, so this runs many times faster than the csv module.
+  rows = 0
+  in_quotes = False
+  last = b''
+  with open(path, 'rb') as f:
+    f.seek(start)
+    remaining = end - start
+    while remaining > 0:
+      block = f.read(min(_SCAN_BLOCK, remaining))
+      if not block:
+        break
+      while block.endswith(b'\r') and len(block) < remaining:
+        # Keep a '\r\n' in one block, so it is counted once.
+        block += f.read(1)
+      remaining -= len(block)
+      last = block[-1:]
+      outside = block
+      if in_quotes:
+        close = block.find(b'"')
+        outside = b'' if close < 0 else block[close + 1:]
+      in_quotes ^= block.count(b'"') % 2 == 1
+      # A stand-in keeps a '\r' and a '\n' around a quoted stretch apart.
+      outside = _QUOTED.sub(b'_', outside)
+      rows += outside.count(b'\n') + outside.count(b'\r') - outside.count(b'\r\n')
+  if last and (in_quotes or last not in b'\r\n'):
+    rows += 1
+  return rows
+
+def _write_range(path, start, end, first_row, count, is_last, index, delimiter, row_limit,
+                 codec, output_name_template, output_path, headers, skip_pieces=(), profile=None):
+  # Writes rows [first_row, first_row + count) of the file. Pieces that start
+  # and end inside this range are written to their final path; the others are
+  # written to a fragment for stitching. Rows of skipped pieces are read past.
+  # Returns (Piece, is_fragment) for each file written, in piece order, and
+  # the range's `profile` part, closed.
+  written = []
+  end_row = first_row + count
+  row = first_row
+  with _open_range(path, start, end) as text:
+    reader = csv.reader(text, delimiter=delimiter)
+    while row < end_row:
+      piece = row // row_limit + 1
+      piece_end = min(piece * row_limit, end_row)
+      piece_rows = itertools.islice(reader, piece_end - row)
+      if profile is not None:
+        piece_rows = profile.filter(piece_rows)
+      if piece in skip_pieces:
+        deque(piece_rows, maxlen=0)
+        row = piece_end
+        continue
+      piece_path = os.path.join(output_path, output_name_template % piece)
+      whole = row % row_limit == 0 and (piece_end == piece * row_limit or is_last)
+      if not whole:
+        piece_path = '%s.part%d' % (piece_path, index)
+      chunk = _Chunk(piece_path, delimiter, headers if row % row_limit == 0 else None, codec)
+      chunk.writerows(piece_rows)
+      chunk.close()
+      written.append((Piece(piece, piece_path, chunk.rows, chunk.raw_bytes, None, None), not whole))
+      row = piece_end
+  if profile is not None:
+    profile.close()
+  return written, profile
+
+def _write_sized_range(path, start, end, index, delimiter, target_size, size_basis, codec,
+                       output_path, headers, profile=None, row_limit=None):
+  # Writes a byte range to size-targeted pieces (or, without a `target_size`,
+  # pieces of `row_limit` rows) under temporary names and returns their Pieces
+  # in order, and the range's `profile` part, closed; parallel_split and
+  # split_files number the pieces afterwards.
+  with _open_range(path, start, end) as text:
+    written = _write_pieces(csv.reader(text, delimiter=delimiter), delimiter, headers, row_limit,
+                            target_size, size_basis, codec,
+                            lambda piece: os.path.join(output_path, '.range%d_%d.part' % (index, piece)),
+                            profile=profile)
+  if profile is not None:
+    profile.close()
+  return written, profile
+
+def _write_partitioned_range(path, start, end, index, delimiter, partitioning, row_limit, target_size,
+                             size_basis, codec, output_path, headers, profile=None):
+  # Partitions a byte range into pieces under temporary names and returns
+  # their Pieces in order, and the range's `profile` part, closed;
+  # parallel_split numbers and names the pieces afterwards.
+  with _open_range(path, start, end) as text:
+    written = _write_partitions(
+      csv.reader(text, delimiter=delimiter), delimiter, headers, partitioning, row_limit, target_size,
+      size_basis, codec, lambda label, n: os.path.join(output_path, '.range%d_%s_%d.tmp' % (index, label, n)),
+      lambda label, piece: os.path.join(output_path, '.range%d_%d.part' % (index, piece)), profile=profile)
+  if profile is not None:
+    profile.close()
+  return written, profile
 
 if __name__ == '__main__':
   largefile = 'C://Users//north//OneDrive//Documents//Snowflake//SampleData//LargeFIle.csv'
-  split(largefile)
\ No newline at end of file
+  split(largefile)
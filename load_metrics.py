@@ -0,0 +1,153 @@
+# Per-stage metrics for the load (split, PUT, COPY, MERGE) and the load steps and fetches in
+# MYTEST.py. Every unit of work (a split file, a PUT, a COPY, a fetch) is recorded as one event
+# with its stage, start time, wall time and whatever it moved: bytes, rows, files, query id,
+# retries and the time it waited in a queue before it could start. Events are appended to a
+# JSON-lines file as they happen; close() writes the run's per-stage totals as Prometheus gauges
+# in a textfile (for the node_exporter textfile collector) and the events as a Chrome trace
+# (chrome://tracing or ui.perfetto.dev), and prints a summary naming the stage that kept the run
+# busiest.
+#======================================================================================================
+import contextlib
+import json
+import os
+import threading
+import time
+
+# Totals kept per stage, with their Prometheus help text. They are the totals of one run and the
+# textfile is rewritten by every run, so they are exported as gauges, not counters.
+TOTALS = {
+    'seconds': 'Seconds spent in the stage, summed over its events',
+    'bytes': 'Bytes moved by the stage',
+    'rows': 'Rows moved by the stage',
+    'files': 'Files handled by the stage',
+    'events': 'Units of work (files, statements, fetches) done by the stage',
+    'retries': 'Statement retries in the stage',
+    'queued': 'Seconds the stage\'s work waited in a queue before it started',
+    'errors': 'Units of work that failed',
+}
+
+class StageMetrics:
+    def __init__(self, eventsFile=None, prometheusFile=None, traceFile=None, prefix='snowflake_load'):
+        self.eventsFile = eventsFile
+        self.prometheusFile = prometheusFile
+        self.traceFile = traceFile
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.totals = {}
+        self.spans = {}
+        self.events = []
+        self.threadIds = {}
+        self.started = time.time()
+
+    def record(self, stage, started, elapsed, **fields):
+
+        """
+            PURPOSE:
+                Records one unit of work of `stage` that started at `started` (time.time())
+                and took `elapsed` seconds. fields may hold bytes, rows, files, queryId,
+                retries, queued (seconds) and error; other fields are kept in the event only.
+                Thread-safe.
+        """
+        event = {'stage': stage, 'start': started, 'seconds': elapsed}
+        event.update((name, value) for name, value in fields.items() if value is not None)
+        if 'error' in event:
+            event['error'] = str(event['error'])
+        with self.lock:
+            totals = self.totals.setdefault(stage, dict.fromkeys(TOTALS, 0))
+            for name in ('seconds', 'bytes', 'rows', 'files', 'retries', 'queued'):
+                totals[name] += event.get(name) or 0
+            totals['events'] += 1
+            totals['errors'] += 'error' in event
+            first, last = self.spans.get(stage, (started, started + elapsed))
+            self.spans[stage] = (min(first, started), max(last, started + elapsed))
+            event['thread'] = self.threadIds.setdefault(threading.current_thread().name, len(self.threadIds) + 1)
+            self.events.append(event)
+            if self.eventsFile is not None:
+                with open(self.eventsFile, 'a') as f:
+                    f.write(json.dumps(event) + '\n')
+
+    @contextlib.contextmanager
+    def span(self, stage, **fields):
+        # Times the body as one event of `stage`; the body can add fields to the yielded dict.
+        started = time.time()
+        clock = time.perf_counter()
+        try:
+            yield fields
+        except Exception as e:
+            fields['error'] = e
+            raise
+        finally:
+            self.record(stage, started, time.perf_counter() - clock, **fields)
+
+    def wall_seconds(self, stage):
+        first, last = self.spans[stage]
+        return last - first
+
+    def close(self):
+        # Writes the Prometheus textfile and Chrome trace and prints the per-stage summary.
+        if self.prometheusFile is not None:
+            self.write_prometheus()
+        if self.traceFile is not None:
+            self.write_trace()
+        self.print_summary()
+
+    def print_summary(self):
+        with self.lock:
+            stages = sorted(self.totals, key=lambda stage: self.spans[stage][0])
+            if not stages:
+                return
+            for stage in stages:
+                totals = self.totals[stage]
+                wall = self.wall_seconds(stage)
+                print('{0:<8} {1:>5} events {2:>8.1f}s wall {3:>8.1f}s busy {4:>9.1f} MB {5:>7.1f} MB/s '
+                      '{6:>11} rows {7:>4} retries {8:>7.1f}s queued {9} errors'.format(
+                          stage, totals['events'], wall, totals['seconds'], totals['bytes'] / 1024 / 1024,
+                          totals['bytes'] / 1024 / 1024 / wall if wall else 0.0, totals['rows'],
+                          totals['retries'], totals['queued'], totals['errors']))
+            bottleneck = max(stages, key=self.wall_seconds)
+            print('Longest running stage: {0} ({1:.1f}s of {2:.1f}s)'.format(
+                bottleneck, self.wall_seconds(bottleneck), time.time() - self.started))
+
+    def write_prometheus(self):
+        lines = []
+        with self.lock:
+            for name, help_text in TOTALS.items():
+                metric = '{0}_stage_{1}'.format(self.prefix, name)
+                lines.append('# HELP {0} {1} in the last run.'.format(metric, help_text))
+                lines.append('# TYPE {0} gauge'.format(metric))
+                for stage, totals in sorted(self.totals.items()):
+                    lines.append('{0}{{stage="{1}"}} {2}'.format(metric, stage, totals[name]))
+            metric = '{0}_stage_wall_seconds'.format(self.prefix)
+            lines.append('# HELP {0} Seconds from the start of the stage\'s first event to the end of its last.'
+                         .format(metric))
+            lines.append('# TYPE {0} gauge'.format(metric))
+            for stage in sorted(self.totals):
+                lines.append('{0}{{stage="{1}"}} {2}'.format(metric, stage, self.wall_seconds(stage)))
+            metric = '{0}_stage_bytes_per_second'.format(self.prefix)
+            lines.append('# HELP {0} Bytes moved by the stage per second of its wall time.'.format(metric))
+            lines.append('# TYPE {0} gauge'.format(metric))
+            for stage, totals in sorted(self.totals.items()):
+                wall = self.wall_seconds(stage)
+                lines.append('{0}{{stage="{1}"}} {2}'.format(metric, stage, totals['bytes'] / wall if wall else 0))
+            metric = '{0}_last_run_timestamp_seconds'.format(self.prefix)
+            lines.append('# HELP {0} When the last run finished.'.format(metric))
+            lines.append('# TYPE {0} gauge'.format(metric))
+            lines.append('{0} {1}'.format(metric, time.time()))
+        # The textfile collector may read at any moment, so the file is replaced in one step.
+        temp_file = self.prometheusFile + '.tmp'
+        with open(temp_file, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(temp_file, self.prometheusFile)
+
+    def write_trace(self):
+        with self.lock:
+            trace = [{'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': tid, 'args': {'name': name}}
+                     for name, tid in self.threadIds.items()]
+            for event in self.events:
+                args = {name: value for name, value in event.items()
+                        if name not in ('stage', 'start', 'seconds', 'thread')}
+                trace.append({'name': event['stage'], 'cat': event['stage'], 'ph': 'X', 'pid': 1,
+                              'tid': event['thread'], 'ts': (event['start'] - self.started) * 1e6,
+                              'dur': event['seconds'] * 1e6, 'args': args})
+        with open(self.traceFile, 'w') as f:
+            json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, f)
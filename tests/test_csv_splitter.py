@@ -0,0 +1,119 @@
+import csv
+import datetime
+import decimal
+
+import pytest
+
+import csv_splitter
+
+
+def write(path, text):
+  with open(path, 'w', newline='') as f:
+    f.write(text)
+  return str(path)
+
+
+def pieces(output, function, *args, **kwargs):
+  # The rows of every piece a split writes, in piece order.
+  written = []
+  function(*args, output_path=str(output) + '/', on_chunk=written.append, **kwargs)
+  rows = []
+  for piece in sorted(written, key=lambda piece: piece.number):
+    with open(piece.path, newline='') as f:
+      rows.append(list(csv.reader(f)))
+  return rows
+
+
+@pytest.mark.parametrize('text', [
+  'a,b\n1,2\n\n3,4\n\n',
+  'a,b\r\n1,2\r\n3,"x\r\ny"\r\n4,5',
+  'a,b\n1,"\r"\n\r\n2,3\r4,5\n',
+  'a,b\n1,""""\n2,"\n\n"\n3,4',
+])
+def test_count_rows_matches_csv(tmp_path, text):
+  path = write(tmp_path / 'in.csv', text)
+  with open(path) as f:
+    expected = sum(1 for _ in csv.reader(f))
+  assert csv_splitter._count_rows(path, 0, len(text.encode())) == expected
+
+
+def test_parallel_split_blank_lines_and_no_trailing_newline(tmp_path):
+  text = 'a,b\n' + ''.join('%d,x\n%s' % (i, '\n' if i % 5 == 0 else '') for i in range(40)) + '40,"y\nz"'
+  path = write(tmp_path / 'in.csv', text)
+  (tmp_path / 'serial').mkdir()
+  (tmp_path / 'parallel').mkdir()
+  expected = pieces(tmp_path / 'serial', csv_splitter.split, path, row_limit=7)
+  assert pieces(tmp_path / 'parallel', csv_splitter.parallel_split, path, row_limit=7, workers=3) == expected
+
+
+@pytest.mark.parametrize('options', [
+  dict(row_limit=7),
+  dict(row_limit=7, compression='gzip'),
+  dict(target_size=60),
+  dict(row_limit=7, partition_by=csv_splitter.Partitioning('b', buckets=3)),
+])
+def test_parallel_split_failure_leaves_only_reported_pieces(tmp_path, options):
+  text = 'a,b\n' + ''.join('%d,%s\n' % (i, 'x' if i != 45 else 'too long') for i in range(60))
+  path = write(tmp_path / 'in.csv', text)
+  output = tmp_path / 'out'
+  output.mkdir()
+  profile = csv_splitter.Profile([('A', 'NUMBER(9,0)', False), ('B', 'VARCHAR(1)', False)])
+  reported = []
+  with pytest.raises(csv_splitter.ConformanceError) as error:
+    csv_splitter.parallel_split(path, output_path=str(output) + '/', workers=3, profile=profile,
+                                on_chunk=reported.append, **options)
+  assert error.value.row == 46
+  assert sorted(p.name for p in output.iterdir()) == sorted(piece.path.rsplit('/', 1)[1] for piece in reported)
+
+
+def test_profile_rejects_numbers_out_of_range():
+  profile = csv_splitter.Profile([('ID', 'NUMBER(38,0)', True), ('AMOUNT', 'NUMBER(5,2)', True),
+                                  ('RATIO', 'FLOAT', True)])
+  profile.start(['ID', 'AMOUNT', 'RATIO'])
+  assert profile.check(['1e400', '1.5', '1']) == ('ID', "'1e400' is not a NUMBER(38,0)")
+  assert profile.check(['1e37', '999.994', '1']) is None
+  assert profile.check(['1', '1e3', '1']) == ('AMOUNT', "'1e3' is not a NUMBER(5,2)")
+  assert profile.check(['1', '0.001e2', '1e400']) == ('RATIO', "'1e400' is out of the FLOAT range")
+  assert profile.errors == [1, 1, 1]
+
+
+def test_profile_keeps_number_extremes_exact():
+  profile = csv_splitter.Profile([('ID', 'NUMBER(38,0)', True), ('AMOUNT', 'NUMBER(38,2)', True)])
+  profile.start(['ID', 'AMOUNT'])
+  for row in (['9007199254740993', '12345678901234567890123456789012.345'], ['9007199254740992', '-0.005']):
+    assert profile.check(row) is None
+  assert profile.minimums == [9007199254740992, decimal.Decimal('-0.01')]
+  assert profile.maximums == [9007199254740993, decimal.Decimal('12345678901234567890123456789012.35')]
+
+
+def test_change_index_skips_blank_and_passes_short_rows(tmp_path):
+  path = write(tmp_path / 'in.csv', 'A,B,C\n1,ab,2024-01-01\n\n2,cd\n3\n1,ab,2024-01-01\n\n')
+  output = tmp_path / 'out'
+  output.mkdir()
+  changes = csv_splitter.ChangeIndex(str(tmp_path / 'index'), ['A', 'C'])
+  rows = pieces(output, csv_splitter.split, path, changes=changes)
+  assert rows == [[['A', 'B', 'C'], ['1', 'ab', '2024-01-01'], ['2', 'cd'], ['3']]]
+  assert (changes.inserted, changes.short, changes.duplicates) == (1, 2, 1)
+  changes.commit()
+  again = csv_splitter.ChangeIndex(str(tmp_path / 'index'), ['A', 'C'])
+  assert pieces(output, csv_splitter.split, path, changes=again) == [[['A', 'B', 'C'], ['2', 'cd'], ['3']]]
+  assert again.unchanged == 1
+
+
+def test_partitioning_by_datetime_boundaries():
+  partitioning = csv_splitter.Partitioning('TS', ranges=[datetime.datetime(2024, 1, 1, 12),
+                                                         datetime.date(2024, 2, 1)])
+  assert partitioning.bucket('2023-12-31 23:59:59') == 'r00'
+  assert partitioning.bucket('2024-01-01') == 'r00'
+  assert partitioning.bucket('2024-01-01T12:00:00+02:00') == 'r01'
+  assert partitioning.bucket('31-Jan-2024') == 'r01'
+  assert partitioning.bucket('2024-02-01 00:00:00.001') == 'r02'
+  assert partitioning.bucket('soon') == 'other'
+  assert partitioning.bucket('') == 'null'
+
+
+def test_partitioning_by_date_and_number_boundaries():
+  by_date = csv_splitter.Partitioning(0, ranges=[datetime.date(2024, 1, 1)])
+  assert [by_date.bucket(value) for value in ('2023-12-31', '2024-01-01 08:00', 'x')] == ['r00', 'r01', 'other']
+  by_number = csv_splitter.Partitioning(0, ranges=[10, 1e3])
+  assert [by_number.bucket(value) for value in ('9.5', '10', '1e400', 'x')] == ['r00', 'r01', 'r02', 'other']
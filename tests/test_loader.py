@@ -0,0 +1,87 @@
+import pytest
+
+pytest.importorskip('snowflake.connector')
+
+import csv_splitter
+import MultiThreadBulkLoad_V1 as loader
+
+
+def statement_result(elapsed=1.0, attempts=1, queued=0.0):
+    result = loader.sfStatementResult('COPY INTO T')
+    result.elapsed = elapsed
+    result.attempts = attempts
+    result.warehouseQueued = queued
+    return result
+
+
+def run_round(limit, **result):
+    # Runs `limit.limit` statements at once and releases them with the same result.
+    tickets = [limit.acquire() for _ in range(limit.limit)]
+    for ticket in tickets:
+        limit.release(statement_result(**result), units=100, ticket=ticket)
+
+
+def test_concurrency_limit_rises_while_throughput_grows_and_backs_off():
+    limit = loader.sfConcurrencyLimit('COPY', initial=2, maximum=4)
+    run_round(limit)
+    assert limit.limit == 3
+    run_round(limit)
+    assert limit.limit == 4
+    run_round(limit)
+    assert limit.limit == 4
+    run_round(limit, attempts=2)
+    assert limit.limit == 2
+    run_round(limit, queued=0.5)
+    assert limit.limit == 1
+    assert limit.history == [2, 3, 4, 2, 1]
+
+
+def test_concurrency_limit_ignores_statements_started_under_an_earlier_limit():
+    limit = loader.sfConcurrencyLimit('PUT', initial=1)
+    old = limit.acquire()
+    limit.release(statement_result(), units=100, ticket=old)
+    assert limit.limit == 2
+    stale = limit.acquire()
+    limit.epoch += 1
+    limit.release(statement_result(attempts=3), units=100, ticket=stale)
+    assert limit.limit == 2 and limit.round == [] and limit.running == 0
+
+
+def write_piece(directory, number, text):
+    path = directory / 'output_{0}.csv'.format(number)
+    path.write_text(text)
+    return csv_splitter.Piece(number, str(path), text.count('\n'), len(text), None, None)
+
+
+def test_load_manifest_resumes_where_the_last_run_stopped(tmp_path):
+    path = str(tmp_path / 'load_manifest.jsonl')
+    signature = {'largefile': 'big.csv', 'size': 100}
+    manifest = loader.sfLoadManifest(path, signature)
+    first, second = write_piece(tmp_path, 1, 'a\n'), write_piece(tmp_path, 2, 'b\n')
+    manifest.chunk_split(first, 'digest1')
+    manifest.chunk_split(second, 'digest2')
+    manifest.split_done()
+    manifest.mark(['output_1.csv'], 'uploaded')
+    manifest.mark(['output_1.csv'], 'copied', queryId='q1')
+    manifest.mark(['output_2.csv'], 'uploaded')
+    with open(path, 'a') as f:
+        f.write('{"name": "output_2.csv", "sta')
+
+    resumed = loader.sfLoadManifest(path, signature)
+    assert resumed.runId == manifest.runId
+    assert resumed.names('copied') == ['output_1.csv']
+    assert resumed.names('uploaded') == ['output_2.csv']
+    assert resumed.staged_pieces() == {1, 2}
+    assert resumed.is_staged('output_2.csv', 'digest2') and not resumed.is_staged('output_2.csv', 'other')
+    assert not resumed.split_needed() and not resumed.complete()
+    resumed.mark(['output_2.csv'], 'copied')
+    assert resumed.complete()
+
+
+def test_load_manifest_starts_over_for_other_settings(tmp_path):
+    path = str(tmp_path / 'load_manifest.jsonl')
+    manifest = loader.sfLoadManifest(path, {'largefile': 'big.csv', 'workers': 1})
+    manifest.chunk_split(write_piece(tmp_path, 1, 'a\n'), 'digest1')
+    other = loader.sfLoadManifest(path, {'largefile': 'big.csv', 'workers': 4})
+    assert other.runId != manifest.runId
+    assert other.chunks == {} and other.split_needed()